@@ -0,0 +1,128 @@
+import os
+import math
+import time
+import uuid
+import sqlite3
+import threading
+
+# Retry-After given when a request is turned away for an in-flight limit
+INFLIGHT_RETRY_SECONDS = 2
+# How long a write transaction waits for another process to finish its own
+LOCK_TIMEOUT_SECONDS = 5
+
+
+class AdmissionControl:
+    """
+    Decides whether a request that queues a PDF job is let in. Each user has
+    a token bucket for the request rate, and every admitted job holds an
+    in-flight slot, per user and overall, until release() is called when the
+    job finishes. State lives in a SQLite file under UPLOAD_FOLDER, so every
+    web process on the host enforces the same limits; each check is a single
+    short write transaction. Slots not released within ADMISSION_SLOT_TTL_SECONDS,
+    e.g. because their process was killed, are dropped.
+    """
+
+    def __init__(self, app=None):
+        self.path = None
+        self.user_inflight = None
+        self.global_inflight = None
+        self.rate_per_second = None
+        self.burst = None
+        self.slot_ttl_seconds = None
+        self._local = threading.local()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.path = os.path.join(app.config['UPLOAD_FOLDER'], 'admission.sqlite')
+        self.user_inflight = app.config['ADMISSION_USER_INFLIGHT']
+        self.global_inflight = app.config['ADMISSION_GLOBAL_INFLIGHT']
+        self.rate_per_second = app.config['ADMISSION_RATE_PER_MINUTE'] / 60
+        self.burst = app.config['ADMISSION_BURST']
+        self.slot_ttl_seconds = app.config['ADMISSION_SLOT_TTL_SECONDS']
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+
+        connection = sqlite3.connect(self.path, timeout=LOCK_TIMEOUT_SECONDS)
+        try:
+            # WAL lets status reads of other processes go on during a write
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute(
+                'CREATE TABLE IF NOT EXISTS inflight ('
+                'slot TEXT PRIMARY KEY, user_id INTEGER NOT NULL, expires_at REAL NOT NULL)'
+            )
+            connection.execute('CREATE INDEX IF NOT EXISTS ix_inflight_user ON inflight (user_id)')
+            connection.execute(
+                'CREATE TABLE IF NOT EXISTS buckets ('
+                'user_id INTEGER PRIMARY KEY, tokens REAL NOT NULL, updated_at REAL NOT NULL)'
+            )
+            connection.commit()
+        finally:
+            connection.close()
+
+    def _connection(self):
+        # sqlite3 connections can't be shared between threads
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=LOCK_TIMEOUT_SECONDS, isolation_level=None)
+            self._local.connection = connection
+        return connection
+
+    def acquire(self, user_id):
+        """
+        Take an in-flight slot and a rate token for a user
+        Args:
+            user_id: ID of the user
+        Returns:
+            Tuple of (slot, retry_after): the slot ID, to be used as the job ID
+            and passed to release(), and None; or None and the whole seconds
+            to wait before retrying
+        """
+        now = time.time()
+        connection = self._connection()
+        # Taken before reading so concurrent requests can't both see a free slot
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            connection.execute('DELETE FROM inflight WHERE expires_at <= ?', (now,))
+
+            if self.global_inflight:
+                total, = connection.execute('SELECT COUNT(*) FROM inflight').fetchone()
+                if total >= self.global_inflight:
+                    connection.execute('COMMIT')
+                    return None, INFLIGHT_RETRY_SECONDS
+            if self.user_inflight:
+                count, = connection.execute(
+                    'SELECT COUNT(*) FROM inflight WHERE user_id = ?', (user_id,)
+                ).fetchone()
+                if count >= self.user_inflight:
+                    connection.execute('COMMIT')
+                    return None, INFLIGHT_RETRY_SECONDS
+
+            if self.rate_per_second:
+                row = connection.execute(
+                    'SELECT tokens, updated_at FROM buckets WHERE user_id = ?', (user_id,)
+                ).fetchone()
+                tokens = self.burst if row is None else min(
+                    self.burst, row[0] + (now - row[1]) * self.rate_per_second
+                )
+                if tokens < 1:
+                    connection.execute('COMMIT')
+                    return None, math.ceil((1 - tokens) / self.rate_per_second)
+                connection.execute(
+                    'INSERT OR REPLACE INTO buckets (user_id, tokens, updated_at) VALUES (?, ?, ?)',
+                    (user_id, tokens - 1, now)
+                )
+
+            slot = uuid.uuid4().hex
+            connection.execute(
+                'INSERT INTO inflight (slot, user_id, expires_at) VALUES (?, ?, ?)',
+                (slot, user_id, now + self.slot_ttl_seconds)
+            )
+            connection.execute('COMMIT')
+            return slot, None
+        except Exception:
+            connection.execute('ROLLBACK')
+            raise
+
+    def release(self, slot):
+        """Free an in-flight slot; releasing one that is gone does nothing"""
+        self._connection().execute('DELETE FROM inflight WHERE slot = ?', (slot,))
@@ -1,17 +1,29 @@
 import os
 import io
+import json
+import hmac
+import base64
 import stripe
-from flask import Flask, render_template, request, jsonify, send_file, redirect, url_for, flash, session
+from functools import wraps
+from flask import Flask, render_template, request, jsonify, send_file, send_from_directory, redirect, url_for, flash, session, g, make_response
 from flask_login import LoginManager, login_user, logout_user, login_required, current_user
 from flask_cors import CORS
 from werkzeug.utils import secure_filename
 from datetime import datetime
-from models import db, User, PDFOperation
-from pdf_utils import PDFProcessor
+from models import db, ensure_schema, User, PDFOperation, Job
 from config import Config
+from jobs import JobQueue
+from metrics import metrics
+from user_cache import UserCache
+from pdf_utils import PDFProcessor
+from image_compression import COMPRESSION_LEVELS
+from preflight import preflight
+from upload_spool import SpooledUploadRequest
+from rollups import ensure_rollups, get_dashboard_stats, increment_counter, rebuild_rollups, tier_changed
 
 app = Flask(__name__)
 app.config.from_object(Config)
+app.request_class = SpooledUploadRequest
 
 # Initialize extensions
 db.init_app(app)
@@ -22,9 +34,21 @@ login_manager.login_view = 'login'
 
 # Initialize Stripe
 stripe.api_key = app.config['STRIPE_SECRET_KEY']
+if app.config['STRIPE_API_BASE']:
+    stripe.api_base = app.config['STRIPE_API_BASE']
 
-# Create upload folder
+# Create upload and spool folders
 os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
+os.makedirs(app.config['SPOOL_FOLDER'], exist_ok=True)
+
+# Request and PDF operation metrics, served on /metrics
+metrics.init_app(app)
+
+# Initialize background job queue
+job_queue = JobQueue(app)
+
+# Cache user identity for login_manager.user_loader
+user_cache = UserCache(app)
 
 
 # Make datetime available to all templates
@@ -35,7 +59,7 @@ def inject_now():
 
 @login_manager.user_loader
 def load_user(user_id):
-    return User.query.get(int(user_id))
+    return user_cache.load(int(user_id))
 
 
 def allowed_file(filename, allowed_types=None):
@@ -44,6 +68,103 @@ def allowed_file(filename, allowed_types=None):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in allowed_types
 
 
+def parse_page_ranges(text):
+    """Parse '1-3, 5' into [(1, 3), (5, 5)]"""
+    page_ranges = []
+    for part in text.split(','):
+        part = part.strip()
+        if not part:
+            continue
+        start, _, end = part.partition('-')
+        start = int(start)
+        end = int(end) if end else start
+        if start < 1 or end < start:
+            raise ValueError(f"Invalid page range: {part}")
+        page_ranges.append((start, end))
+
+    if not page_ranges:
+        raise ValueError("No page ranges given")
+    return page_ranges
+
+
+def check_pdfs(files, operation_type):
+    """
+    Preflight uploaded PDFs before they are queued
+    Args:
+        files: Uploaded file objects
+        operation_type: Operation the files are for
+    Returns:
+        (list of preflight results, error message or None)
+    """
+    results = []
+    for file in files:
+        result = preflight(file.stream, operation_type)
+        if result['error']:
+            return results, f"{file.filename}: {result['error']}"
+        results.append(result)
+    return results, None
+
+
+def encode_cursor(operation):
+    """Opaque pagination cursor pointing just past an operation"""
+    key = f'{operation.created_at.isoformat()}|{operation.id}'
+    return base64.urlsafe_b64encode(key.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """Turn a cursor back into (created_at, id); raises ValueError if it is malformed"""
+    # binascii.Error and UnicodeDecodeError are ValueErrors too
+    key = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode()
+    created_at, _, operation_id = key.partition('|')
+    return datetime.fromisoformat(created_at), int(operation_id)
+
+
+def is_admin(user):
+    # Simple admin check (you can add a proper role system)
+    return user.is_authenticated and user.email == 'admin@pdftoolkit.com'  # Change this to your admin email
+
+
+def profile_requested():
+    """Admins can have a job profiled by sending profile=1 with the upload"""
+    return request.form.get('profile') == '1' and is_admin(current_user)
+
+
+def admission_required(view):
+    """
+    Admission control for routes that queue a job. A POST takes an in-flight
+    slot and a rate token before the upload is read, and gets a 429 with
+    Retry-After if there are none; the slot becomes the job's ID and is freed
+    when the job finishes, or right away if no job was queued.
+    """
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        if request.method != 'POST':
+            return view(*args, **kwargs)
+
+        slot, retry_after = job_queue.admission.acquire(current_user.id)
+        if slot is None:
+            response = jsonify({'error': 'Too many requests. Please wait for your running jobs to finish.'})
+            response.headers['Retry-After'] = str(retry_after)
+            return response, 429
+
+        g.admission_slot = slot
+        response = None
+        try:
+            response = make_response(view(*args, **kwargs))
+        finally:
+            if response is None or response.status_code != 202:
+                job_queue.admission.release(slot)
+        return response
+    return wrapper
+
+
+def job_response(job, status=202):
+    data = job.to_dict()
+    data['status_url'] = url_for('api_job_status', job_id=job.id)
+    data['result_url'] = url_for('api_job_result', job_id=job.id)
+    return jsonify(data), status
+
+
 # ==================== ROUTES ====================
 
 @app.route('/')
@@ -67,6 +188,7 @@ def register():
         user = User(email=email)
         user.set_password(password)
         db.session.add(user)
+        increment_counter('total_users')
         db.session.commit()
 
         login_user(user)
@@ -107,14 +229,16 @@ def logout():
 @app.route('/dashboard')
 @login_required
 def dashboard():
-    operations = PDFOperation.query.filter_by(user_id=current_user.id).order_by(PDFOperation.created_at.desc()).limit(10).all()
-    return render_template('dashboard.html', user=current_user, operations=operations)
+    operations, has_more = PDFOperation.history_page(current_user.id, 10)
+    next_cursor = encode_cursor(operations[-1]) if has_more else None
+    return render_template('dashboard.html', user=current_user, operations=operations, next_cursor=next_cursor)
 
 
 # ==================== PDF OPERATIONS ====================
 
 @app.route('/merge', methods=['GET', 'POST'])
 @login_required
+@admission_required
 def merge_pdfs():
     if request.method == 'GET':
         return render_template('merge.html', user=current_user)
@@ -133,25 +257,16 @@ def merge_pdfs():
             if not file or not allowed_file(file.filename, {'pdf'}):
                 return jsonify({'error': 'Invalid file type. Only PDF files are allowed.'}), 400
 
-        # Process merge
-        merged_pdf = PDFProcessor.merge_pdfs(files)
+        checks, error = check_pdfs(files, 'merge')
+        if error:
+            return jsonify({'error': error}), 400
 
-        # Log operation
-        operation = PDFOperation(
-            user_id=current_user.id,
-            operation_type='merge',
-            file_count=len(files)
-        )
-        db.session.add(operation)
-        current_user.increment_usage()
-
-        # Return file
-        return send_file(
-            merged_pdf,
-            mimetype='application/pdf',
-            as_attachment=True,
-            download_name=f'merged_{datetime.now().strftime("%Y%m%d_%H%M%S")}.pdf'
+        # Queue merge
+        job = job_queue.submit(
+            current_user, 'merge', files, profile=profile_requested(),
+            cost_ms=sum(check['cost_ms'] for check in checks), job_id=g.admission_slot
         )
+        return job_response(job)
 
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -159,6 +274,7 @@ def merge_pdfs():
 
 @app.route('/split', methods=['GET', 'POST'])
 @login_required
+@admission_required
 def split_pdf():
     if request.method == 'GET':
         return render_template('split.html', user=current_user)
@@ -171,31 +287,30 @@ def split_pdf():
         return jsonify({'error': 'Please upload a valid PDF file'}), 400
 
     try:
+        checks, error = check_pdfs([file], 'split')
+        if error:
+            return jsonify({'error': error}), 400
+
         # Get split options
         split_type = request.form.get('split_type', 'all')
 
-        if split_type == 'all':
-            # Split each page
-            outputs = PDFProcessor.split_pdf(file)
-        else:
-            # Custom page ranges (not implemented in this version for simplicity)
-            outputs = PDFProcessor.split_pdf(file)
-
-        # For simplicity, return first split page (you can extend to zip multiple)
-        operation = PDFOperation(
-            user_id=current_user.id,
-            operation_type='split',
-            file_count=len(outputs)
-        )
-        db.session.add(operation)
-        current_user.increment_usage()
-
-        return send_file(
-            outputs[0],
-            mimetype='application/pdf',
-            as_attachment=True,
-            download_name=f'split_page_1_{datetime.now().strftime("%Y%m%d_%H%M%S")}.pdf'
+        params = {}
+        if split_type == 'ranges':
+            try:
+                params['page_ranges'] = parse_page_ranges(request.form.get('page_ranges', ''))
+            except ValueError:
+                return jsonify({'error': 'Please enter page ranges like 1-3, 5'}), 400
+
+            pages = checks[0]['pages']
+            # Ranges past the end are skipped, so at least one has to start inside the document
+            if pages is not None and min(start for start, _ in params['page_ranges']) > pages:
+                return jsonify({'error': f'The PDF has only {pages} pages'}), 400
+
+        job = job_queue.submit(
+            current_user, 'split', [file], params, profile=profile_requested(),
+            cost_ms=checks[0]['cost_ms'], job_id=g.admission_slot
         )
+        return job_response(job)
 
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -203,6 +318,7 @@ def split_pdf():
 
 @app.route('/compress', methods=['GET', 'POST'])
 @login_required
+@admission_required
 def compress_pdf():
     if request.method == 'GET':
         return render_template('compress.html', user=current_user)
@@ -215,23 +331,20 @@ def compress_pdf():
         return jsonify({'error': 'Please upload a valid PDF file'}), 400
 
     try:
+        # Checked here, as it becomes part of the result cache key
         quality = request.form.get('quality', 'medium')
-        compressed_pdf = PDFProcessor.compress_pdf(file, quality)
+        if quality not in COMPRESSION_LEVELS:
+            return jsonify({'error': 'Invalid compression quality'}), 400
 
-        operation = PDFOperation(
-            user_id=current_user.id,
-            operation_type='compress',
-            file_count=1
-        )
-        db.session.add(operation)
-        current_user.increment_usage()
-
-        return send_file(
-            compressed_pdf,
-            mimetype='application/pdf',
-            as_attachment=True,
-            download_name=f'compressed_{datetime.now().strftime("%Y%m%d_%H%M%S")}.pdf'
+        checks, error = check_pdfs([file], 'compress')
+        if error:
+            return jsonify({'error': error}), 400
+
+        job = job_queue.submit(
+            current_user, 'compress', [file], {'quality': quality}, profile=profile_requested(),
+            cost_ms=checks[0]['cost_ms'], job_id=g.admission_slot
         )
+        return job_response(job)
 
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -239,6 +352,7 @@ def compress_pdf():
 
 @app.route('/convert', methods=['GET', 'POST'])
 @login_required
+@admission_required
 def convert_to_pdf():
     if request.method == 'GET':
         return render_template('convert.html', user=current_user)
@@ -256,23 +370,17 @@ def convert_to_pdf():
             if not file or not allowed_file(file.filename, {'png', 'jpg', 'jpeg'}):
                 return jsonify({'error': 'Invalid file type. Only PNG, JPG, JPEG are allowed.'}), 400
 
-        # Convert images to PDF
-        pdf_output = PDFProcessor.image_to_pdf(files)
+        # Resolution large images are scaled down to; 'original' keeps every pixel
+        dpi = request.form.get('dpi', '150')
+        if dpi not in ('150', '300', 'original'):
+            return jsonify({'error': 'Invalid image resolution'}), 400
 
-        operation = PDFOperation(
-            user_id=current_user.id,
-            operation_type='convert',
-            file_count=len(files)
-        )
-        db.session.add(operation)
-        current_user.increment_usage()
-
-        return send_file(
-            pdf_output,
-            mimetype='application/pdf',
-            as_attachment=True,
-            download_name=f'converted_{datetime.now().strftime("%Y%m%d_%H%M%S")}.pdf'
+        # Queue image conversion
+        params = {'dpi': None if dpi == 'original' else int(dpi)}
+        job = job_queue.submit(
+            current_user, 'convert', files, params, profile=profile_requested(), job_id=g.admission_slot
         )
+        return job_response(job)
 
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -332,13 +440,17 @@ def subscription_success():
             subscription = stripe.Subscription.retrieve(session.subscription)
             price_id = subscription['items']['data'][0]['price']['id']
 
+            old_tier = current_user.subscription_tier
             if price_id == app.config['STRIPE_PRICE_BASIC']:
                 current_user.subscription_tier = 'basic'
             elif price_id == app.config['STRIPE_PRICE_PRO']:
                 current_user.subscription_tier = 'pro'
 
             current_user.subscription_status = 'active'
+            tier_changed(old_tier, current_user.subscription_tier)
             db.session.commit()
+            # Again after the commit, in case a concurrent request re-cached the old tier
+            user_cache.invalidate(current_user.id)
 
             flash('Subscription successful! Welcome to your new plan.', 'success')
 
@@ -367,15 +479,18 @@ def stripe_webhook():
             if user:
                 user.subscription_status = subscription['status']
                 db.session.commit()
+                user_cache.invalidate(user.id)
 
         elif event['type'] == 'customer.subscription.deleted':
             subscription = event['data']['object']
             user = User.query.filter_by(stripe_subscription_id=subscription['id']).first()
 
             if user:
+                tier_changed(user.subscription_tier, 'free')
                 user.subscription_tier = 'free'
                 user.subscription_status = 'canceled'
                 db.session.commit()
+                user_cache.invalidate(user.id)
 
         return jsonify({'status': 'success'}), 200
 
@@ -388,25 +503,44 @@ def stripe_webhook():
 @app.route('/admin')
 @login_required
 def admin():
-    # Simple admin check (you can add a proper role system)
-    if current_user.email != 'admin@pdftoolkit.com':  # Change this to your admin email
+    if not is_admin(current_user):
         flash('Access denied', 'error')
         return redirect(url_for('dashboard'))
 
-    total_users = User.query.count()
-    total_operations = PDFOperation.query.count()
-    paid_users = User.query.filter(User.subscription_tier != 'free').count()
+    # Counters and per-day totals come from the rollup tables, not full scans
+    stats = get_dashboard_stats()
+    # Uses the created_at index
+    stats['operations'] = PDFOperation.query.order_by(PDFOperation.created_at.desc()).limit(20).all()
+    stats['cache'] = job_queue.result_cache.stats()
+    stats['profiles'] = job_queue.profiles.list()
 
-    recent_operations = PDFOperation.query.order_by(PDFOperation.created_at.desc()).limit(20).all()
+    return render_template('admin.html', stats=stats)
 
-    stats = {
-        'total_users': total_users,
-        'paid_users': paid_users,
-        'total_operations': total_operations,
-        'operations': recent_operations
-    }
 
-    return render_template('admin.html', stats=stats)
+@app.route('/admin/profiles/<filename>')
+@login_required
+def admin_profile_download(filename):
+    if not is_admin(current_user):
+        flash('Access denied', 'error')
+        return redirect(url_for('dashboard'))
+
+    if not filename.endswith(('.prof', '.txt')):
+        return jsonify({'error': 'Profile not found'}), 404
+
+    # send_from_directory refuses names that escape the directory
+    return send_from_directory(job_queue.profiles.profile_dir, filename, as_attachment=True)
+
+
+# ==================== METRICS ====================
+
+@app.route('/metrics')
+def metrics_endpoint():
+    """Prometheus scrape endpoint, merged across all web processes"""
+    token = app.config['METRICS_TOKEN']
+    if token and not hmac.compare_digest(request.headers.get('Authorization', '').encode(), f'Bearer {token}'.encode()):
+        return 'Unauthorized', 401
+
+    return metrics.render(), 200, {'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'}
 
 
 # ==================== API ENDPOINTS ====================
@@ -416,18 +550,107 @@ def admin():
 def api_usage():
     """Get current usage stats for the user"""
     return jsonify({
-        'usage_count': current_user.usage_count,
+        'usage_count': current_user.get_usage_count(),
         'usage_limit': current_user.get_usage_limit(),
         'subscription_tier': current_user.subscription_tier,
         'can_perform': current_user.can_perform_operation()
     })
 
 
+@app.route('/api/operations')
+@login_required
+def api_operations():
+    """
+    Get the user's operation history, newest first.
+    Pass the returned next_cursor as ?cursor= to get the following page.
+    """
+    try:
+        limit = int(request.args.get('limit', 20))
+        before = decode_cursor(request.args['cursor']) if request.args.get('cursor') else None
+    except ValueError:
+        return jsonify({'error': 'Invalid limit or cursor'}), 400
+    limit = max(1, min(limit, 100))
+
+    operations, has_more = PDFOperation.history_page(current_user.id, limit, before)
+    return jsonify({
+        'operations': [operation.to_dict() for operation in operations],
+        'next_cursor': encode_cursor(operations[-1]) if has_more else None
+    })
+
+
+@app.route('/api/pipeline', methods=['POST'])
+@login_required
+@admission_required
+def api_pipeline():
+    """
+    Queue several operations on one PDF, e.g. extract then rotate then compress.
+    Expects a 'file' upload and a 'steps' form field holding a JSON list of steps.
+    """
+    if not current_user.can_perform_operation():
+        return jsonify({'error': 'Usage limit reached. Please upgrade your plan.'}), 403
+
+    file = request.files.get('file')
+    if not file or not allowed_file(file.filename, {'pdf'}):
+        return jsonify({'error': 'Please upload a valid PDF file'}), 400
+
+    try:
+        steps = PDFProcessor.validate_pipeline(json.loads(request.form.get('steps', '')))
+    except ValueError as e:
+        # json.JSONDecodeError is a ValueError too
+        return jsonify({'error': f'Invalid steps: {str(e)}'}), 400
+
+    try:
+        # Recompressing images dominates a pipeline's cost when it has that step
+        compresses = any(step['op'] == 'compress' for step in steps)
+        checks, error = check_pdfs([file], 'compress' if compresses else 'pipeline')
+        if error:
+            return jsonify({'error': error}), 400
+
+        job = job_queue.submit(
+            current_user, 'pipeline', [file], {'steps': steps}, profile=profile_requested(),
+            cost_ms=checks[0]['cost_ms'], job_id=g.admission_slot
+        )
+        return job_response(job)
+
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+
+@app.route('/api/jobs/<job_id>')
+@login_required
+def api_job_status(job_id):
+    """Get the status of a queued PDF operation"""
+    job = Job.query.filter_by(id=job_id, user_id=current_user.id).first()
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+
+    return job_response(job, 200)
+
+
+@app.route('/api/jobs/<job_id>/result')
+@login_required
+def api_job_result(job_id):
+    """Download the output of a finished PDF operation"""
+    job = Job.query.filter_by(id=job_id, user_id=current_user.id).first()
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+
+    if job.status != 'done':
+        return jsonify({'error': f'Job is {job.status}', 'status': job.status}), 409
+
+    return send_file(
+        os.path.abspath(job_queue.result_path(job.id)),
+        mimetype=job.result_mimetype,
+        as_attachment=True,
+        download_name=job.result_name
+    )
+
+
 # ==================== ERROR HANDLERS ====================
 
 @app.errorhandler(413)
 def request_entity_too_large(error):
-    return jsonify({'error': 'File too large. Maximum size is 10MB.'}), 413
+    return jsonify({'error': f"File too large. Maximum size is {app.config['MAX_FILE_SIZE_MB']}MB."}), 413
 
 
 @app.errorhandler(404)
@@ -446,14 +669,31 @@ def internal_error(error):
 def init_db():
     """Initialize the database"""
     with app.app_context():
-        db.create_all()
+        ensure_schema()
+        ensure_rollups()
         print("Database initialized successfully!")
 
 
-# Initialize database tables on startup (works in both dev and production)
-with app.app_context():
-    db.create_all()
-    print("Database tables created/verified!")
+@app.cli.command('init-db')
+def init_db_command():
+    """Create missing tables, columns and indexes and backfill the rollups"""
+    init_db()
+
+
+@app.cli.command('rebuild-rollups')
+def rebuild_rollups_command():
+    """Recompute the admin dashboard rollups from pdf_operations"""
+    with app.app_context():
+        count = rebuild_rollups()
+    print(f"Rebuilt {count} rollup rows")
+
+
+# Initialize database tables on startup, unless a release step runs `flask init-db`
+if app.config['INIT_DB_ON_STARTUP']:
+    with app.app_context():
+        ensure_schema()
+        ensure_rollups()
+        print("Database tables created/verified!")
 
 
 if __name__ == '__main__':
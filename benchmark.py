@@ -0,0 +1,380 @@
+"""
+Benchmark PDFProcessor on generated corpora.
+
+Generates reproducible test documents (long text documents, image-heavy
+scans, font-heavy text, many small files for merge, large JPEG/PNG sets),
+times every PDFProcessor operation on them and records wall time, peak
+Python memory and output size as JSON. Results can be compared against a
+stored baseline; the script exits with status 1 on a regression.
+
+Usage:
+    python benchmark.py                                  # run and print results
+    python benchmark.py --save-baseline benchmark_baseline.json
+    python benchmark.py --baseline benchmark_baseline.json
+    python benchmark.py --scale large --only merge,compress --repeat 5
+"""
+import os
+import io
+import sys
+import json
+import time
+import random
+import argparse
+import platform
+import statistics
+import tracemalloc
+from datetime import datetime
+from PIL import Image, ImageDraw, ImageFilter
+import reportlab
+from reportlab.pdfgen import canvas
+from reportlab.lib.pagesizes import letter
+from reportlab.lib.utils import ImageReader
+from reportlab.pdfbase import pdfmetrics
+from reportlab.pdfbase.ttfonts import TTFont
+import PyPDF2
+from pdf_utils import PDFProcessor
+from preflight import preflight
+
+# Bump when the generators change so stale corpora are rebuilt
+CORPUS_VERSION = 1
+
+# Corpus size for each scale
+SCALES = {
+    'small': {
+        'text_pages': 60, 'scan_pages': 4, 'scan_size': (1275, 1650), 'font_pages': 10,
+        'merge_files': 20, 'merge_file_pages': 2, 'images': 4, 'image_size': (2400, 1800)
+    },
+    'medium': {
+        'text_pages': 400, 'scan_pages': 12, 'scan_size': (2550, 3300), 'font_pages': 60,
+        'merge_files': 100, 'merge_file_pages': 3, 'images': 10, 'image_size': (4000, 3000)
+    },
+    'large': {
+        'text_pages': 2000, 'scan_pages': 40, 'scan_size': (2550, 3300), 'font_pages': 300,
+        'merge_files': 400, 'merge_file_pages': 3, 'images': 30, 'image_size': (6000, 4000)
+    }
+}
+
+# Default regression thresholds, as a fraction over the baseline
+THRESHOLDS = {
+    'wall_seconds': 0.20,
+    'peak_memory_mb': 0.20,
+    'output_bytes': 0.05
+}
+
+WORDS = (
+    'lorem ipsum dolor sit amet consectetur adipiscing elit sed do eiusmod tempor '
+    'incididunt ut labore et dolore magna aliqua invoice total quarterly report '
+    'revenue shipment contract signature appendix schedule'
+).split()
+
+FONTS = ('Vera', 'VeraBd', 'VeraIt', 'VeraBI')
+
+
+# ==================== CORPUS GENERATION ====================
+
+def _sentence(rng, words=12):
+    return ' '.join(rng.choice(WORDS) for _ in range(words)).capitalize() + '.'
+
+
+def _noise(rng, size):
+    # Drawn from rng rather than Image.effect_noise so the corpus is reproducible
+    return Image.frombytes('L', size, rng.randbytes(size[0] * size[1]))
+
+
+def _photo(rng, size):
+    """Noisy, smoothly varying image that compresses like a photo"""
+    small = _noise(rng, (max(1, size[0] // 16), max(1, size[1] // 16)))
+    base = Image.merge('RGB', [
+        small.point(lambda v, shift=shift: (v + shift) % 256) for shift in rng.sample(range(256), 3)
+    ]).resize(size, Image.BICUBIC)
+    grain = _noise(rng, size).convert('RGB')
+    photo = Image.blend(base, grain, 0.1)
+
+    draw = ImageDraw.Draw(photo)
+    for _ in range(12):
+        x, y = rng.randrange(size[0]), rng.randrange(size[1])
+        radius = rng.randrange(size[0] // 20, size[0] // 6)
+        color = tuple(rng.randrange(256) for _ in range(3))
+        draw.ellipse((x - radius, y - radius, x + radius, y + radius), fill=color)
+    return photo.filter(ImageFilter.GaussianBlur(2))
+
+
+def _text_pdf(path, rng, pages):
+    c = canvas.Canvas(path, pagesize=letter, invariant=1)
+    for page in range(1, pages + 1):
+        c.setFont('Helvetica-Bold', 16)
+        c.drawString(72, 740, f'Section {page}')
+        c.setFont('Helvetica', 10)
+        for line in range(55):
+            c.drawString(72, 715 - line * 12, _sentence(rng))
+        c.showPage()
+    c.save()
+
+
+def _scan_pdf(path, rng, pages, size):
+    c = canvas.Canvas(path, pagesize=letter, invariant=1)
+    width, height = letter
+    for _ in range(pages):
+        scan = io.BytesIO()
+        _photo(rng, size).save(scan, 'JPEG', quality=92)
+        scan.seek(0)
+        c.drawImage(ImageReader(scan), 0, 0, width, height)
+        c.showPage()
+    c.save()
+
+
+def _font_pdf(path, rng, pages):
+    for name in FONTS:
+        if name not in pdfmetrics.getRegisteredFontNames():
+            pdfmetrics.registerFont(TTFont(name, f'{name}.ttf'))
+
+    # Every printable Latin-1 character so the embedded subsets are large
+    charset = ''.join(chr(code) for code in range(0x21, 0x7f)) + ''.join(chr(code) for code in range(0xa1, 0x100))
+    c = canvas.Canvas(path, pagesize=letter, invariant=1)
+    for _ in range(pages):
+        y = 740
+        while y > 60:
+            c.setFont(rng.choice(FONTS), rng.choice((8, 9, 10, 12, 14)))
+            start = rng.randrange(len(charset) - 60)
+            c.drawString(72, y, charset[start:start + 60] + ' ' + _sentence(rng, 4))
+            y -= 16
+        c.showPage()
+    c.save()
+
+
+def _image_files(directory, rng, count, size, extension):
+    os.makedirs(directory, exist_ok=True)
+    paths = []
+    for index in range(count):
+        path = os.path.join(directory, f'image_{index:03d}.{extension}')
+        image = _photo(rng, size)
+        if extension == 'png':
+            image.save(path, 'PNG')
+        else:
+            image.save(path, 'JPEG', quality=90)
+        paths.append(path)
+    return paths
+
+
+def build_corpus(directory, scale, seed):
+    """
+    Generate the corpus for a scale, or reuse it if it already exists
+    Returns:
+        Dictionary of corpus name -> path or list of paths
+    """
+    params = SCALES[scale]
+    corpus_dir = os.path.join(directory, f'{scale}-{seed}')
+    manifest_path = os.path.join(corpus_dir, 'manifest.json')
+
+    if os.path.exists(manifest_path):
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+        if manifest.get('version') == CORPUS_VERSION:
+            return manifest['files']
+
+    print(f'Generating {scale} corpus in {corpus_dir}...')
+    os.makedirs(corpus_dir, exist_ok=True)
+    rng = random.Random(seed)
+
+    files = {
+        'text': os.path.join(corpus_dir, 'text.pdf'),
+        'scans': os.path.join(corpus_dir, 'scans.pdf'),
+        'fonts': os.path.join(corpus_dir, 'fonts.pdf'),
+        'merge_set': [],
+        'jpegs': [],
+        'pngs': []
+    }
+    _text_pdf(files['text'], rng, params['text_pages'])
+    _scan_pdf(files['scans'], rng, params['scan_pages'], params['scan_size'])
+    _font_pdf(files['fonts'], rng, params['font_pages'])
+
+    merge_dir = os.path.join(corpus_dir, 'merge')
+    os.makedirs(merge_dir, exist_ok=True)
+    for index in range(params['merge_files']):
+        path = os.path.join(merge_dir, f'part_{index:04d}.pdf')
+        _text_pdf(path, rng, params['merge_file_pages'])
+        files['merge_set'].append(path)
+
+    files['jpegs'] = _image_files(os.path.join(corpus_dir, 'jpeg'), rng, params['images'], params['image_size'], 'jpg')
+    png_size = (params['image_size'][0] // 2, params['image_size'][1] // 2)
+    files['pngs'] = _image_files(os.path.join(corpus_dir, 'png'), rng, max(1, params['images'] // 2), png_size, 'png')
+
+    with open(manifest_path, 'w') as f:
+        json.dump({'version': CORPUS_VERSION, 'scale': scale, 'seed': seed, 'params': params, 'files': files}, f, indent=2)
+    return files
+
+
+# ==================== BENCHMARK CASES ====================
+
+def _size(result):
+    """Output size in bytes of whatever a PDFProcessor method returned"""
+    if hasattr(result, 'seek'):
+        return result.seek(0, os.SEEK_END)
+    if isinstance(result, list):
+        return sum(_size(item) for item in result)
+    if isinstance(result, dict):
+        return 0
+    # Generators (split_pdf_zip) are consumed here, inside the timed region
+    return sum(len(chunk) for chunk in result)
+
+
+def benchmark_cases(corpus):
+    """Benchmark name -> zero-argument callable running one PDFProcessor method"""
+    text, scans, fonts = corpus['text'], corpus['scans'], corpus['fonts']
+    every_third = list(range(1, SCALES['large']['text_pages'] + 1, 3))
+    pipeline = [
+        {'op': 'extract', 'pages': every_third[:200]},
+        {'op': 'rotate', 'rotation': 90, 'pages': None},
+        {'op': 'compress', 'quality': 'medium'}
+    ]
+
+    return {
+        'merge_pdfs/many_small': lambda: PDFProcessor.merge_pdfs(corpus['merge_set']),
+        'merge_pdfs/text_and_fonts': lambda: PDFProcessor.merge_pdfs([text, fonts]),
+        'split_pdf/text': lambda: PDFProcessor.split_pdf(text),
+        'split_pdf_zip/text': lambda: PDFProcessor.split_pdf_zip(text),
+        'compress_pdf/scans_low': lambda: PDFProcessor.compress_pdf(scans, 'low'),
+        'compress_pdf/scans_medium': lambda: PDFProcessor.compress_pdf(scans, 'medium'),
+        'compress_pdf/fonts_high': lambda: PDFProcessor.compress_pdf(fonts, 'high'),
+        'image_to_pdf/jpegs_150dpi': lambda: PDFProcessor.image_to_pdf(corpus['jpegs'], 150),
+        'image_to_pdf/jpegs_original': lambda: PDFProcessor.image_to_pdf(corpus['jpegs'], None),
+        'image_to_pdf/pngs_150dpi': lambda: PDFProcessor.image_to_pdf(corpus['pngs'], 150),
+        'extract_pages/text_every_third': lambda: PDFProcessor.extract_pages(text, every_third),
+        'rotate_pdf/text': lambda: PDFProcessor.rotate_pdf(text, 90),
+        'run_pipeline/text_extract_rotate_compress': lambda: PDFProcessor.run_pipeline(text, pipeline),
+        'get_pdf_info/text': lambda: PDFProcessor.get_pdf_info(text),
+        'preflight/text': lambda: preflight(text, 'merge')
+    }
+
+
+def measure(case, repeat):
+    """
+    Run a case repeat times for wall time, then once more under tracemalloc
+    for peak memory (tracemalloc slows allocation-heavy code, so it is kept
+    out of the timed runs). Only Python-level allocations are counted.
+    """
+    timings = []
+    output_bytes = 0
+    for _ in range(repeat):
+        start = time.perf_counter()
+        output_bytes = _size(case())
+        timings.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    try:
+        _size(case())
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return {
+        'wall_seconds': round(statistics.median(timings), 4),
+        'wall_seconds_runs': [round(t, 4) for t in timings],
+        'peak_memory_mb': round(peak / (1024 * 1024), 2),
+        'output_bytes': output_bytes
+    }
+
+
+def run(corpus, repeat, only=None):
+    results = {}
+    for name, case in benchmark_cases(corpus).items():
+        if only and not any(name.startswith(prefix) for prefix in only):
+            continue
+        print(f'  {name} ...', end='', flush=True)
+        results[name] = measure(case, repeat)
+        print(f" {results[name]['wall_seconds']:.3f}s, {results[name]['peak_memory_mb']:.1f} MB,"
+              f" {results[name]['output_bytes']:,} bytes")
+    return results
+
+
+# ==================== BASELINE COMPARISON ====================
+
+def compare(results, baseline, thresholds):
+    """
+    Compare results with a baseline run
+    Returns:
+        List of regression descriptions (empty if none)
+    """
+    regressions = []
+    baseline_results = baseline.get('results', {})
+    print(f"\n{'benchmark':<44}{'metric':<16}{'baseline':>14}{'current':>14}{'change':>10}")
+    for name, current in results.items():
+        previous = baseline_results.get(name)
+        if previous is None:
+            print(f'{name:<44}(not in baseline)')
+            continue
+
+        for metric, threshold in thresholds.items():
+            old, new = previous.get(metric), current.get(metric)
+            if not old or new is None:
+                continue
+            change = (new - old) / old
+            flag = ''
+            if change > threshold:
+                flag = '  REGRESSION'
+                regressions.append(f'{name} {metric}: {old} -> {new} (+{change * 100:.1f}%)')
+            print(f'{name:<44}{metric:<16}{old:>14}{new:>14}{change * 100:>+9.1f}%{flag}')
+
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark PDFProcessor on generated corpora')
+    parser.add_argument('--scale', choices=sorted(SCALES), default='small', help='Corpus size (default small)')
+    parser.add_argument('--seed', type=int, default=1234, help='Seed for corpus generation (default 1234)')
+    parser.add_argument('--repeat', type=int, default=3, help='Timed runs per benchmark; the median is reported')
+    parser.add_argument('--only', help='Comma-separated benchmark name prefixes, e.g. merge,compress_pdf/scans')
+    parser.add_argument('--corpus-dir', default='benchmark_corpus', help='Where generated corpora are kept')
+    parser.add_argument('--output', help='Write results JSON to this file')
+    parser.add_argument('--baseline', help='Compare with a results JSON file and exit 1 on regression')
+    parser.add_argument('--save-baseline', help='Also write the results to this file as the new baseline')
+    for metric, default in THRESHOLDS.items():
+        parser.add_argument(f"--max-{metric.replace('_', '-')}", type=float, default=default,
+                            help=f'Allowed {metric} increase over the baseline (default {default * 100:.0f}%%)')
+    args = parser.parse_args()
+
+    corpus = build_corpus(args.corpus_dir, args.scale, args.seed)
+    print(f'Running benchmarks ({args.scale}, {args.repeat} runs each)...')
+    results = run(corpus, args.repeat, args.only.split(',') if args.only else None)
+
+    report = {
+        'meta': {
+            'timestamp': datetime.utcnow().isoformat(),
+            'scale': args.scale,
+            'seed': args.seed,
+            'repeat': args.repeat,
+            'corpus_version': CORPUS_VERSION,
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'pypdf2': PyPDF2.__version__,
+            'pillow': Image.__version__,
+            'reportlab': reportlab.Version
+        },
+        'results': results
+    }
+
+    for path in (args.output, args.save_baseline):
+        if path:
+            with open(path, 'w') as f:
+                json.dump(report, f, indent=2)
+            print(f'Results written to {path}')
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline.get('meta', {}).get('scale') != args.scale:
+            print(f"Warning: baseline was recorded at scale {baseline.get('meta', {}).get('scale')}")
+
+        thresholds = {metric: getattr(args, f'max_{metric}') for metric in THRESHOLDS}
+        regressions = compare(results, baseline, thresholds)
+        if regressions:
+            print(f'\n{len(regressions)} regression(s):')
+            for regression in regressions:
+                print(f'  - {regression}')
+            sys.exit(1)
+        print('\nNo regressions.')
+
+
+if __name__ == '__main__':
+    main()
@@ -10,6 +10,9 @@ class Config:
     # Database
     SQLALCHEMY_DATABASE_URI = os.getenv('DATABASE_URL', 'sqlite:///pdftoolkit.db')
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+    # Create and upgrade tables when the app is imported; turn off where a
+    # release step runs `flask --app app init-db` before the web processes start
+    INIT_DB_ON_STARTUP = os.getenv('INIT_DB_ON_STARTUP', 'true').lower() == 'true'
 
     # Stripe
     STRIPE_PUBLIC_KEY = os.getenv('STRIPE_PUBLIC_KEY', '')
@@ -17,6 +20,8 @@ class Config:
     STRIPE_WEBHOOK_SECRET = os.getenv('STRIPE_WEBHOOK_SECRET', '')
     STRIPE_PRICE_BASIC = os.getenv('STRIPE_PRICE_BASIC', '')
     STRIPE_PRICE_PRO = os.getenv('STRIPE_PRICE_PRO', '')
+    # Point the Stripe client somewhere else, e.g. the load test's local stub
+    STRIPE_API_BASE = os.getenv('STRIPE_API_BASE', '')
 
     # Usage Limits
     FREE_TIER_LIMIT = int(os.getenv('FREE_TIER_LIMIT', 5))
@@ -26,5 +31,65 @@ class Config:
     # File Upload
     MAX_FILE_SIZE_MB = int(os.getenv('MAX_FILE_SIZE_MB', 10))
     MAX_CONTENT_LENGTH = MAX_FILE_SIZE_MB * 1024 * 1024
-    UPLOAD_FOLDER = 'uploads'
+    UPLOAD_FOLDER = os.getenv('UPLOAD_FOLDER', 'uploads')
+    # Large uploads and outputs spill to disk here rather than the system temp directory
+    SPOOL_FOLDER = os.path.join(UPLOAD_FOLDER, 'tmp')
     ALLOWED_EXTENSIONS = {'pdf', 'png', 'jpg', 'jpeg'}
+
+    # Web worker processes on a host (gunicorn reads the same variable); each
+    # gets its own job threads and PDF worker processes, so by default they
+    # split the host's cores between them rather than each taking them all
+    WEB_CONCURRENCY = int(os.getenv('WEB_CONCURRENCY', 2))
+    CPUS_PER_WEB_PROCESS = max(1, (os.cpu_count() or 1) // max(1, WEB_CONCURRENCY))
+
+    # Background Jobs (per web process)
+    JOB_WORKERS = int(os.getenv('JOB_WORKERS', CPUS_PER_WEB_PROCESS))
+    # Jobs estimated below this many milliseconds also run on a fast lane with
+    # its own worker process (0 disables it)
+    FAST_LANE_MAX_MS = int(os.getenv('FAST_LANE_MAX_MS', 500))
+    # Each process marks its queued and running jobs alive this often; jobs not
+    # marked for JOB_STALE_SECONDS, e.g. after a restart, are queued again by
+    # another process, or failed once they were started JOB_MAX_ATTEMPTS times
+    JOB_HEARTBEAT_SECONDS = int(os.getenv('JOB_HEARTBEAT_SECONDS', 30))
+    JOB_STALE_SECONDS = int(os.getenv('JOB_STALE_SECONDS', 120))
+    JOB_MAX_ATTEMPTS = int(os.getenv('JOB_MAX_ATTEMPTS', 2))
+    # Finished jobs and their results are deleted after this many hours (0 keeps them)
+    JOB_RESULT_TTL_HOURS = float(os.getenv('JOB_RESULT_TTL_HOURS', 24))
+
+    # Admission control for requests that queue PDF jobs, shared by the web
+    # processes on a host: in-flight jobs per user and in total, and a per-user
+    # token bucket (0 disables each limit)
+    ADMISSION_USER_INFLIGHT = int(os.getenv('ADMISSION_USER_INFLIGHT', 4))
+    ADMISSION_GLOBAL_INFLIGHT = int(os.getenv('ADMISSION_GLOBAL_INFLIGHT', 64))
+    ADMISSION_RATE_PER_MINUTE = float(os.getenv('ADMISSION_RATE_PER_MINUTE', 30))
+    ADMISSION_BURST = int(os.getenv('ADMISSION_BURST', 10))
+    # In-flight slots of jobs that never finished are dropped after this long
+    ADMISSION_SLOT_TTL_SECONDS = int(os.getenv('ADMISSION_SLOT_TTL_SECONDS', 900))
+
+    # PDF worker processes (per web process)
+    PDF_PROCESS_WORKERS = int(os.getenv('PDF_PROCESS_WORKERS', CPUS_PER_WEB_PROCESS))
+    PDF_TASK_CPU_SECONDS = int(os.getenv('PDF_TASK_CPU_SECONDS', 100))
+    PDF_TASK_MEMORY_MB = int(os.getenv('PDF_TASK_MEMORY_MB', 1024))
+    # Output documents built in memory move to SPOOL_FOLDER past this size
+    PDF_OUTPUT_SPOOL_MB = int(os.getenv('PDF_OUTPUT_SPOOL_MB', 16))
+
+    # Result cache (0 disables it)
+    RESULT_CACHE_MAX_MB = int(os.getenv('RESULT_CACHE_MAX_MB', 512))
+
+    # User identity cache for login sessions (per process)
+    USER_CACHE_TTL_SECONDS = int(os.getenv('USER_CACHE_TTL_SECONDS', 30))
+    USER_CACHE_SIZE = int(os.getenv('USER_CACHE_SIZE', 10000))
+
+    # Operation log (written behind in batches)
+    OPERATION_LOG_BATCH_SIZE = int(os.getenv('OPERATION_LOG_BATCH_SIZE', 100))
+    OPERATION_LOG_FLUSH_SECONDS = float(os.getenv('OPERATION_LOG_FLUSH_SECONDS', 2))
+
+    # Prometheus metrics: how often each process publishes its samples, and an
+    # optional bearer token required to scrape /metrics
+    METRICS_FLUSH_SECONDS = float(os.getenv('METRICS_FLUSH_SECONDS', 5))
+    METRICS_TOKEN = os.getenv('METRICS_TOKEN', '')
+
+    # Profiling: admins can request it per job; jobs slower than this many seconds
+    # are rerun once under the profiler (0 disables that)
+    PROFILE_SLOW_SECONDS = float(os.getenv('PROFILE_SLOW_SECONDS', 0))
+    PROFILE_KEEP = int(os.getenv('PROFILE_KEEP', 50))
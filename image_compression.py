@@ -0,0 +1,234 @@
+import io
+import os
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from PyPDF2.filters import ASCII85Decode, ASCIIHexDecode
+from PyPDF2.generic import NameObject, NumberObject, ArrayObject
+from PIL import Image
+
+
+# Quality tier -> target resolution and encoder settings
+COMPRESSION_LEVELS = {
+    'low': {'dpi': 72, 'jpeg_quality': 50, 'lossless_only': False},
+    'medium': {'dpi': 150, 'jpeg_quality': 70, 'lossless_only': False},
+    'high': {'dpi': 220, 'jpeg_quality': 85, 'lossless_only': True}
+}
+
+# Only downsample when the image is meaningfully above the target resolution
+DOWNSAMPLE_THRESHOLD = 1.25
+
+_TEXT_FILTERS = {
+    '/ASCII85Decode': ASCII85Decode,
+    '/ASCIIHexDecode': ASCIIHexDecode
+}
+
+_LOSSLESS_FILTERS = ('/FlateDecode', '/LZWDecode', '/ASCII85Decode', '/ASCIIHexDecode')
+
+_COLOR_SPACE_MODES = {
+    '/DeviceGray': 'L',
+    '/DeviceRGB': 'RGB'
+}
+
+
+def _filters(image):
+    filters = image.get('/Filter', ())
+    if isinstance(filters, NameObject):
+        return [filters]
+    return list(filters)
+
+
+def _image_mode(image):
+    """PIL mode matching the image's color space, or None if we leave it alone"""
+    color_space = image.get('/ColorSpace')
+    if color_space is None:
+        return None
+    color_space = color_space.get_object()
+
+    if isinstance(color_space, NameObject):
+        return _COLOR_SPACE_MODES.get(color_space)
+
+    # ICC profiles are kept as-is, so only the component count matters
+    if isinstance(color_space, ArrayObject) and color_space[0] == '/ICCBased':
+        components = color_space[1].get_object().get('/N')
+        return {1: 'L', 3: 'RGB'}.get(components)
+
+    return None
+
+
+def _iter_images(resources, seen):
+    """Yield (name, image) for image XObjects, following nested form XObjects"""
+    if resources is None:
+        return
+    xobjects = resources.get_object().get('/XObject')
+    if xobjects is None:
+        return
+
+    for name, ref in xobjects.get_object().items():
+        obj = ref.get_object()
+        if id(obj) in seen:
+            continue
+        seen.add(id(obj))
+
+        if obj.get('/Subtype') == '/Image':
+            yield name, obj
+        elif obj.get('/Subtype') == '/Form':
+            yield from _iter_images(obj.get('/Resources'), seen)
+
+
+def _prepare(image, page_width, page_height):
+    """
+    Pull what a worker thread needs out of a PDF image object
+    Returns:
+        Dictionary describing the image, or a skip reason string
+    """
+    if image.get('/ImageMask') or '/Mask' in image or '/Decode' in image:
+        return 'masked or custom decode'
+    if image.get('/BitsPerComponent') != 8:
+        return 'unsupported bit depth'
+
+    mode = _image_mode(image)
+    if mode is None:
+        return 'unsupported color space'
+
+    filters = _filters(image)
+    if filters and filters[-1] == '/DCTDecode' and all(f in _TEXT_FILTERS for f in filters[:-1]):
+        source = 'jpeg'
+        data = image._data
+        # Strip ASCII armor (ReportLab writes [/ASCII85Decode /DCTDecode]) to get the JPEG
+        for filter_name in filters[:-1]:
+            data = _TEXT_FILTERS[filter_name].decode(data)
+    elif all(f in _LOSSLESS_FILTERS for f in filters):
+        source = 'raw'
+        data = image.get_data()
+    else:
+        return 'unsupported filter'
+
+    return {
+        'source': source,
+        'data': data,
+        'mode': mode,
+        'width': int(image['/Width']),
+        'height': int(image['/Height']),
+        'original_bytes': len(image._data),
+        'page_width_in': page_width / 72.0,
+        'page_height_in': page_height / 72.0
+    }
+
+
+def _recompress(info, settings):
+    """
+    Downsample and re-encode one image. Runs on a worker thread; PIL
+    releases the GIL while decoding, resampling and encoding.
+    Returns:
+        Tuple of (filter name, encoded bytes, width, height), or None
+    """
+    width, height = info['width'], info['height']
+
+    # The image can't be drawn larger than the page, so this is a lower bound
+    # on its effective resolution; downsampling to it is always safe
+    dpi = min(width / info['page_width_in'], height / info['page_height_in'])
+    scale = 1.0
+    if dpi > settings['dpi'] * DOWNSAMPLE_THRESHOLD:
+        scale = settings['dpi'] / dpi
+    new_size = (max(1, round(width * scale)), max(1, round(height * scale)))
+
+    if info['source'] == 'jpeg':
+        img = Image.open(io.BytesIO(info['data']))
+        # Let libjpeg decode at reduced size where it can
+        img.draft(info['mode'], new_size)
+    else:
+        img = Image.frombytes(info['mode'], (width, height), info['data'])
+
+    if img.mode != info['mode']:
+        img = img.convert(info['mode'])
+    if img.size != new_size:
+        img = img.resize(new_size, Image.LANCZOS)
+
+    candidates = []
+    if info['source'] == 'jpeg' or not settings['lossless_only']:
+        jpeg = io.BytesIO()
+        img.save(jpeg, 'JPEG', quality=settings['jpeg_quality'], optimize=True)
+        candidates.append(('/DCTDecode', jpeg.getvalue()))
+    if info['source'] == 'raw':
+        candidates.append(('/FlateDecode', zlib.compress(img.tobytes(), 9)))
+
+    filter_name, data = min(candidates, key=lambda candidate: len(candidate[1]))
+    if len(data) >= info['original_bytes']:
+        return None
+    return filter_name, data, new_size[0], new_size[1]
+
+
+def recompress_images(writer, quality='medium'):
+    """
+    Downsample and re-encode the images of every page in a PdfWriter, in place
+    Args:
+        writer: PdfWriter whose pages have been added
+        quality: 'low', 'medium', or 'high'
+    Returns:
+        List of dictionaries describing each image and the bytes saved
+    """
+    settings = COMPRESSION_LEVELS.get(quality, COMPRESSION_LEVELS['medium'])
+
+    report = []
+    work = []
+    seen = set()
+    for page_num, page in enumerate(writer.pages, start=1):
+        page_width = float(page.mediabox.width)
+        page_height = float(page.mediabox.height)
+
+        for name, image in _iter_images(page.get('/Resources'), seen):
+            entry = {
+                'page': page_num,
+                'name': str(name),
+                'width': int(image.get('/Width', 0)),
+                'height': int(image.get('/Height', 0)),
+                'original_bytes': len(image._data),
+                'new_bytes': len(image._data),
+                'bytes_saved': 0,
+                'action': 'skipped'
+            }
+            report.append(entry)
+
+            try:
+                info = _prepare(image, page_width, page_height)
+            except Exception as e:
+                info = f'could not decode: {str(e)}'
+            if isinstance(info, str):
+                entry['reason'] = info
+                continue
+            work.append((entry, image, info))
+
+    if not work:
+        return report
+
+    with ThreadPoolExecutor(max_workers=min(len(work), os.cpu_count() or 1)) as pool:
+        futures = [pool.submit(_recompress, info, settings) for _, _, info in work]
+
+        for (entry, image, _), future in zip(work, futures):
+            try:
+                result = future.result()
+            except Exception as e:
+                entry['reason'] = f'could not re-encode: {str(e)}'
+                continue
+            if result is None:
+                entry['reason'] = 'no savings'
+                continue
+
+            filter_name, data, new_width, new_height = result
+            image._data = data
+            image.decoded_self = None
+            image[NameObject('/Filter')] = NameObject(filter_name)
+            image[NameObject('/Width')] = NumberObject(new_width)
+            image[NameObject('/Height')] = NumberObject(new_height)
+            if '/DecodeParms' in image:
+                del image['/DecodeParms']
+
+            entry.update({
+                'new_width': new_width,
+                'new_height': new_height,
+                'new_bytes': len(data),
+                'bytes_saved': entry['original_bytes'] - len(data),
+                'action': 'recompressed'
+            })
+
+    return report
@@ -0,0 +1,163 @@
+import io
+import zlib
+from collections import namedtuple
+from PIL import Image
+from pdf_writer import pdf_number
+
+# Image data ready to embed as an image XObject
+EmbeddedImage = namedtuple('EmbeddedImage', 'width height color_space decode filter data')
+
+# Only pre-scale when the image has clearly more pixels than its placement needs
+PRESCALE_THRESHOLD = 1.25
+PRESCALE_JPEG_QUALITY = 90
+
+_JPEG_COLOR_SPACES = {
+    'L': '/DeviceGray',
+    'RGB': '/DeviceRGB',
+    'CMYK': '/DeviceCMYK'
+}
+
+# EXIF Orientation tag, and the transpose that turns each value upright
+_EXIF_ORIENTATION = 0x0112
+_ORIENTATION_TRANSPOSES = {
+    2: Image.Transpose.FLIP_LEFT_RIGHT,
+    3: Image.Transpose.ROTATE_180,
+    4: Image.Transpose.FLIP_TOP_BOTTOM,
+    5: Image.Transpose.TRANSPOSE,
+    6: Image.Transpose.ROTATE_270,
+    7: Image.Transpose.TRANSVERSE,
+    8: Image.Transpose.ROTATE_90
+}
+
+
+def _read_bytes(img_file):
+    if hasattr(img_file, 'read'):
+        if hasattr(img_file, 'seek'):
+            img_file.seek(0)
+        return img_file.read()
+    with open(img_file, 'rb') as f:
+        return f.read()
+
+
+def fit_to_page(img_width, img_height, page_width, page_height):
+    """
+    Place an image on a page, shrinking it to fit while keeping its aspect ratio
+    Returns:
+        Tuple of (x, y, width, height) in points
+    """
+    aspect = img_height / float(img_width)
+
+    if img_width > page_width or img_height > page_height:
+        if aspect > 1:
+            # Portrait
+            new_height = page_height - 40
+            new_width = new_height / aspect
+        else:
+            # Landscape
+            new_width = page_width - 40
+            new_height = new_width * aspect
+    else:
+        new_width = img_width
+        new_height = img_height
+
+    # Center image
+    x = (page_width - new_width) / 2
+    y = (page_height - new_height) / 2
+    return x, y, new_width, new_height
+
+
+def load_image(img_file, page_size, dpi=None):
+    """
+    Prepare an image and its placement without touching the filesystem.
+    JPEGs that are already small enough are passed through untouched as
+    DCTDecode; Image.open only parses the header, so their pixels are never
+    decoded. Photos with an EXIF orientation are decoded and turned upright,
+    as viewers ignore it. Larger images are decoded at reduced size (JPEG draft mode or
+    reduce()) down to what the placement needs at the target DPI.
+    Args:
+        img_file: Image file object or path
+        page_size: Tuple of (width, height) of the page, in points
+        dpi: Target resolution of the placed image, or None to keep all pixels
+    Returns:
+        Tuple of (EmbeddedImage, placement) where placement is (x, y, width, height)
+    """
+    data = _read_bytes(img_file)
+    img = Image.open(io.BytesIO(data))
+    # PDF viewers ignore EXIF, so a rotated photo is stored upright
+    transpose = _ORIENTATION_TRANSPOSES.get(img.getexif().get(_EXIF_ORIENTATION))
+    turned = transpose in (Image.Transpose.TRANSPOSE, Image.Transpose.ROTATE_270,
+                           Image.Transpose.TRANSVERSE, Image.Transpose.ROTATE_90)
+    upright_size = img.size[::-1] if turned else img.size
+    placement = fit_to_page(upright_size[0], upright_size[1], *page_size)
+
+    target_size = upright_size
+    if dpi:
+        needed = (max(1, round(placement[2] / 72.0 * dpi)), max(1, round(placement[3] / 72.0 * dpi)))
+        if upright_size[0] > needed[0] * PRESCALE_THRESHOLD:
+            target_size = needed
+
+    is_jpeg = img.format == 'JPEG' and img.mode in _JPEG_COLOR_SPACES
+    if is_jpeg and transpose is None and target_size == img.size:
+        decode = None
+        if img.mode == 'CMYK' and 'adobe' in img.info:
+            # Adobe writes CMYK JPEGs inverted
+            decode = '[1 0 1 0 1 0 1 0]'
+        embedded = EmbeddedImage(img.size[0], img.size[1], _JPEG_COLOR_SPACES[img.mode], decode, '/DCTDecode', data)
+        return embedded, placement
+
+    if target_size != upright_size:
+        # thumbnail() uses JPEG draft decoding or reduce() before resampling
+        img.thumbnail(target_size[::-1] if turned else target_size, Image.LANCZOS)
+    if transpose is not None:
+        img = img.transpose(transpose)
+
+    if is_jpeg and img.mode in ('L', 'RGB'):
+        # Keep photos as JPEG after scaling
+        jpeg = io.BytesIO()
+        img.save(jpeg, 'JPEG', quality=PRESCALE_JPEG_QUALITY)
+        color_space = _JPEG_COLOR_SPACES[img.mode]
+        return EmbeddedImage(img.size[0], img.size[1], color_space, None, '/DCTDecode', jpeg.getvalue()), placement
+
+    if img.mode in ('RGBA', 'LA') or (img.mode == 'P' and 'transparency' in img.info):
+        # Flatten transparency onto a white page
+        img = img.convert('RGBA')
+        background = Image.new('RGB', img.size, (255, 255, 255))
+        background.paste(img, mask=img.getchannel('A'))
+        img = background
+    elif img.mode not in ('L', 'RGB'):
+        img = img.convert('RGB')
+
+    color_space = '/DeviceGray' if img.mode == 'L' else '/DeviceRGB'
+    data = zlib.compress(img.tobytes(), 6)
+    return EmbeddedImage(img.size[0], img.size[1], color_space, None, '/FlateDecode', data), placement
+
+
+def write_image_page(writer, pages_number, image, x, y, width, height, page_width, page_height):
+    """
+    Write one page showing an image at the given placement
+    Args:
+        writer: StreamingPdfWriter
+        pages_number: Object number of the page tree the page belongs to
+        image: EmbeddedImage
+        x, y, width, height: Placement of the image on the page, in points
+        page_width, page_height: Page size, in points
+    Returns:
+        Object number of the page
+    """
+    dictionary = b'/Type /XObject /Subtype /Image /Width %d /Height %d /ColorSpace %s /BitsPerComponent 8 /Filter %s' % (
+        image.width, image.height, image.color_space.encode('ascii'), image.filter.encode('ascii')
+    )
+    if image.decode:
+        dictionary += b' /Decode ' + image.decode.encode('ascii')
+    image_number = writer.write_stream(dictionary, image.data)
+
+    content = f'q {pdf_number(width)} 0 0 {pdf_number(height)} {pdf_number(x)} {pdf_number(y)} cm /Im0 Do Q'
+    content_number = writer.write_stream(b'', content.encode('ascii'))
+
+    page = (
+        f'<</Type /Page /Parent {pages_number} 0 R'
+        f' /MediaBox [0 0 {pdf_number(page_width)} {pdf_number(page_height)}]'
+        f' /Resources <</XObject <</Im0 {image_number} 0 R>>>>'
+        f' /Contents {content_number} 0 R>>'
+    )
+    return writer.write_object(page.encode('ascii'))
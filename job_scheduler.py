@@ -0,0 +1,94 @@
+import threading
+
+# Share of the workers each subscription tier gets while all of them have work queued
+LANE_WEIGHTS = {'pro': 6, 'basic': 3, 'free': 1}
+DEFAULT_LANE = 'free'
+
+
+class FairScheduler:
+    """
+    Queue of jobs with one lane per subscription tier, served by
+    self-clocked fair queuing (SCFQ). A queued job starts at the later of
+    the virtual time and its lane's previous finish tag, and finishes its
+    estimated cost divided by the lane's weight after that. Workers take the
+    job with the smallest finish tag, and the virtual time becomes that
+    job's finish tag. A lane therefore gets workers in proportion to its
+    weight whenever several lanes are busy, no lane is starved, and a cheap
+    job is not stuck behind expensive ones queued by another tier. Jobs
+    within a lane keep their submission order.
+    """
+
+    def __init__(self, weights=None):
+        self.weights = dict(weights or LANE_WEIGHTS)
+        self._lanes = {lane: [] for lane in self.weights}  # lane -> [(start, finish, cost_ms, item)]
+        self._finish = {lane: 0.0 for lane in self.weights}
+        self._virtual_time = 0.0
+        self._closed = False
+        self._condition = threading.Condition()
+
+    def put(self, item, lane, cost_ms):
+        """
+        Queue an item
+        Args:
+            item: What get() returns for it
+            lane: Key of the weights; unknown lanes go to DEFAULT_LANE
+            cost_ms: Estimated milliseconds of worker time
+        """
+        if lane not in self.weights:
+            lane = DEFAULT_LANE
+        with self._condition:
+            queue = self._lanes[lane]
+            # A lane that was idle starts from the current virtual time, so it can't bank credit
+            start = max(self._virtual_time, self._finish[lane])
+            finish = start + max(cost_ms, 1) / self.weights[lane]
+            self._finish[lane] = finish
+            queue.append((start, finish, cost_ms, item))
+            self._condition.notify_all()
+
+    def get(self, max_cost_ms=None):
+        """
+        Wait for the next item
+        Args:
+            max_cost_ms: Only take items estimated to cost at most this much
+        Returns:
+            The item with the smallest finish tag, or None once closed
+        """
+        with self._condition:
+            while True:
+                if self._closed:
+                    return None
+                picked = self._pick(max_cost_ms)
+                if picked is not None:
+                    in_turn = max_cost_ms is None or picked == self._pick(None)
+                    lane, index = picked
+                    _, finish, _, item = self._lanes[lane].pop(index)
+                    # The clock is the tag of the job in service; one the fast
+                    # lane takes ahead of its turn doesn't move it
+                    if in_turn:
+                        self._virtual_time = max(self._virtual_time, finish)
+                    return item
+                self._condition.wait()
+
+    def _pick(self, max_cost_ms):
+        """(lane, index) of the queued entry to serve next, or None"""
+        best = None
+        for lane, queue in self._lanes.items():
+            for index, (_, finish, cost_ms, _) in enumerate(queue):
+                if max_cost_ms is not None and cost_ms > max_cost_ms:
+                    continue
+                if best is None or finish < best[0]:
+                    best = (finish, lane, index)
+                # Later entries of a lane have larger tags
+                break
+        return None if best is None else best[1:]
+
+    def depth(self):
+        """Number of queued items per lane"""
+        with self._condition:
+            return {lane: len(queue) for lane, queue in self._lanes.items()}
+
+    def close(self):
+        """Wake every waiting get() and make it return None"""
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
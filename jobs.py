@@ -0,0 +1,505 @@
+import os
+import json
+import time
+import uuid
+import socket
+import shutil
+import threading
+import multiprocessing
+from datetime import datetime, timedelta
+from sqlalchemy import delete, func, or_, select, update
+from werkzeug.utils import secure_filename
+from models import db, Job, User
+from pdf_executor import PDFExecutor
+from result_cache import ResultCache
+from operation_log import OperationLogger
+from metrics import metrics
+from profiling import ProfileStore
+from upload_spool import store_upload
+from job_scheduler import FairScheduler, DEFAULT_LANE
+from admission import AdmissionControl
+from preflight import estimate_cost_ms
+
+
+# Operation type -> (download name prefix, extension, mimetype) of the result
+JOB_OUTPUTS = {
+    'merge': ('merged', 'pdf', 'application/pdf'),
+    'split': ('split_pages', 'zip', 'application/zip'),
+    'compress': ('compressed', 'pdf', 'application/pdf'),
+    'convert': ('converted', 'pdf', 'application/pdf'),
+    'pipeline': ('processed', 'pdf', 'application/pdf')
+}
+# Statuses of jobs that still need a process to run them, and of those that are over
+ACTIVE_STATUSES = ('queued', 'running')
+FINISHED_STATUSES = ('done', 'failed')
+
+
+class JobQueue:
+    """
+    Runs PDF operations in the background on a local worker pool.
+    Job state lives in the jobs table so any web worker can answer status
+    polls; uploads and results are kept under UPLOAD_FOLDER/jobs/<job_id>.
+    The threads only wait on PDFExecutor, which does the CPU work in
+    separate processes. Queued jobs wait in a FairScheduler with a lane per
+    subscription tier, weighted by their estimated cost; when
+    FAST_LANE_MAX_MS is set, one more thread with its own worker process
+    only takes jobs estimated below it, so small jobs don't wait behind
+    large ones. Results are looked up in ResultCache first, so a
+    repeated operation on the same input is served without parsing it.
+    PDFOperation records are written behind by OperationLogger, and every
+    finished job is recorded in the Prometheus metrics and releases its
+    AdmissionControl slot. Jobs submitted with profile=True, and background
+    reruns of successful jobs slower than PROFILE_SLOW_SECONDS, are profiled
+    into ProfileStore.
+
+    Each job row names the process that owns it, and a housekeeping thread
+    refreshes its heartbeat every JOB_HEARTBEAT_SECONDS. Queued or running
+    jobs whose heartbeat is older than JOB_STALE_SECONDS, because their
+    process restarted or died, are claimed by another process and queued
+    again, or failed once they have been started JOB_MAX_ATTEMPTS times.
+    The same thread deletes finished jobs and their results after
+    JOB_RESULT_TTL_HOURS. The threads and processes are started by start(),
+    on the first request, rather than when the app is imported.
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        self.scheduler = None
+        self.threads = []
+        self.pdf_executor = None
+        self.fast_executor = None
+        self.fast_lane_max_ms = None
+        self.result_cache = None
+        self.operation_log = None
+        self.profiles = None
+        self.admission = None
+        self.storage_dir = None
+        self.worker_id = None
+        self.heartbeat_seconds = None
+        self.stale_seconds = None
+        self.max_attempts = None
+        self.result_ttl_seconds = None
+        self._profile_lock = threading.Lock()
+        self._start_lock = threading.Lock()
+        self._started_pid = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        self.storage_dir = os.path.join(app.config['UPLOAD_FOLDER'], 'jobs')
+        os.makedirs(self.storage_dir, exist_ok=True)
+        self.scheduler = FairScheduler()
+        self.pdf_executor = PDFExecutor(app)
+        self.result_cache = ResultCache(app)
+        self.operation_log = OperationLogger(app)
+        self.profiles = ProfileStore(app)
+        self.admission = AdmissionControl(app)
+        self.heartbeat_seconds = app.config['JOB_HEARTBEAT_SECONDS']
+        self.stale_seconds = app.config['JOB_STALE_SECONDS']
+        self.max_attempts = app.config['JOB_MAX_ATTEMPTS']
+        self.result_ttl_seconds = app.config['JOB_RESULT_TTL_HOURS'] * 3600
+
+        self.fast_lane_max_ms = app.config['FAST_LANE_MAX_MS']
+        if self.fast_lane_max_ms:
+            self.fast_executor = PDFExecutor(app, max_workers=1)
+        app.before_request(self.start)
+
+    def start(self):
+        """
+        Start the worker threads, worker processes and housekeeping thread,
+        unless this process already has them. Called before each request and
+        on submit, so importing the app for a CLI command (e.g. the release
+        step's init-db) doesn't start workers that would claim stale jobs
+        and exit holding them.
+        """
+        # Worker processes that re-import the app must not pick up jobs
+        if multiprocessing.current_process().name != 'MainProcess':
+            return
+        if self._started_pid == os.getpid():
+            return
+        with self._start_lock:
+            if self._started_pid == os.getpid():
+                return
+            self._started_pid = os.getpid()
+            self.worker_id = f'{socket.gethostname()[:40]}:{os.getpid()}:{uuid.uuid4().hex[:8]}'
+            self.pdf_executor.start()
+            for index in range(self.app.config['JOB_WORKERS']):
+                self._start_worker(f'pdf-job-{index}', self.pdf_executor)
+            if self.fast_executor is not None:
+                self.fast_executor.start()
+                self._start_worker('pdf-job-fast', self.fast_executor, self.fast_lane_max_ms)
+            thread = threading.Thread(target=self._housekeep, name='pdf-job-housekeeping', daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+    def _start_worker(self, name, pdf_executor, max_cost_ms=None):
+        thread = threading.Thread(target=self._work, args=(pdf_executor, max_cost_ms), name=name, daemon=True)
+        thread.start()
+        self.threads.append(thread)
+
+    def _work(self, pdf_executor, max_cost_ms):
+        """Worker thread: run scheduled jobs until the scheduler is closed"""
+        while True:
+            entry = self.scheduler.get(max_cost_ms)
+            if entry is None:
+                return
+            job_id, tier = entry
+            try:
+                self._run(job_id, pdf_executor, tier)
+            except Exception as e:
+                self.app.logger.error(f"Error running job {job_id}: {str(e)}")
+
+    def job_dir(self, job_id):
+        return os.path.join(self.storage_dir, job_id)
+
+    def input_dir(self, job_id):
+        return os.path.join(self.job_dir(job_id), 'input')
+
+    def result_path(self, job_id):
+        return os.path.join(self.job_dir(job_id), 'result')
+
+    def submit(self, user, operation_type, files, params=None, profile=False, cost_ms=None, job_id=None):
+        """
+        Store uploaded files and queue the operation
+        Args:
+            user: User requesting the operation
+            operation_type: Key of JOB_OUTPUTS
+            files: List of uploaded file objects, in processing order
+            params: Dictionary of operation options
+            profile: Run the operation under the profiler, bypassing the result cache
+            cost_ms: Estimated milliseconds of worker time, e.g. from preflight;
+                     estimated from the file count and size if not given
+            job_id: ID for the job, e.g. its admission slot; a new one if not given
+        Returns:
+            The queued Job
+        """
+        if operation_type not in JOB_OUTPUTS:
+            raise ValueError(f"Unknown operation: {operation_type}")
+        self.start()
+
+        job = Job(
+            id=job_id or uuid.uuid4().hex,
+            user_id=user.id,
+            operation_type=operation_type,
+            status='queued',
+            params=json.dumps(params or {}),
+            file_count=len(files),
+            profile=profile,
+            worker_id=self.worker_id,
+            heartbeat_at=datetime.utcnow(),
+            attempts=0
+        )
+
+        input_dir = self.input_dir(job.id)
+        os.makedirs(input_dir, exist_ok=True)
+        for index, file in enumerate(files):
+            # Prefix with the position so the processing order survives the round trip
+            filename = secure_filename(file.filename) or 'upload'
+            store_upload(file, os.path.join(input_dir, f'{index:04d}_{filename}'))
+
+        db.session.add(job)
+        db.session.commit()
+
+        self._schedule(job, user.subscription_tier, cost_ms)
+        return job
+
+    def _schedule(self, job, tier, cost_ms=None):
+        """Put a stored job in the scheduler's lane for its tier"""
+        if cost_ms is None:
+            input_dir = self.input_dir(job.id)
+            size = sum(os.path.getsize(os.path.join(input_dir, name)) for name in os.listdir(input_dir))
+            cost_ms = estimate_cost_ms(job.operation_type, job.file_count, size)
+        if job.profile and self.fast_lane_max_ms:
+            # Profiled runs are kept off the fast lane
+            cost_ms = max(cost_ms, self.fast_lane_max_ms + 1)
+        self.scheduler.put((job.id, tier), tier, cost_ms)
+
+    def _run(self, job_id, pdf_executor, tier=None):
+        with self.app.app_context():
+            now = datetime.utcnow()
+            # Only the owner of a queued job starts it, so a job another
+            # process recovered in the meantime doesn't run twice
+            claimed = db.session.execute(
+                update(Job)
+                .where(Job.id == job_id, Job.status == 'queued', Job.worker_id == self.worker_id)
+                .values(
+                    status='running', started_at=now, heartbeat_at=now,
+                    attempts=func.coalesce(Job.attempts, 0) + 1
+                )
+            ).rowcount
+            db.session.commit()
+            job = db.session.get(Job, job_id)
+            if not claimed:
+                if job is None:
+                    self.admission.release(job_id)
+                return
+
+            input_dir = self.input_dir(job_id)
+            user_id, operation_type, file_count = job.user_id, job.operation_type, job.file_count
+            queue_wait = (job.started_at - job.created_at).total_seconds() if job.created_at else None
+            started = time.monotonic()
+            bytes_in = bytes_out = report = cache_hit = inputs = params = None
+            hit = success = False
+            usage = {}
+            try:
+                inputs = [os.path.join(input_dir, name) for name in sorted(os.listdir(input_dir))]
+                bytes_in = sum(os.path.getsize(path) for path in inputs)
+                params = json.loads(job.params or '{}')
+                result_path = self.result_path(job_id)
+
+                if self.result_cache.enabled:
+                    cache_key = self.result_cache.key(job.operation_type, inputs, params)
+                    # A profiled job has to do the work, so it skips the lookup
+                    if not job.profile:
+                        hit, report = self.result_cache.get(cache_key, result_path)
+                        cache_hit = hit
+                if job.profile:
+                    report, usage = self._run_profiled(job, inputs, result_path, params, 'requested', bytes_in)
+                elif not hit:
+                    report, usage = pdf_executor.run(job.operation_type, inputs, result_path, params)
+                if not hit and self.result_cache.enabled:
+                    self.result_cache.put(cache_key, result_path, report)
+
+                prefix, extension, mimetype = JOB_OUTPUTS[job.operation_type]
+                job.status = 'done'
+                job.result_name = f'{prefix}_{datetime.now().strftime("%Y%m%d_%H%M%S")}.{extension}'
+                job.result_mimetype = mimetype
+                job.report = json.dumps(report) if report else None
+                job.finished_at = datetime.utcnow()
+
+                bytes_out = os.path.getsize(result_path)
+
+                # Count usage and finish the job in one commit
+                if not User.consume_usage(job.user_id):
+                    raise Exception('Usage limit reached. Please upgrade your plan.')
+                db.session.commit()
+                success = True
+
+            except Exception as e:
+                db.session.rollback()
+                job = db.session.get(Job, job_id)
+                job.status = 'failed'
+                job.error = str(e)
+                job.finished_at = datetime.utcnow()
+                db.session.commit()
+                success = False
+
+            finally:
+                duration = time.monotonic() - started
+                self.admission.release(job_id)
+                # Failures are left out: a job stopped by its limits would only fail again
+                slow = self.profiles.slow_seconds and duration >= self.profiles.slow_seconds
+                if slow and success and not hit and not job.profile:
+                    self._profile_slow_job(job_id, input_dir, params, bytes_in, duration)
+                shutil.rmtree(input_dir, ignore_errors=True)
+
+            if not success:
+                bytes_out = None
+            pages = (report or {}).get('pages') if success else None
+            timings = usage.get('timings', {})
+            self.operation_log.log(
+                user_id, operation_type, file_count, success,
+                duration_ms=int(duration * 1000),
+                bytes_in=bytes_in,
+                bytes_out=bytes_out,
+                page_count=pages,
+                parse_ms=_milliseconds(timings.get('parse')),
+                transform_ms=_milliseconds(timings.get('transform')),
+                serialize_ms=_milliseconds(timings.get('serialize')),
+                peak_rss_bytes=usage.get('peak_rss_bytes')
+            )
+            metrics.record_operation(
+                operation_type, success, duration,
+                queue_wait=queue_wait,
+                tier=tier,
+                cache_hit=cache_hit,
+                bytes_in=bytes_in,
+                bytes_out=bytes_out,
+                pages=pages,
+                timings=timings,
+                peak_rss_bytes=usage.get('peak_rss_bytes')
+            )
+
+    def _housekeep(self):
+        """Housekeeping thread: keep this process's jobs alive, recover abandoned ones and expire old ones"""
+        while True:
+            try:
+                with self.app.app_context():
+                    self._heartbeat()
+                    self._recover_stale_jobs()
+                    self._expire_jobs()
+            except Exception as e:
+                self.app.logger.warning(f"Error in job housekeeping: {str(e)}")
+            time.sleep(self.heartbeat_seconds)
+
+    def _heartbeat(self):
+        db.session.execute(
+            update(Job)
+            .where(Job.worker_id == self.worker_id, Job.status.in_(ACTIVE_STATUSES))
+            .values(heartbeat_at=datetime.utcnow())
+        )
+        db.session.commit()
+
+    def _recover_stale_jobs(self):
+        """
+        Claim queued and running jobs whose owner stopped sending heartbeats,
+        then queue them here again or fail them
+        Returns:
+            Number of jobs recovered
+        """
+        now = datetime.utcnow()
+        stale = or_(Job.heartbeat_at.is_(None), Job.heartbeat_at < now - timedelta(seconds=self.stale_seconds))
+        job_ids = [job_id for job_id, in db.session.execute(
+            select(Job.id).where(Job.status.in_(ACTIVE_STATUSES), stale).limit(100)
+        ).all()]
+
+        recovered = 0
+        for job_id in job_ids:
+            # The same condition again, so only one process claims each job
+            claimed = db.session.execute(
+                update(Job)
+                .where(Job.id == job_id, Job.status.in_(ACTIVE_STATUSES), stale)
+                .values(worker_id=self.worker_id, heartbeat_at=now)
+            ).rowcount
+            db.session.commit()
+            if claimed:
+                self._recover(db.session.get(Job, job_id))
+                recovered += 1
+        return recovered
+
+    def _recover(self, job):
+        """Queue a claimed job again if its inputs survived and it has attempts left, else fail it"""
+        input_dir = self.input_dir(job.id)
+        has_inputs = os.path.isdir(input_dir) and len(os.listdir(input_dir)) == job.file_count
+        if has_inputs and (job.attempts or 0) < self.max_attempts:
+            job.status = 'queued'
+            job.started_at = None
+            db.session.commit()
+            user = db.session.get(User, job.user_id)
+            self._schedule(job, user.subscription_tier if user else DEFAULT_LANE)
+            self.app.logger.info(f"Requeued interrupted job {job.id}")
+            return
+
+        job.status = 'failed'
+        job.error = 'Processing was interrupted. Please try again.'
+        job.finished_at = datetime.utcnow()
+        db.session.commit()
+        self.admission.release(job.id)
+        shutil.rmtree(input_dir, ignore_errors=True)
+        self.app.logger.warning(f"Failed interrupted job {job.id}")
+
+    def _expire_jobs(self):
+        """
+        Delete jobs that finished more than JOB_RESULT_TTL_HOURS ago with
+        their files, and job directories of this host that have no job
+        Returns:
+            Number of jobs deleted
+        """
+        if not self.result_ttl_seconds:
+            return 0
+
+        cutoff = datetime.utcnow() - timedelta(seconds=self.result_ttl_seconds)
+        job_ids = [job_id for job_id, in db.session.execute(
+            select(Job.id).where(Job.status.in_(FINISHED_STATUSES), Job.finished_at < cutoff).limit(500)
+        ).all()]
+        if job_ids:
+            # Rows go first, so a job is never reported done without its result
+            db.session.execute(delete(Job).where(Job.id.in_(job_ids)))
+            db.session.commit()
+            for job_id in job_ids:
+                shutil.rmtree(self.job_dir(job_id), ignore_errors=True)
+
+        # Left behind by jobs deleted from another host, or uploads whose job was never stored
+        oldest = time.time() - self.result_ttl_seconds
+        for name in os.listdir(self.storage_dir):
+            path = os.path.join(self.storage_dir, name)
+            try:
+                if os.path.getmtime(path) >= oldest:
+                    continue
+            except OSError:
+                continue
+            if db.session.get(Job, name) is None:
+                shutil.rmtree(path, ignore_errors=True)
+        return len(job_ids)
+
+    def _run_profiled(self, job, inputs, output_path, params, reason, bytes_in, **details):
+        """Run a job's operation under the profiler and save the profile, even if the run fails"""
+        profile_id, profile_path = self.profiles.new_path(job.id)
+        started = time.monotonic()
+        usage, error = {}, None
+        try:
+            report, usage = self.pdf_executor.run(
+                job.operation_type, inputs, output_path, params, profile_path=profile_path
+            )
+            return report, usage
+        except Exception as e:
+            error = str(e)
+            raise
+        finally:
+            # Nothing is written if the worker process died
+            if os.path.exists(f'{profile_path}.prof'):
+                self.profiles.save(
+                    profile_id,
+                    job_id=job.id,
+                    user_id=job.user_id,
+                    operation_type=job.operation_type,
+                    reason=reason,
+                    file_count=job.file_count,
+                    bytes_in=bytes_in,
+                    duration_ms=int((time.monotonic() - started) * 1000),
+                    peak_rss_bytes=usage.get('peak_rss_bytes'),
+                    peak_traced_bytes=usage.get('peak_traced_bytes'),
+                    error=error,
+                    **details
+                )
+
+    def _profile_slow_job(self, job_id, input_dir, params, bytes_in, duration):
+        """
+        Rerun a slow job under the profiler on a background thread, one at a
+        time per process; the result is thrown away
+        Args:
+            job_id: ID of the finished job
+            input_dir: The job's input directory, which the rerun takes over
+            params: Dictionary of operation options
+            bytes_in: Total size of the inputs
+            duration: Seconds the job took
+        """
+        if not self._profile_lock.acquire(blocking=False):
+            return
+        # Moved out of the way of the job's cleanup; the rerun removes it
+        profile_dir = os.path.join(self.job_dir(job_id), 'profile')
+        try:
+            os.rename(input_dir, profile_dir)
+            thread = threading.Thread(
+                target=self._rerun_profiled,
+                args=(job_id, profile_dir, params, bytes_in, duration),
+                name=f'pdf-profile-{job_id}',
+                daemon=True
+            )
+            thread.start()
+        except Exception as e:
+            self._profile_lock.release()
+            shutil.rmtree(profile_dir, ignore_errors=True)
+            self.app.logger.warning(f"Error profiling slow job {job_id}: {str(e)}")
+
+    def _rerun_profiled(self, job_id, profile_dir, params, bytes_in, duration):
+        """Background thread of _profile_slow_job"""
+        try:
+            inputs = [os.path.join(profile_dir, name) for name in sorted(os.listdir(profile_dir))]
+            with self.app.app_context():
+                job = db.session.get(Job, job_id)
+                if job is not None:
+                    self._run_profiled(
+                        job, inputs, os.path.join(profile_dir, 'result'), params, 'slow', bytes_in,
+                        original_duration_ms=int(duration * 1000)
+                    )
+        except Exception as e:
+            self.app.logger.warning(f"Error profiling slow job {job_id}: {str(e)}")
+        finally:
+            self._profile_lock.release()
+            shutil.rmtree(profile_dir, ignore_errors=True)
+
+
+def _milliseconds(seconds):
+    return None if seconds is None else int(seconds * 1000)
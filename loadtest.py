@@ -0,0 +1,502 @@
+"""
+End-to-end load test for the Flask app.
+
+Seeds users in a scratch SQLite database, starts the app locally (gunicorn
+or the Flask dev server) with Stripe pointed at a local stub, and drives
+/merge, /split, /compress and /convert concurrently with files from the
+benchmark corpus. Each operation is timed from upload until its result has
+been downloaded. Reports throughput, p50/p95/p99 latency and error rate
+per route, plus job queue wait and worker saturation from the jobs table.
+
+Usage:
+    python loadtest.py                                   # 8 users for 60 seconds
+    python loadtest.py --users 32 --duration 300 --server-workers 4
+    python loadtest.py --mix merge=1,compress=3 --output loadtest.json
+"""
+import os
+import sys
+import json
+import time
+import uuid
+import random
+import shutil
+import sqlite3
+import argparse
+import tempfile
+import threading
+import subprocess
+import http.cookiejar
+import urllib.error
+import urllib.parse
+import urllib.request
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from flask import Flask
+from benchmark import build_corpus
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Relative weight of each action in the default mix
+DEFAULT_MIX = {
+    'merge': 3,
+    'split': 2,
+    'compress': 3,
+    'convert': 2,
+    'checkout': 1
+}
+
+STUB_PRICE_ID = 'price_pro_loadtest'
+PASSWORD = 'loadtest-password'
+
+
+# ==================== STRIPE STUB ====================
+
+class StripeStubHandler(BaseHTTPRequestHandler):
+    """Answers the Stripe API calls app.py makes with canned objects"""
+
+    def _send(self, status, body):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _checkout_session(self, session_id):
+        suffix = session_id.rsplit('_', 1)[-1]
+        return {
+            'id': session_id,
+            'object': 'checkout.session',
+            'url': f'http://stripe-stub.invalid/pay/{session_id}',
+            'customer': f'cus_{suffix}',
+            'subscription': f'sub_{suffix}'
+        }
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        if self.path == '/v1/checkout/sessions':
+            return self._send(200, self._checkout_session(f'cs_test_{uuid.uuid4().hex}'))
+        self._send(404, {'error': {'type': 'invalid_request_error', 'message': f'No stub for {self.path}'}})
+
+    def do_GET(self):
+        path = urllib.parse.urlparse(self.path).path
+        if path.startswith('/v1/checkout/sessions/'):
+            return self._send(200, self._checkout_session(path.rsplit('/', 1)[1]))
+        if path.startswith('/v1/subscriptions/'):
+            return self._send(200, {
+                'id': path.rsplit('/', 1)[1],
+                'object': 'subscription',
+                'status': 'active',
+                'items': {'object': 'list', 'data': [{'object': 'subscription_item', 'price': {'id': STUB_PRICE_ID}}]}
+            })
+        self._send(404, {'error': {'type': 'invalid_request_error', 'message': f'No stub for {path}'}})
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_stripe_stub():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StripeStubHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+# ==================== SETUP ====================
+
+def seed_database(database_url, users, tier):
+    """Create the schema and the load-test users in the scratch database"""
+    from models import db, ensure_schema, User
+
+    seed_app = Flask(__name__)
+    seed_app.config['SQLALCHEMY_DATABASE_URI'] = database_url
+    db.init_app(seed_app)
+    with seed_app.app_context():
+        ensure_schema()
+        emails = []
+        for index in range(users):
+            user = User(email=f'loadtest{index}@example.com', subscription_tier=tier)
+            user.set_password(PASSWORD)
+            db.session.add(user)
+            emails.append(user.email)
+        db.session.commit()
+    return emails
+
+
+def start_server(args, workdir, env):
+    port = args.port
+    if args.server == 'gunicorn':
+        command = [
+            sys.executable, '-m', 'gunicorn', 'app:app',
+            '--bind', f'127.0.0.1:{port}',
+            '--workers', str(args.server_workers),
+            '--timeout', '120'
+        ]
+    else:
+        command = [sys.executable, '-m', 'flask', '--app', 'app', 'run', '--port', str(port), '--with-threads']
+
+    log = open(os.path.join(workdir, 'server.log'), 'w')
+    # Run from the scratch directory so uploads/ and instance/ land there
+    process = subprocess.Popen(command, cwd=workdir, env=env, stdout=log, stderr=subprocess.STDOUT)
+
+    base_url = f'http://127.0.0.1:{port}'
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f'Server exited early, see {log.name}')
+        try:
+            urllib.request.urlopen(base_url + '/', timeout=2).read()
+            return process, base_url
+        except (urllib.error.URLError, ConnectionError):
+            time.sleep(0.25)
+
+    process.terminate()
+    raise RuntimeError(f'Server did not start within 60 seconds, see {log.name}')
+
+
+# ==================== CLIENT ====================
+
+def _multipart(fields, files):
+    boundary = uuid.uuid4().hex
+    parts = []
+    for name, value in fields.items():
+        parts.append(
+            f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode()
+        )
+    for name, path in files:
+        with open(path, 'rb') as f:
+            data = f.read()
+        header = (
+            f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"; '
+            f'filename="{os.path.basename(path)}"\r\nContent-Type: application/octet-stream\r\n\r\n'
+        )
+        parts.append(header.encode() + data + b'\r\n')
+    parts.append(f'--{boundary}--\r\n'.encode())
+    return b''.join(parts), f'multipart/form-data; boundary={boundary}'
+
+
+class VirtualUser:
+    """One logged-in browser session issuing requests back to back"""
+
+    def __init__(self, base_url, email, corpus, rng, poll_interval):
+        self.base_url = base_url
+        self.email = email
+        self.corpus = corpus
+        self.rng = rng
+        self.poll_interval = poll_interval
+        self.opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()))
+
+    def request(self, method, path, data=None, content_type=None):
+        request = urllib.request.Request(self.base_url + path, data=data, method=method)
+        if content_type:
+            request.add_header('Content-Type', content_type)
+        try:
+            with self.opener.open(request, timeout=300) as response:
+                return response.status, response.read()
+        except urllib.error.HTTPError as e:
+            return e.code, e.read()
+
+    def login(self):
+        data = urllib.parse.urlencode({'email': self.email, 'password': PASSWORD}).encode()
+        status, _ = self.request('POST', '/login', data, 'application/x-www-form-urlencoded')
+        return status == 200
+
+    def _files_for(self, action):
+        rng, corpus = self.rng, self.corpus
+        if action == 'merge':
+            files = rng.sample(corpus['merge_set'], rng.randint(2, 5))
+            if rng.random() < 0.3:
+                files.append(corpus['text'])
+            return {}, [('files', path) for path in files]
+        if action == 'split':
+            fields = {'split_type': 'all'}
+            if rng.random() < 0.5:
+                fields = {'split_type': 'ranges', 'page_ranges': '1-3, 5, 8-12'}
+            return fields, [('file', rng.choice((corpus['text'], corpus['fonts'])))]
+        if action == 'compress':
+            fields = {'quality': rng.choice(('low', 'medium', 'high'))}
+            return fields, [('file', rng.choice((corpus['scans'], corpus['fonts'], corpus['text'])))]
+        # convert
+        images = corpus['jpegs'] if rng.random() < 0.7 else corpus['pngs']
+        fields = {'dpi': rng.choice(('150', '150', '300'))}
+        return fields, [('files', path) for path in rng.sample(images, rng.randint(1, min(3, len(images))))]
+
+    def run_job(self, action):
+        """
+        Upload, poll until the job finishes, then download the result
+        Returns:
+            Tuple of (outcome, submit_seconds) where outcome is 'ok', 'rejected' or an error description
+        """
+        fields, files = self._files_for(action)
+        body, content_type = _multipart(fields, files)
+
+        start = time.perf_counter()
+        status, data = self.request('POST', f'/{action}', body, content_type)
+        submit_seconds = time.perf_counter() - start
+        if status in (403, 429):
+            return 'rejected', submit_seconds
+        if status != 202:
+            return f'submit HTTP {status}', submit_seconds
+
+        job = json.loads(data)
+        while job['status'] not in ('done', 'failed'):
+            time.sleep(self.poll_interval)
+            status, data = self.request('GET', job['status_url'])
+            if status != 200:
+                return f'status HTTP {status}', submit_seconds
+            job = json.loads(data)
+
+        if job['status'] == 'failed':
+            return f"job failed: {job.get('error')}", submit_seconds
+
+        status, _ = self.request('GET', job['result_url'])
+        if status != 200:
+            return f'result HTTP {status}', submit_seconds
+        return 'ok', submit_seconds
+
+    def run_checkout(self):
+        """Create a checkout session and complete it, both against the Stripe stub"""
+        start = time.perf_counter()
+        body = json.dumps({'price_id': STUB_PRICE_ID}).encode()
+        status, data = self.request('POST', '/create-checkout-session', body, 'application/json')
+        submit_seconds = time.perf_counter() - start
+        if status != 200:
+            return f'checkout HTTP {status}', submit_seconds
+
+        session_id = json.loads(data)['checkout_url'].rsplit('/', 1)[1]
+        status, _ = self.request('GET', f'/subscription-success?session_id={session_id}')
+        if status != 200:
+            return f'subscription-success HTTP {status}', submit_seconds
+        return 'ok', submit_seconds
+
+
+def percentile(sorted_values, fraction):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return None
+    rank = max(1, int(round(fraction * len(sorted_values) + 0.5)))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+def drive(base_url, emails, corpus, mix, duration, seed, poll_interval):
+    """
+    Run one thread per user until the duration has passed
+    Returns:
+        List of (action, outcome, latency_seconds, submit_seconds) samples
+    """
+    samples = []
+    samples_lock = threading.Lock()
+    deadline = time.monotonic() + duration
+    actions, weights = zip(*mix.items())
+
+    def worker(index, email):
+        rng = random.Random(seed + index)
+        user = VirtualUser(base_url, email, corpus, rng, poll_interval)
+        if not user.login():
+            with samples_lock:
+                samples.append(('login', 'login failed', 0.0, 0.0))
+            return
+
+        while time.monotonic() < deadline:
+            action = rng.choices(actions, weights)[0]
+            start = time.perf_counter()
+            try:
+                if action == 'checkout':
+                    outcome, submit_seconds = user.run_checkout()
+                else:
+                    outcome, submit_seconds = user.run_job(action)
+            except Exception as e:
+                outcome, submit_seconds = f'{type(e).__name__}: {e}', 0.0
+            latency = time.perf_counter() - start
+            with samples_lock:
+                samples.append((action, outcome, latency, submit_seconds))
+
+    threads = [threading.Thread(target=worker, args=(index, email)) for index, email in enumerate(emails)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return samples
+
+
+# ==================== REPORTING ====================
+
+def summarize_routes(samples, elapsed):
+    routes = {}
+    for action in sorted({sample[0] for sample in samples}):
+        rows = [sample for sample in samples if sample[0] == action]
+        ok = sorted(latency for _, outcome, latency, _ in rows if outcome == 'ok')
+        submits = sorted(submit for _, outcome, _, submit in rows if outcome == 'ok')
+        errors = [outcome for _, outcome, _, _ in rows if outcome not in ('ok', 'rejected')]
+        routes[action] = {
+            'requests': len(rows),
+            'ok': len(ok),
+            'rejected': sum(1 for _, outcome, _, _ in rows if outcome == 'rejected'),
+            'errors': len(errors),
+            'error_rate': round(len(errors) / len(rows), 4) if rows else 0.0,
+            'throughput_per_s': round(len(ok) / elapsed, 3),
+            'latency_p50_s': percentile(ok, 0.50),
+            'latency_p95_s': percentile(ok, 0.95),
+            'latency_p99_s': percentile(ok, 0.99),
+            'submit_p50_s': percentile(submits, 0.50),
+            'sample_errors': sorted(set(errors))[:5]
+        }
+    return routes
+
+
+def summarize_jobs(database_path, started, elapsed, worker_slots):
+    """Queue wait and worker saturation from the jobs table"""
+    connection = sqlite3.connect(database_path)
+    try:
+        rows = connection.execute(
+            'SELECT created_at, started_at, finished_at FROM jobs WHERE started_at IS NOT NULL'
+        ).fetchall()
+    finally:
+        connection.close()
+
+    def parse(value):
+        return datetime.fromisoformat(value) if value else None
+
+    waits, busy, events = [], 0.0, []
+    for created_at, started_at, finished_at in rows:
+        created_at, started_at, finished_at = parse(created_at), parse(started_at), parse(finished_at)
+        if created_at < started:
+            continue
+        waits.append((started_at - created_at).total_seconds())
+        if finished_at:
+            busy += (finished_at - started_at).total_seconds()
+            events += [(started_at, 1), (finished_at, -1)]
+
+    running = peak = 0
+    for _, delta in sorted(events):
+        running += delta
+        peak = max(peak, running)
+
+    waits.sort()
+    return {
+        'jobs': len(waits),
+        'queue_wait_p50_s': percentile(waits, 0.50),
+        'queue_wait_p95_s': percentile(waits, 0.95),
+        'queue_wait_p99_s': percentile(waits, 0.99),
+        'worker_slots': worker_slots,
+        'peak_running_jobs': peak,
+        # Share of the available job worker time spent running jobs
+        'worker_saturation': round(busy / (elapsed * worker_slots), 3) if worker_slots else None
+    }
+
+
+def _fmt(value):
+    return '-' if value is None else f'{value:.3f}'
+
+
+def print_report(report):
+    print(f"\n{'route':<10}{'reqs':>7}{'ok':>7}{'rej':>6}{'err':>6}{'err%':>7}{'ok/s':>8}"
+          f"{'p50':>9}{'p95':>9}{'p99':>9}{'submit50':>10}")
+    for route, stats in report['routes'].items():
+        print(f"{route:<10}{stats['requests']:>7}{stats['ok']:>7}{stats['rejected']:>6}{stats['errors']:>6}"
+              f"{stats['error_rate'] * 100:>6.1f}%{stats['throughput_per_s']:>8.2f}"
+              f"{_fmt(stats['latency_p50_s']):>9}{_fmt(stats['latency_p95_s']):>9}"
+              f"{_fmt(stats['latency_p99_s']):>9}{_fmt(stats['submit_p50_s']):>10}")
+        for error in stats['sample_errors']:
+            print(f'    error: {error}')
+
+    jobs = report['jobs']
+    print(f"\nJobs: {jobs['jobs']}, queue wait p50/p95/p99: {_fmt(jobs['queue_wait_p50_s'])}/"
+          f"{_fmt(jobs['queue_wait_p95_s'])}/{_fmt(jobs['queue_wait_p99_s'])}s")
+    print(f"Job workers: {jobs['worker_slots']} slots, peak {jobs['peak_running_jobs']} running, "
+          f"saturation {jobs['worker_saturation']}")
+
+
+def parse_mix(text):
+    mix = {}
+    for part in text.split(','):
+        name, _, weight = part.partition('=')
+        if name.strip() not in DEFAULT_MIX:
+            raise argparse.ArgumentTypeError(f'Unknown action: {name}')
+        mix[name.strip()] = float(weight or 1)
+    return mix
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Load test the PDF Toolkit routes end to end')
+    parser.add_argument('--users', type=int, default=8, help='Concurrent virtual users (default 8)')
+    parser.add_argument('--duration', type=float, default=60, help='Seconds to generate load (default 60)')
+    parser.add_argument('--mix', type=parse_mix, default=DEFAULT_MIX,
+                        help='Action weights, e.g. merge=3,split=2,compress=3,convert=2,checkout=1')
+    parser.add_argument('--tier', default='pro', choices=('free', 'basic', 'pro'), help='Tier of the seeded users')
+    parser.add_argument('--server', choices=('gunicorn', 'flask'), default='gunicorn', help='How to run the app')
+    parser.add_argument('--server-workers', type=int, default=2, help='gunicorn worker processes (default 2)')
+    parser.add_argument('--port', type=int, default=5055, help='Port for the app (default 5055)')
+    parser.add_argument('--job-workers', type=int, default=4, help='JOB_WORKERS for the app (default 4)')
+    parser.add_argument('--pdf-workers', type=int, default=2, help='PDF_PROCESS_WORKERS for the app (default 2)')
+    parser.add_argument('--result-cache', action='store_true', help='Leave the result cache on (off by default)')
+    parser.add_argument('--poll-interval', type=float, default=0.2, help='Seconds between job status polls')
+    parser.add_argument('--corpus-dir', default='benchmark_corpus', help='Where benchmark corpora are kept')
+    parser.add_argument('--seed', type=int, default=1234)
+    parser.add_argument('--keep', action='store_true', help='Keep the scratch directory')
+    parser.add_argument('--output', help='Write the report as JSON to this file')
+    args = parser.parse_args()
+
+    corpus = build_corpus(os.path.abspath(args.corpus_dir), 'small', args.seed)
+    workdir = tempfile.mkdtemp(prefix='pdftoolkit-loadtest-')
+    database_path = os.path.join(workdir, 'loadtest.db')
+    database_url = f'sqlite:///{database_path}'
+    print(f'Scratch directory: {workdir}')
+
+    emails = seed_database(database_url, args.users, args.tier)
+    stub = start_stripe_stub()
+
+    env = dict(
+        os.environ,
+        PYTHONPATH=os.pathsep.join(filter(None, [REPO_DIR, os.environ.get('PYTHONPATH')])),
+        DATABASE_URL=database_url,
+        FLASK_SECRET_KEY='loadtest',
+        STRIPE_SECRET_KEY='sk_test_loadtest',
+        STRIPE_PRICE_PRO=STUB_PRICE_ID,
+        STRIPE_API_BASE=f'http://127.0.0.1:{stub.server_address[1]}',
+        JOB_WORKERS=str(args.job_workers),
+        PDF_PROCESS_WORKERS=str(args.pdf_workers),
+        RESULT_CACHE_MAX_MB=os.environ.get('RESULT_CACHE_MAX_MB', '512') if args.result_cache else '0'
+    )
+
+    process, base_url = start_server(args, workdir, env)
+    try:
+        print(f'Driving {args.users} users against {base_url} for {args.duration:.0f}s...')
+        started = datetime.utcnow()
+        start = time.monotonic()
+        samples = drive(base_url, emails, corpus, args.mix, args.duration, args.seed, args.poll_interval)
+        elapsed = time.monotonic() - start
+    finally:
+        process.terminate()
+        process.wait(timeout=30)
+        stub.shutdown()
+
+    server_processes = args.server_workers if args.server == 'gunicorn' else 1
+    report = {
+        'meta': {
+            'timestamp': started.isoformat(),
+            'users': args.users,
+            'duration_s': round(elapsed, 1),
+            'server': args.server,
+            'server_workers': server_processes,
+            'job_workers': args.job_workers,
+            'pdf_workers': args.pdf_workers,
+            'mix': args.mix
+        },
+        'routes': summarize_routes(samples, elapsed),
+        'jobs': summarize_jobs(database_path, started, elapsed, args.job_workers * server_processes)
+    }
+    print_report(report)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f'\nReport written to {args.output}')
+
+    if args.keep:
+        print(f'Scratch directory kept at {workdir}')
+    else:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,295 @@
+import os
+import json
+import time
+import atexit
+import threading
+from flask import g, request
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+MEMORY_BUCKETS = tuple(2 ** power * 1024 * 1024 for power in range(5, 13))  # 32 MB .. 4 GB
+
+# Name -> (type, help, histogram buckets)
+METRICS = {
+    'http_requests_total': (
+        'counter', 'HTTP requests by route, method and status code', None),
+    'http_request_duration_seconds': (
+        'histogram', 'Time to answer HTTP requests by route and method', DURATION_BUCKETS),
+    'pdf_operations_total': (
+        'counter', 'Finished PDF operations by type and status', None),
+    'pdf_operation_duration_seconds': (
+        'histogram', 'Time from a PDF job starting until it finished', DURATION_BUCKETS),
+    'pdf_operation_phase_seconds': (
+        'histogram', 'Time spent parsing, transforming and serializing per PDF operation', DURATION_BUCKETS),
+    'pdf_job_queue_wait_seconds': (
+        'histogram', 'Time PDF jobs waited for a worker by operation and subscription tier', DURATION_BUCKETS),
+    'pdf_operation_peak_rss_bytes': (
+        'histogram', 'Peak resident memory of the worker process during a PDF operation', MEMORY_BUCKETS),
+    'pdf_operation_input_bytes_total': (
+        'counter', 'Bytes uploaded to PDF operations', None),
+    'pdf_operation_output_bytes_total': (
+        'counter', 'Bytes produced by PDF operations', None),
+    'pdf_operation_pages_total': (
+        'counter', 'Pages processed by PDF operations', None),
+    'pdf_result_cache_requests_total': (
+        'counter', 'Result cache lookups by outcome', None)
+}
+
+
+class Metrics:
+    """
+    Prometheus counters and histograms for requests and PDF operations.
+    Each web process keeps its own samples and writes them to
+    UPLOAD_FOLDER/metrics/<pid>.json at most every METRICS_FLUSH_SECONDS;
+    render() merges every process's file so a scrape of any worker sees
+    the totals. Files of stopped processes are kept, as their counts are
+    part of the totals, and are picked up again if the PID is reused.
+    """
+
+    def __init__(self, app=None):
+        self.snapshot_dir = None
+        self.flush_interval = None
+        self._counters = {}
+        self._histograms = {}
+        self._dirty = False
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.snapshot_dir = os.path.join(app.config['UPLOAD_FOLDER'], 'metrics')
+        self.flush_interval = app.config['METRICS_FLUSH_SECONDS']
+        os.makedirs(self.snapshot_dir, exist_ok=True)
+        app.extensions['metrics'] = self
+        app.before_request(self._start_request)
+        app.after_request(self._finish_request)
+
+    def _start_request(self):
+        g.metrics_started = time.perf_counter()
+
+    def _finish_request(self, response):
+        started = g.pop('metrics_started', None)
+        if started is not None:
+            # The URL rule rather than the path, so IDs in URLs don't create new series
+            route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+            self.inc('http_requests_total', route=route, method=request.method, status=str(response.status_code))
+            self.observe('http_request_duration_seconds', time.perf_counter() - started,
+                         route=route, method=request.method)
+        return response
+
+    def inc(self, name, value=1, **labels):
+        """
+        Add to a counter
+        Args:
+            name: Counter name from METRICS
+            value: Amount to add
+            **labels: Label values of the series
+        """
+        key = (name, tuple(sorted(labels.items())))
+        self._ensure_thread()
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+            self._dirty = True
+
+    def observe(self, name, value, **labels):
+        """
+        Record a histogram observation
+        Args:
+            name: Histogram name from METRICS
+            value: Observed value, in seconds or bytes
+            **labels: Label values of the series
+        """
+        buckets = METRICS[name][2]
+        key = (name, tuple(sorted(labels.items())))
+        self._ensure_thread()
+        with self._lock:
+            counts, total, count = self._histograms.get(key, ([0] * len(buckets), 0.0, 0))
+            counts = [bucket_count + (value <= bound) for bucket_count, bound in zip(counts, buckets)]
+            self._histograms[key] = (counts, total + value, count + 1)
+            self._dirty = True
+
+    def record_operation(self, operation_type, success, duration, queue_wait=None, tier=None, cache_hit=None,
+                         bytes_in=None, bytes_out=None, pages=None, timings=None, peak_rss_bytes=None):
+        """
+        Record a finished PDF job
+        Args:
+            operation_type: merge, split, compress, convert, ...
+            success: Whether the job produced a result
+            duration: Seconds from the job starting until it finished
+            queue_wait: Seconds the job waited for a worker
+            tier: Subscription tier of the user, whose lane the job was queued in
+            cache_hit: True or False if the result cache was consulted
+            bytes_in: Total size of the inputs
+            bytes_out: Size of the result
+            pages: Number of pages processed
+            timings: Seconds per phase ('parse', 'transform', 'serialize')
+            peak_rss_bytes: Peak resident memory of the worker process
+        """
+        self.inc('pdf_operations_total', operation=operation_type, status='success' if success else 'failed')
+        self.observe('pdf_operation_duration_seconds', duration, operation=operation_type)
+        if queue_wait is not None:
+            self.observe('pdf_job_queue_wait_seconds', queue_wait, operation=operation_type, tier=tier or 'unknown')
+        if cache_hit is not None:
+            self.inc('pdf_result_cache_requests_total', result='hit' if cache_hit else 'miss')
+        for phase, seconds in (timings or {}).items():
+            self.observe('pdf_operation_phase_seconds', seconds, operation=operation_type, phase=phase)
+        if peak_rss_bytes:
+            self.observe('pdf_operation_peak_rss_bytes', peak_rss_bytes, operation=operation_type)
+        if bytes_in:
+            self.inc('pdf_operation_input_bytes_total', bytes_in, operation=operation_type)
+        if bytes_out:
+            self.inc('pdf_operation_output_bytes_total', bytes_out, operation=operation_type)
+        if pages:
+            self.inc('pdf_operation_pages_total', pages, operation=operation_type)
+
+    def _ensure_thread(self):
+        # Started lazily so forked web workers (e.g. gunicorn --preload) get their own
+        if self._thread is not None and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread is not None and self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._counters, self._histograms = {}, {}
+            self._load_previous()
+            self._thread = threading.Thread(target=self._run, name='metrics', daemon=True)
+            self._thread.start()
+            atexit.register(self.flush)
+
+    def _load_previous(self):
+        # A file for our PID was left by an earlier process; carry its counts on
+        try:
+            with open(self._snapshot_path(self._pid)) as f:
+                counters, histograms = _parse_snapshot(json.load(f))
+        except (OSError, ValueError):
+            return
+        self._counters.update(counters)
+        self._histograms.update(histograms)
+
+    def _snapshot_path(self, pid):
+        return os.path.join(self.snapshot_dir, f'{pid}.json')
+
+    def _run(self):
+        while True:
+            time.sleep(self.flush_interval)
+            self.flush()
+
+    def flush(self):
+        """Write this process's samples to its snapshot file if they changed"""
+        if self._pid != os.getpid():
+            return
+        with self._lock:
+            if not self._dirty:
+                return
+            snapshot = {
+                'counters': [[name, labels, value] for (name, labels), value in self._counters.items()],
+                'histograms': [
+                    [name, labels, counts, total, count]
+                    for (name, labels), (counts, total, count) in self._histograms.items()
+                ]
+            }
+            self._dirty = False
+
+        path = self._snapshot_path(self._pid)
+        temp_path = f'{path}.tmp'
+        with open(temp_path, 'w') as f:
+            json.dump(snapshot, f)
+        os.replace(temp_path, path)
+
+    def totals(self, name):
+        """
+        Merge one counter's samples from every process
+        Args:
+            name: Counter name from METRICS
+        Returns:
+            Dictionary of label tuple -> value, e.g. {(('result', 'hit'),): 3}
+        """
+        counters, _ = self._merge_snapshots()
+        return {labels: value for (sample_name, labels), value in counters.items() if sample_name == name}
+
+    def _merge_snapshots(self):
+        self.flush()
+        counters, histograms = {}, {}
+        for name in os.listdir(self.snapshot_dir):
+            if not name.endswith('.json'):
+                continue
+            try:
+                with open(os.path.join(self.snapshot_dir, name)) as f:
+                    file_counters, file_histograms = _parse_snapshot(json.load(f))
+            except (OSError, ValueError):
+                continue
+            for key, value in file_counters.items():
+                counters[key] = counters.get(key, 0) + value
+            for key, (counts, total, count) in file_histograms.items():
+                merged_counts, merged_total, merged_count = histograms.get(key, ([0] * len(counts), 0.0, 0))
+                histograms[key] = (
+                    [a + b for a, b in zip(merged_counts, counts)],
+                    merged_total + total,
+                    merged_count + count
+                )
+        return counters, histograms
+
+    def render(self):
+        """
+        Merge the samples of every process
+        Returns:
+            Metrics in the Prometheus text exposition format
+        """
+        counters, histograms = self._merge_snapshots()
+
+        lines = []
+        for name, (metric_type, help_text, buckets) in METRICS.items():
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} {metric_type}')
+            if metric_type == 'counter':
+                for (sample_name, labels), value in sorted(counters.items()):
+                    if sample_name == name:
+                        lines.append(f'{name}{_format_labels(labels)} {_format_value(value)}')
+                continue
+
+            for (sample_name, labels), (counts, total, count) in sorted(histograms.items()):
+                if sample_name != name:
+                    continue
+                for bound, bucket_count in zip(buckets, counts):
+                    lines.append(f'{name}_bucket{_format_labels(labels, le=_format_value(bound))} {bucket_count}')
+                lines.append(f'{name}_bucket{_format_labels(labels, le="+Inf")} {count}')
+                lines.append(f'{name}_sum{_format_labels(labels)} {_format_value(total)}')
+                lines.append(f'{name}_count{_format_labels(labels)} {count}')
+
+        return '\n'.join(lines) + '\n'
+
+
+def _parse_snapshot(snapshot):
+    counters = {
+        (name, tuple(tuple(label) for label in labels)): value
+        for name, labels, value in snapshot.get('counters', [])
+        if name in METRICS
+    }
+    histograms = {
+        (name, tuple(tuple(label) for label in labels)): (counts, total, count)
+        for name, labels, counts, total, count in snapshot.get('histograms', [])
+        # Skip series recorded with different buckets by an older version
+        if name in METRICS and len(counts) == len(METRICS[name][2])
+    }
+    return counters, histograms
+
+
+def _format_labels(labels, **extra):
+    pairs = list(labels) + list(extra.items())
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{key}="{_escape_label(value)}"' for key, value in pairs) + '}'
+
+
+def _escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_value(value):
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+metrics = Metrics()
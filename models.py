@@ -1,10 +1,71 @@
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import UserMixin
-from datetime import datetime
+import json
+from datetime import datetime, timedelta
+from sqlalchemy import case, inspect, or_, text, tuple_, update
+from sqlalchemy.exc import DBAPIError
 from werkzeug.security import generate_password_hash, check_password_hash
 
 db = SQLAlchemy()
 
+
+def ensure_schema():
+    """
+    Create missing tables, and add columns and indexes that were added to
+    the models after their table was created. Must run in an app context.
+    Safe to run from several processes at once: a change that fails because
+    another process made it first is skipped.
+    """
+    for table in db.metadata.sorted_tables:
+        _apply_schema_change(
+            lambda: table.create(db.engine, checkfirst=True),
+            lambda: not inspect(db.engine).has_table(table.name)
+        )
+
+        existing = _column_names(table)
+        for column in table.columns:
+            if column.name not in existing:
+                column_type = column.type.compile(dialect=db.engine.dialect)
+                _apply_schema_change(
+                    lambda: _execute_ddl(f'ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}'),
+                    lambda: column.name not in _column_names(table)
+                )
+
+        for index in table.indexes:
+            _apply_schema_change(
+                lambda: index.create(db.engine, checkfirst=True),
+                lambda: index.name not in {ix['name'] for ix in inspect(db.engine).get_indexes(table.name)}
+            )
+
+
+def _apply_schema_change(change, still_needed):
+    """Make a schema change; if it fails, only raise when it still hasn't been made"""
+    try:
+        change()
+    except DBAPIError:
+        db.session.rollback()
+        if still_needed():
+            raise
+
+
+def _column_names(table):
+    # A new inspector each time, so changes by other processes are seen
+    return {column['name'] for column in inspect(db.engine).get_columns(table.name)}
+
+
+def _execute_ddl(statement):
+    db.session.execute(text(statement))
+    db.session.commit()
+
+
+# Operations allowed per billing period, by subscription tier
+USAGE_LIMITS = {
+    'free': 5,
+    'basic': 100,
+    'pro': 1000
+}
+USAGE_PERIOD = timedelta(days=30)
+
 class User(UserMixin, db.Model):
     __tablename__ = 'users'
 
@@ -33,27 +94,45 @@ class User(UserMixin, db.Model):
         return check_password_hash(self.password_hash, password)
 
     def get_usage_limit(self):
-        limits = {
-            'free': 5,
-            'basic': 100,
-            'pro': 1000
-        }
-        return limits.get(self.subscription_tier, 5)
+        return USAGE_LIMITS.get(self.subscription_tier, USAGE_LIMITS['free'])
+
+    def usage_reset_due(self):
+        return self.usage_reset_date is None or datetime.utcnow() - self.usage_reset_date >= USAGE_PERIOD
+
+    def get_usage_count(self):
+        # The stored count is only reset by the next recorded operation
+        return 0 if self.usage_reset_due() else self.usage_count
 
     def can_perform_operation(self):
-        # Check if usage reset is needed (monthly)
-        if self.usage_reset_date:
-            days_since_reset = (datetime.utcnow() - self.usage_reset_date).days
-            if days_since_reset >= 30:
-                self.usage_count = 0
-                self.usage_reset_date = datetime.utcnow()
-                db.session.commit()
+        """Quick pre-check; the quota is enforced by consume_usage"""
+        return self.get_usage_count() < self.get_usage_limit()
 
-        return self.usage_count < self.get_usage_limit()
+    @staticmethod
+    def consume_usage(user_id):
+        """
+        Count one operation against the user's quota with a single conditional
+        UPDATE that also applies the monthly reset. Nothing is committed, so
+        the caller can commit it together with the job's final state.
+        Args:
+            user_id: ID of the user performing the operation
+        Returns:
+            False if the user is already at their limit, True otherwise
+        """
+        now = datetime.utcnow()
+        # Monthly reset happens inside the same statement
+        reset_due = or_(User.usage_reset_date.is_(None), User.usage_reset_date <= now - USAGE_PERIOD)
+        limit = case(USAGE_LIMITS, value=User.subscription_tier, else_=USAGE_LIMITS['free'])
 
-    def increment_usage(self):
-        self.usage_count += 1
-        db.session.commit()
+        result = db.session.execute(
+            update(User)
+            .where(User.id == user_id, or_(reset_due, User.usage_count < limit))
+            .values(
+                usage_count=case((reset_due, 1), else_=User.usage_count + 1),
+                usage_reset_date=case((reset_due, now), else_=User.usage_reset_date)
+            )
+            .execution_options(synchronize_session=False)
+        )
+        return result.rowcount > 0
 
     def __repr__(self):
         return f'<User {self.email}>'
@@ -61,13 +140,131 @@ class User(UserMixin, db.Model):
 
 class PDFOperation(db.Model):
     __tablename__ = 'pdf_operations'
+    __table_args__ = (
+        # Per-user history, newest first; id breaks ties between equal timestamps
+        db.Index('ix_pdf_operations_user_id_created_at', 'user_id', 'created_at', 'id'),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
     operation_type = db.Column(db.String(50), nullable=False)  # merge, split, compress, convert
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
     file_count = db.Column(db.Integer, default=1)
     success = db.Column(db.Boolean, default=True)
+    duration_ms = db.Column(db.Integer)
+    bytes_in = db.Column(db.BigInteger)
+    bytes_out = db.Column(db.BigInteger)
+    page_count = db.Column(db.Integer)
+    parse_ms = db.Column(db.Integer)
+    transform_ms = db.Column(db.Integer)
+    serialize_ms = db.Column(db.Integer)
+    peak_rss_bytes = db.Column(db.BigInteger)
+
+    @staticmethod
+    def history_page(user_id, limit, before=None):
+        """
+        One page of a user's operations, newest first, using keyset pagination
+        so every page is an index range scan no matter how deep it is
+        Args:
+            user_id: ID of the user
+            limit: Maximum number of operations to return
+            before: (created_at, id) of the last operation on the previous page, or None
+        Returns:
+            Tuple of (operations, has_more)
+        """
+        query = PDFOperation.query.filter(PDFOperation.user_id == user_id)
+        if before is not None:
+            query = query.filter(tuple_(PDFOperation.created_at, PDFOperation.id) < tuple_(*before))
+
+        operations = query.order_by(PDFOperation.created_at.desc(), PDFOperation.id.desc()).limit(limit + 1).all()
+        return operations[:limit], len(operations) > limit
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'operation_type': self.operation_type,
+            'file_count': self.file_count,
+            'success': self.success,
+            'duration_ms': self.duration_ms,
+            'bytes_in': self.bytes_in,
+            'bytes_out': self.bytes_out,
+            'page_count': self.page_count,
+            'parse_ms': self.parse_ms,
+            'transform_ms': self.transform_ms,
+            'serialize_ms': self.serialize_ms,
+            'peak_rss_bytes': self.peak_rss_bytes,
+            'created_at': self.created_at.isoformat() if self.created_at else None
+        }
 
     def __repr__(self):
         return f'<PDFOperation {self.operation_type} by User {self.user_id}>'
+
+
+class OperationRollup(db.Model):
+    """Operation totals per day, operation type and subscription tier, kept up to date by rollups.py"""
+    __tablename__ = 'operation_rollups'
+    __table_args__ = (db.UniqueConstraint('day', 'operation_type', 'subscription_tier'),)
+
+    id = db.Column(db.Integer, primary_key=True)
+    day = db.Column(db.Date, nullable=False, index=True)
+    operation_type = db.Column(db.String(50), nullable=False)
+    subscription_tier = db.Column(db.String(20), nullable=False)
+    operation_count = db.Column(db.Integer, nullable=False, default=0)
+    failed_count = db.Column(db.Integer, nullable=False, default=0)
+    file_count = db.Column(db.Integer, nullable=False, default=0)
+    bytes_in = db.Column(db.BigInteger, nullable=False, default=0)
+    bytes_out = db.Column(db.BigInteger, nullable=False, default=0)
+    duration_ms = db.Column(db.BigInteger, nullable=False, default=0)
+
+    def __repr__(self):
+        return f'<OperationRollup {self.day} {self.operation_type} {self.subscription_tier}>'
+
+
+class StatCounter(db.Model):
+    """Running totals shown on the admin dashboard (total_users, paid_users, total_operations)"""
+    __tablename__ = 'stat_counters'
+
+    name = db.Column(db.String(50), primary_key=True)
+    value = db.Column(db.BigInteger, nullable=False, default=0)
+
+    def __repr__(self):
+        return f'<StatCounter {self.name}={self.value}>'
+
+
+class Job(db.Model):
+    __tablename__ = 'jobs'
+
+    id = db.Column(db.String(32), primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False, index=True)
+    operation_type = db.Column(db.String(50), nullable=False)  # merge, split, compress, convert
+    status = db.Column(db.String(20), default='queued')  # queued, running, done, failed
+    params = db.Column(db.Text)  # JSON encoded operation options
+    file_count = db.Column(db.Integer, default=1)
+    result_name = db.Column(db.String(255))
+    result_mimetype = db.Column(db.String(100))
+    report = db.Column(db.Text)  # JSON encoded details from the operation, e.g. bytes saved
+    error = db.Column(db.Text)
+    profile = db.Column(db.Boolean, default=False)  # Run under the profiler, see profiling.py
+    worker_id = db.Column(db.String(64))  # Process that owns the job while it is queued or running
+    heartbeat_at = db.Column(db.DateTime)  # Last time the owner showed it was alive
+    attempts = db.Column(db.Integer, default=0)  # Times the job was started
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    started_at = db.Column(db.DateTime)
+    finished_at = db.Column(db.DateTime, index=True)
+
+    def to_dict(self):
+        return {
+            'job_id': self.id,
+            'operation_type': self.operation_type,
+            'status': self.status,
+            'file_count': self.file_count,
+            'result_name': self.result_name,
+            'report': json.loads(self.report) if self.report else None,
+            'error': self.error,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'started_at': self.started_at.isoformat() if self.started_at else None,
+            'finished_at': self.finished_at.isoformat() if self.finished_at else None
+        }
+
+    def __repr__(self):
+        return f'<Job {self.id} {self.operation_type} {self.status}>'
@@ -0,0 +1,231 @@
+import os
+import json
+import time
+import atexit
+import threading
+import multiprocessing
+from datetime import datetime
+from models import db, PDFOperation
+from rollups import record_operations
+
+# Every column a record can set; spools written by older versions lack some
+RECORD_FIELDS = (
+    'user_id', 'operation_type', 'file_count', 'success', 'duration_ms', 'bytes_in', 'bytes_out',
+    'page_count', 'parse_ms', 'transform_ms', 'serialize_ms', 'peak_rss_bytes', 'created_at'
+)
+
+
+class OperationLogger:
+    """
+    Write-behind logger for PDFOperation records. log() only appends to an
+    in-memory buffer; a background thread copies records to a per-process
+    append-only spool under UPLOAD_FOLDER/oplog and bulk-inserts them once
+    OPERATION_LOG_BATCH_SIZE records are waiting or OPERATION_LOG_FLUSH_SECONDS
+    have passed. Spools left behind by processes that died are replayed on
+    startup.
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        self.spool_dir = None
+        self.batch_size = None
+        self.flush_interval = None
+        self._pending = []
+        self._unflushed = []
+        self._spool = None
+        self._last_flush = time.monotonic()
+        self._condition = threading.Condition()
+        self._flush_lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        self.spool_dir = os.path.join(app.config['UPLOAD_FOLDER'], 'oplog')
+        self.batch_size = app.config['OPERATION_LOG_BATCH_SIZE']
+        self.flush_interval = app.config['OPERATION_LOG_FLUSH_SECONDS']
+        os.makedirs(self.spool_dir, exist_ok=True)
+        # Replay spools from before a restart without waiting for the first operation
+        if multiprocessing.current_process().name == 'MainProcess':
+            self._ensure_thread()
+
+    def log(self, user_id, operation_type, file_count=1, success=True,
+            duration_ms=None, bytes_in=None, bytes_out=None, page_count=None,
+            parse_ms=None, transform_ms=None, serialize_ms=None, peak_rss_bytes=None):
+        """
+        Queue a PDFOperation record
+        Args:
+            user_id: ID of the user who ran the operation
+            operation_type: merge, split, compress, convert, ...
+            file_count: Number of input files
+            success: Whether the operation produced a result
+            duration_ms: Processing time in milliseconds
+            bytes_in: Total size of the inputs
+            bytes_out: Size of the result
+            page_count: Number of pages processed
+            parse_ms: Time spent reading the inputs, in milliseconds
+            transform_ms: Time spent changing the document, in milliseconds
+            serialize_ms: Time spent writing the result, in milliseconds
+            peak_rss_bytes: Peak resident memory of the worker process
+        """
+        record = {
+            'user_id': user_id,
+            'operation_type': operation_type,
+            'file_count': file_count,
+            'success': success,
+            'duration_ms': duration_ms,
+            'bytes_in': bytes_in,
+            'bytes_out': bytes_out,
+            'page_count': page_count,
+            'parse_ms': parse_ms,
+            'transform_ms': transform_ms,
+            'serialize_ms': serialize_ms,
+            'peak_rss_bytes': peak_rss_bytes,
+            'created_at': datetime.utcnow().isoformat()
+        }
+        self._ensure_thread()
+        with self._condition:
+            self._pending.append(record)
+            self._condition.notify()
+
+    def _ensure_thread(self):
+        # Started lazily so forked web workers (e.g. gunicorn --preload) get their own
+        if self._thread is not None and self._pid == os.getpid():
+            return
+        with self._condition:
+            if self._thread is not None and self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._pending, self._unflushed, self._spool = [], [], None
+            self._flush_lock = threading.Lock()
+            self._thread = threading.Thread(target=self._run, name='operation-log', daemon=True)
+            self._thread.start()
+            atexit.register(self.flush)
+
+    def _spool_path(self, pid):
+        return os.path.join(self.spool_dir, f'{pid}.jsonl')
+
+    def _run(self):
+        replay_pending = True
+        while True:
+            with self._condition:
+                self._condition.wait(timeout=self.flush_interval)
+            try:
+                self._drain(force=False)
+            except Exception as e:
+                # Records stay spooled and are retried on the next pass
+                self.app.logger.warning(f"Error writing operation log: {str(e)}")
+
+            if replay_pending:
+                with self._flush_lock:
+                    replay_pending = not self._replay_orphans()
+
+    def flush(self):
+        """Insert everything logged so far"""
+        if self._pid != os.getpid():
+            return
+        try:
+            self._drain(force=True)
+        except Exception as e:
+            self.app.logger.warning(f"Error writing operation log: {str(e)}")
+
+    def _drain(self, force):
+        with self._condition:
+            pending, self._pending = self._pending, []
+
+        # Separate lock so log() never waits on the database
+        with self._flush_lock:
+            if pending:
+                if self._spool is None:
+                    self._spool = open(self._spool_path(self._pid), 'a')
+                self._spool.write(''.join(json.dumps(record) + '\n' for record in pending))
+                self._spool.flush()
+                self._unflushed.extend(pending)
+
+            due = time.monotonic() - self._last_flush >= self.flush_interval
+            if not self._unflushed or not (force or due or len(self._unflushed) >= self.batch_size):
+                return
+
+            self._insert(self._unflushed)
+            self._unflushed = []
+            self._last_flush = time.monotonic()
+            # Everything spooled is in the database now
+            self._spool.truncate(0)
+            self._spool.seek(0)
+
+    def _insert(self, records):
+        # Bulk inserts need the same keys in every row
+        rows = [{field: record.get(field) for field in RECORD_FIELDS} for record in records]
+        for row in rows:
+            row['created_at'] = datetime.fromisoformat(row['created_at'])
+        with self.app.app_context():
+            try:
+                db.session.execute(PDFOperation.__table__.insert(), rows)
+                # Rollups move in the same transaction as the rows they count
+                record_operations(rows)
+                db.session.commit()
+            except Exception:
+                db.session.rollback()
+                raise
+
+    def _replay_orphans(self):
+        """
+        Insert records spooled by processes that are no longer running
+        Returns:
+            True if every orphaned spool was replayed
+        """
+        replayed = True
+        for name in os.listdir(self.spool_dir):
+            pid = _spool_owner(name)
+            if pid is None:
+                continue
+            if pid == self._pid:
+                # Left by an earlier process with the same PID, unless we've started spooling ourselves
+                if self._spool is not None:
+                    continue
+            elif _pid_alive(pid):
+                continue
+
+            path = os.path.join(self.spool_dir, name)
+            claimed = path if '.replay-' in name and pid == self._pid else f'{path}.replay-{self._pid}'
+            if claimed != path:
+                try:
+                    # Rename is atomic, so only one process replays a given spool
+                    os.rename(path, claimed)
+                except OSError:
+                    continue
+
+            try:
+                with open(claimed) as f:
+                    records = [json.loads(line) for line in f if line.strip()]
+                if records:
+                    self._insert(records)
+                os.remove(claimed)
+            except Exception as e:
+                self.app.logger.warning(f"Error replaying operation log {name}: {str(e)}")
+                replayed = False
+
+        return replayed
+
+
+def _spool_owner(name):
+    """PID of the process that owns a spool file, or None for unrelated files"""
+    if '.replay-' in name:
+        owner = name.rsplit('.replay-', 1)[1]
+    elif name.endswith('.jsonl'):
+        owner = name[:-len('.jsonl')]
+    else:
+        return None
+    return int(owner) if owner.isdigit() else None
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
@@ -0,0 +1,316 @@
+import os
+import sys
+import uuid
+import signal
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from concurrent.futures.process import BrokenProcessPool
+import pdf_utils
+from pdf_utils import PDFProcessor, timed_phase
+from profiling import profile_call
+
+try:
+    import resource
+except ImportError:  # Windows has no per-process rlimits
+    resource = None
+
+
+class TaskLimitExceeded(Exception):
+    """Raised when a task exceeds its CPU-time or memory budget"""
+
+
+def _merge(input_paths, output_path, params):
+    report = {}
+    with open(output_path, 'wb') as output:
+        PDFProcessor.merge_pdfs(input_paths, report, output, params.get('fragments'))
+    return report
+
+
+def _merge_fragment(input_paths, output_path, params):
+    report = {}
+    with open(output_path, 'wb') as output:
+        PDFProcessor.write_merge_fragment(input_paths[0], output, report)
+    return report
+
+
+def _split(input_paths, output_path, params):
+    report = {}
+    page_ranges = params.get('page_ranges')
+    if page_ranges is not None:
+        page_ranges = [tuple(page_range) for page_range in page_ranges]
+
+    with open(output_path, 'wb') as result_file:
+        for chunk in PDFProcessor.split_pdf_zip(input_paths[0], page_ranges, report):
+            with timed_phase(report, 'serialize'):
+                result_file.write(chunk)
+    return report
+
+
+def _compress(input_paths, output_path, params):
+    report = {}
+    with open(output_path, 'wb') as output:
+        PDFProcessor.compress_pdf(input_paths[0], params.get('quality', 'medium'), report, output)
+    return report
+
+
+def _convert(input_paths, output_path, params):
+    report = {}
+    with open(output_path, 'wb') as output:
+        PDFProcessor.image_to_pdf(input_paths, params.get('dpi', 150), report, output)
+    return report
+
+
+def _pipeline(input_paths, output_path, params):
+    report = {}
+    with open(output_path, 'wb') as output:
+        PDFProcessor.run_pipeline(input_paths[0], params['steps'], report, output)
+    return report
+
+
+# Operation type -> task(input_paths, output_path, params), run inside a worker process.
+# Tasks write straight into output_path so results never have to fit in memory.
+# A task may return a small JSON-serializable report about the work done; phase
+# timings under 'timings' are split off into the usage _run_task returns.
+TASKS = {
+    'merge': _merge,
+    'split': _split,
+    'compress': _compress,
+    'convert': _convert,
+    'pipeline': _pipeline,
+    # One input of a merge, parsed ahead of time; see PDFExecutor._run_merge
+    'merge_fragment': _merge_fragment
+}
+
+
+def _raise_cpu_limit(signum, frame):
+    raise TaskLimitExceeded("Processing took too long and was stopped")
+
+
+def _init_worker(memory_limit_mb, spool_dir, spool_bytes):
+    pdf_utils.SPOOL_DIR = spool_dir
+    pdf_utils.OUTPUT_SPOOL_BYTES = spool_bytes
+    if resource is None:
+        return
+
+    signal.signal(signal.SIGXCPU, _raise_cpu_limit)
+    if memory_limit_mb:
+        limit = memory_limit_mb * 1024 * 1024
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+
+
+def _warm_up():
+    return os.getpid()
+
+
+def _reset_peak_rss():
+    # Linux lets a process reset its high-water mark, so the peak is per task
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+    except OSError:
+        pass
+
+
+def _peak_rss_bytes():
+    """Peak resident memory since _reset_peak_rss, or over the process lifetime where that can't be reset"""
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and kilobytes elsewhere
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def _run_task(operation_type, input_paths, output_path, params, cpu_limit_seconds, profile_path=None):
+    """Entry point inside the worker process. Only paths cross the process boundary."""
+    _reset_peak_rss()
+    args = (operation_type, input_paths, output_path, params, cpu_limit_seconds)
+    peak_traced_bytes = None
+    if profile_path:
+        report, peak_traced_bytes = profile_call(_run_limited, args, profile_path)
+    else:
+        report = _run_limited(*args)
+
+    report = report or {}
+    usage = {'timings': report.pop('timings', {}), 'peak_rss_bytes': _peak_rss_bytes()}
+    if peak_traced_bytes is not None:
+        usage['peak_traced_bytes'] = peak_traced_bytes
+    return report or None, usage
+
+
+def _run_limited(operation_type, input_paths, output_path, params, cpu_limit_seconds):
+    if resource is None or not cpu_limit_seconds:
+        return TASKS[operation_type](input_paths, output_path, params)
+
+    # RLIMIT_CPU counts the whole process lifetime, so budget relative to the CPU already used
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    used = int(usage.ru_utime + usage.ru_stime)
+    _, hard = resource.getrlimit(resource.RLIMIT_CPU)
+    resource.setrlimit(resource.RLIMIT_CPU, (used + cpu_limit_seconds, hard))
+    try:
+        return TASKS[operation_type](input_paths, output_path, params)
+    except Exception as e:
+        # PDFProcessor re-wraps errors, so look at the original cause too
+        if isinstance(e, MemoryError) or isinstance(e.__context__, MemoryError):
+            raise TaskLimitExceeded("File needs more memory than allowed to process")
+        raise
+    finally:
+        resource.setrlimit(resource.RLIMIT_CPU, (hard, hard))
+
+
+class PDFExecutor:
+    """
+    Runs PDFProcessor work on a warm pool of worker processes so CPU-bound
+    parsing and serialization is not serialized by the GIL. Inputs and
+    outputs are passed as file paths; each task gets a CPU-time budget and
+    each worker a memory cap so a hostile PDF only fails its own job.
+    Merges parse each input in its own task, several at a time, so a merge
+    uses idle workers without taking the whole pool from the other jobs.
+    The pool is started by start(), or by the first run(), not by init_app,
+    so a process that only imports the app (e.g. a CLI command) has none.
+    """
+
+    def __init__(self, app=None, max_workers=None):
+        self.max_workers = max_workers
+        self.merge_parallelism = None
+        self.cpu_limit_seconds = None
+        self.memory_limit_mb = None
+        self.spool_dir = None
+        self.spool_bytes = None
+        self._pool = None
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.max_workers = self.max_workers or app.config['PDF_PROCESS_WORKERS']
+        # Each job thread's fair share of the pool, so one merge's fragments
+        # can't queue ahead of the jobs the scheduler picked for other threads
+        self.merge_parallelism = max(1, self.max_workers // app.config['JOB_WORKERS'])
+        self.cpu_limit_seconds = app.config['PDF_TASK_CPU_SECONDS']
+        self.memory_limit_mb = app.config['PDF_TASK_MEMORY_MB']
+        self.spool_dir = os.path.abspath(app.config['SPOOL_FOLDER'])
+        self.spool_bytes = app.config['PDF_OUTPUT_SPOOL_MB'] * 1024 * 1024
+        os.makedirs(self.spool_dir, exist_ok=True)
+
+    def start(self):
+        """Start the worker processes, unless this process already has them"""
+        # Worker processes may re-import the main module (e.g. `python app.py`);
+        # only the top-level process owns a pool
+        if multiprocessing.current_process().name != 'MainProcess':
+            return
+        with self._lock:
+            if self._pool is None:
+                self._start_pool()
+
+    def _start_pool(self):
+        if 'forkserver' in multiprocessing.get_all_start_methods():
+            # Workers fork from a clean server that has only the PDF libraries loaded
+            context = multiprocessing.get_context('forkserver')
+            context.set_forkserver_preload(['pdf_executor'])
+        else:
+            context = multiprocessing.get_context('spawn')
+
+        self._pool = ProcessPoolExecutor(
+            max_workers=self.max_workers,
+            mp_context=context,
+            initializer=_init_worker,
+            initargs=(self.memory_limit_mb, self.spool_dir, self.spool_bytes)
+        )
+        # Start the workers now so the first job doesn't pay for process startup
+        for _ in range(self.max_workers):
+            self._pool.submit(_warm_up)
+
+    def run(self, operation_type, input_paths, output_path, params=None, profile_path=None):
+        """
+        Run an operation in a worker process and wait for it
+        Args:
+            operation_type: Key of TASKS
+            input_paths: List of input file paths, in processing order
+            output_path: Path the result is written to
+            params: Dictionary of operation options
+            profile_path: If given, profile the task with profiling.profile_call to this path
+        Returns:
+            Tuple of (report, usage): the task's report or None, and a dictionary
+            with seconds per phase under 'timings', 'peak_rss_bytes' and, when
+            profiled, 'peak_traced_bytes'
+        """
+        if operation_type not in TASKS:
+            raise ValueError(f"Unknown operation: {operation_type}")
+
+        self.start()
+        pool = self._pool
+        try:
+            # Merge inputs are parsed in parallel, except when profiling one process
+            parallel = self.merge_parallelism > 1 and not profile_path
+            if operation_type == 'merge' and len(input_paths) > 1 and parallel:
+                return self._run_merge(pool, list(input_paths), output_path, params or {})
+            future = pool.submit(
+                _run_task, operation_type, list(input_paths), output_path,
+                params or {}, self.cpu_limit_seconds, profile_path
+            )
+            return future.result()
+        except BrokenProcessPool:
+            # A worker died (e.g. killed by the OS); replace the pool for later jobs
+            with self._lock:
+                if self._pool is pool:
+                    pool.shutdown(wait=False, cancel_futures=True)
+                    self._start_pool()
+            raise TaskLimitExceeded("Processing failed because the worker stopped unexpectedly")
+
+    def _run_merge(self, pool, input_paths, output_path, params):
+        """
+        Turn each merge input into a fragment file in its own task, with at
+        most merge_parallelism of them in the pool at once, then assemble the
+        fragments in order in one more task. Timings are summed over the tasks
+        and the peak memory is the largest of them.
+        """
+        fragment_paths = [
+            os.path.join(self.spool_dir, f'{uuid.uuid4().hex}.fragment') for _ in input_paths
+        ]
+        try:
+            futures, pending = [], set()
+            try:
+                for input_path, fragment_path in zip(input_paths, fragment_paths):
+                    if len(pending) >= self.merge_parallelism:
+                        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                        # Stop queueing fragments once one has failed
+                        for future in done:
+                            future.result()
+                    future = pool.submit(
+                        _run_task, 'merge_fragment', [input_path], fragment_path, {}, self.cpu_limit_seconds
+                    )
+                    futures.append(future)
+                    pending.add(future)
+            finally:
+                # Let every task finish before the fragments are removed
+                wait(pending)
+            usages = [future.result()[1] for future in futures]
+
+            report, usage = pool.submit(
+                _run_task, 'merge', input_paths, output_path,
+                dict(params, fragments=fragment_paths), self.cpu_limit_seconds
+            ).result()
+            usages.append(usage)
+        finally:
+            for fragment_path in fragment_paths:
+                if os.path.exists(fragment_path):
+                    os.remove(fragment_path)
+
+        timings = {}
+        for task_usage in usages:
+            for phase, seconds in task_usage['timings'].items():
+                timings[phase] = timings.get(phase, 0.0) + seconds
+        peaks = [task_usage['peak_rss_bytes'] for task_usage in usages if task_usage['peak_rss_bytes']]
+        return report, {'timings': timings, 'peak_rss_bytes': max(peaks, default=None)}
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,343 @@
+import io
+import re
+import pickle
+import hashlib
+from collections import deque
+from PyPDF2.generic import ArrayObject, DictionaryObject, IndirectObject, StreamObject
+from pdf_writer import StreamingPdfWriter
+
+# Page dictionary entries that are replaced rather than copied
+PAGE_TREE_KEYS = ('/Parent',)
+# Object number that fragment records use for the merged document's page tree
+PAGE_TREE = 0
+
+
+def header_version(pdf_file):
+    """
+    Read the version from a PDF header without parsing the file
+    Args:
+        pdf_file: PDF file object or path
+    Returns:
+        Version string such as '1.4', or None if there is no header
+    """
+    if hasattr(pdf_file, 'read'):
+        position = pdf_file.tell()
+        head = pdf_file.read(1024)
+        pdf_file.seek(position)
+    else:
+        with open(pdf_file, 'rb') as f:
+            head = f.read(1024)
+    match = re.search(rb'%PDF-(\d\.\d)', head)
+    return match.group(1).decode('ascii') if match else None
+
+
+def iter_fragment(reader):
+    """
+    Copy a document's pages, and the objects they use, into fragment records
+    for StreamingMerger.append. Objects are numbered from 1 within the
+    fragment and serialized bodies are lists of bytes and ints, the ints
+    being references, so records can be produced in another process and
+    renumbered as they are written.
+    Args:
+        reader: PdfReader of the source
+    Yields:
+        ('page', number, body) for each page, in order,
+        ('object', number, body), ('stream', number, dictionary, data),
+        ('shared', number, digest, dictionary, data) for streams without references,
+        and finally ('outline', items)
+    """
+    yield from _FragmentCopier(reader).records()
+
+
+def write_fragment(records, output):
+    """Save fragment records to a binary file"""
+    for record in records:
+        pickle.dump(record, output, pickle.HIGHEST_PROTOCOL)
+
+
+def read_fragment(fragment_file):
+    """Load fragment records saved by write_fragment, one at a time"""
+    while True:
+        try:
+            yield pickle.load(fragment_file)
+        except EOFError:
+            return
+
+
+class _FragmentCopier:
+    """Walks one document for iter_fragment"""
+
+    def __init__(self, reader):
+        self.reader = reader
+        self.remap = {}  # (idnum, generation) in the source -> number in the fragment
+        self.count = 0
+        self.pending = deque()
+        self.output = []
+
+    def _new_number(self):
+        self.count += 1
+        return self.count
+
+    def records(self):
+        pages = self.reader.pages
+        # Pages get their numbers up front so links and outline items between them resolve
+        numbers = []
+        for page in pages:
+            number = self._new_number()
+            numbers.append(number)
+            reference = page.indirect_reference
+            if reference is not None:
+                self.remap[(reference.idnum, reference.generation)] = number
+
+        for number, page in zip(numbers, pages):
+            parts = [b'<<']
+            for key, value in page.items():
+                if key in PAGE_TREE_KEYS:
+                    continue
+                parts.append(_to_bytes(key) + b' ')
+                self._serialize(value, parts)
+                parts.append(b'\n')
+            parts += [b'/Parent ', PAGE_TREE, b'>>']
+            self.output.append(('page', number, _compact(parts)))
+
+            while self.pending:
+                number, obj = self.pending.popleft()
+                parts = []
+                self._serialize(obj, parts)
+                self.output.append(('object', number, _compact(parts)))
+
+            yield from self.output
+            self.output = []
+            # Objects already copied are only needed as numbers now
+            self.reader.resolved_objects.clear()
+
+        yield ('outline', self._copy_outline(self.reader.outline))
+
+    def _serialize(self, value, parts):
+        """Serialize a direct value into parts, copying what it references"""
+        if isinstance(value, IndirectObject):
+            parts.append(self._reference(value))
+        elif isinstance(value, DictionaryObject):
+            parts.append(b'<<')
+            for key, item in value.items():
+                parts.append(_to_bytes(key) + b' ')
+                self._serialize(item, parts)
+                parts.append(b'\n')
+            parts.append(b'>>')
+        elif isinstance(value, ArrayObject):
+            parts.append(b'[')
+            for index, item in enumerate(value):
+                if index:
+                    parts.append(b' ')
+                self._serialize(item, parts)
+            parts.append(b']')
+        else:
+            parts.append(_to_bytes(value))
+
+    def _reference(self, reference):
+        """Fragment number for a reference in the source, copying the object on first use"""
+        key = (reference.idnum, reference.generation)
+        number = self.remap.get(key)
+        if number is not None:
+            return number
+
+        obj = reference.get_object()
+        number = self._new_number()
+        # Registered before copying what the object references, in case that refers back to it
+        self.remap[key] = number
+        if not isinstance(obj, StreamObject):
+            self.pending.append((number, obj))
+            return number
+
+        data = _stream_data(obj)
+        entries = [(name, value) for name, value in obj.items() if name != '/Length']
+        if not any(_has_references(value) for _, value in entries):
+            dictionary = b' '.join(_to_bytes(name) + b' ' + _to_bytes(value) for name, value in entries)
+            digest = hashlib.sha256(dictionary + b'\nstream\n' + data).digest()
+            self.output.append(('shared', number, digest, dictionary, data))
+        else:
+            parts = []
+            for name, value in entries:
+                parts.append(_to_bytes(name) + b' ')
+                self._serialize(value, parts)
+                parts.append(b' ')
+            self.output.append(('stream', number, _compact(parts), data))
+        return number
+
+    def _copy_outline(self, outline):
+        """
+        Turn PdfReader.outline into (entries, open, children) tuples, entries being
+        the serialized /Title, /Dest, /C and /F values with references to copied pages
+        """
+        items = []
+        for entry in outline:
+            if isinstance(entry, list):
+                if items:
+                    items[-1][2].extend(self._copy_outline(entry))
+                continue
+
+            parts = [b'/Title ' + _to_bytes(entry['/Title'])]
+            page = entry.raw_get('/Page')
+            if isinstance(page, IndirectObject) and (page.idnum, page.generation) in self.remap:
+                parts += [
+                    b' /Dest [', self.remap[(page.idnum, page.generation)], b' ',
+                    b' '.join(_to_bytes(value) for value in entry.dest_array[1:]), b']'
+                ]
+            for key in ('/C', '/F'):
+                if key in entry:
+                    parts.append(b' %s %s' % (key.encode('ascii'), _to_bytes(entry[key])))
+            items.append((_compact(parts), entry.get('/Count', 0) > 0, []))
+        return items
+
+
+class StreamingMerger:
+    """
+    Merges documents by writing each source's fragment records (see
+    iter_fragment) straight into a StreamingPdfWriter, renumbering them on
+    the way. Only a number per object of the current source is kept, so
+    memory doesn't grow with the total size of the sources. The page tree,
+    outline and cross-reference table are written by close().
+
+    Streams whose dictionaries hold no references (font files, ICC profiles,
+    most images) are written once and shared by every source that repeats them.
+    """
+
+    def __init__(self, output, version='1.4'):
+        self.writer = StreamingPdfWriter(output, version)
+        self.pages_number = self.writer.reserve()
+        self.kids = []
+        self.outline = []
+        self.dedup_stats = {'objects_removed': 0, 'bytes_removed': 0}
+        self._streams = {}  # digest -> object number
+
+    def append(self, records):
+        """
+        Add a source document
+        Args:
+            records: Fragment records of the source, from iter_fragment or read_fragment
+        """
+        numbers = {PAGE_TREE: self.pages_number}
+
+        def number(local):
+            if local not in numbers:
+                numbers[local] = self.writer.reserve()
+            return numbers[local]
+
+        def resolve(parts):
+            return b''.join(b'%d 0 R' % number(part) if isinstance(part, int) else part for part in parts)
+
+        for record in records:
+            kind = record[0]
+            if kind == 'page':
+                _, local, body = record
+                self.kids.append(number(local))
+                self.writer.write_object(resolve(body), numbers[local])
+            elif kind == 'object':
+                _, local, body = record
+                self.writer.write_object(resolve(body), number(local))
+            elif kind == 'stream':
+                _, local, dictionary, data = record
+                self.writer.write_stream(resolve(dictionary), data, number(local))
+            elif kind == 'shared':
+                _, local, digest, dictionary, data = record
+                existing = self._streams.get(digest)
+                # A shared stream's record comes before anything that refers to it
+                if existing is not None and local not in numbers:
+                    numbers[local] = existing
+                    self.dedup_stats['objects_removed'] += 1
+                    self.dedup_stats['bytes_removed'] += len(data)
+                else:
+                    self._streams[digest] = self.writer.write_stream(dictionary, data, number(local))
+            elif kind == 'outline':
+                self.outline.extend(self._resolve_outline(record[1], resolve))
+
+    def _resolve_outline(self, items, resolve):
+        return [
+            (resolve(entries), is_open, self._resolve_outline(children, resolve))
+            for entries, is_open, children in items
+        ]
+
+    def close(self):
+        """Write the outline, page tree, catalog and cross-reference table"""
+        catalog = b'/Type /Catalog /Pages %d 0 R' % self.pages_number
+        if self.outline:
+            outline_number = self.writer.reserve()
+            first, last, count = self._write_outline_items(self.outline, outline_number)
+            self.writer.write_object(
+                b'<</Type /Outlines /First %d 0 R /Last %d 0 R /Count %d>>' % (first, last, count),
+                outline_number
+            )
+            catalog += b' /Outlines %d 0 R' % outline_number
+
+        self.writer.write_object(
+            b'<</Type /Pages /Kids [%s] /Count %d>>' % (
+                b' '.join(b'%d 0 R' % number for number in self.kids),
+                len(self.kids)
+            ),
+            self.pages_number
+        )
+        root = self.writer.write_object(b'<<' + catalog + b'>>')
+        self.writer.close(root)
+
+    def _write_outline_items(self, items, parent):
+        """Write one level of the outline; returns its first and last object numbers and visible count"""
+        numbers = [self.writer.reserve() for _ in items]
+        visible = len(items)
+        for index, (entries, is_open, children) in enumerate(items):
+            body = entries + b' /Parent %d 0 R' % parent
+            if index > 0:
+                body += b' /Prev %d 0 R' % numbers[index - 1]
+            if index < len(items) - 1:
+                body += b' /Next %d 0 R' % numbers[index + 1]
+            if children:
+                first, last, count = self._write_outline_items(children, numbers[index])
+                # Positive counts are open, negative closed
+                body += b' /First %d 0 R /Last %d 0 R /Count %d' % (first, last, count if is_open else -count)
+                if is_open:
+                    visible += count
+            self.writer.write_object(b'<<' + body + b'>>', numbers[index])
+        return numbers[0], numbers[-1], visible
+
+
+def _compact(parts):
+    """Join runs of bytes in a list of bytes and ints"""
+    compacted, run = [], []
+    for part in parts:
+        if isinstance(part, int):
+            if run:
+                compacted.append(b''.join(run))
+                run = []
+            compacted.append(part)
+        else:
+            run.append(part)
+    if run:
+        compacted.append(b''.join(run))
+    return compacted
+
+
+def _has_references(value):
+    if isinstance(value, IndirectObject):
+        return True
+    if isinstance(value, DictionaryObject):
+        return any(_has_references(item) for item in value.values())
+    if isinstance(value, ArrayObject):
+        return any(_has_references(item) for item in value)
+    return False
+
+
+def _stream_data(stream):
+    data = stream._data
+    return data.encode('latin-1') if isinstance(data, str) else data
+
+
+def _to_bytes(value):
+    """Serialize a value that holds no references"""
+    if isinstance(value, DictionaryObject):
+        return b'<<' + b' '.join(
+            _to_bytes(key) + b' ' + _to_bytes(item) for key, item in value.items()
+        ) + b'>>'
+    if isinstance(value, ArrayObject):
+        return b'[' + b' '.join(_to_bytes(item) for item in value) + b']'
+    out = io.BytesIO()
+    value.write_to_stream(out, None)
+    return out.getvalue()
@@ -1,43 +1,223 @@
 import os
 import io
-from PyPDF2 import PdfReader, PdfWriter, PdfMerger
-from PIL import Image
-from reportlab.pdfgen import canvas
-from reportlab.lib.pagesizes import letter, A4
+import mmap
+import time
+import shutil
 import tempfile
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+from PyPDF2 import PdfReader, PdfWriter
+from PyPDF2.generic import DictionaryObject, IndirectObject, NameObject, create_string_object
+from reportlab.lib.pagesizes import letter, A4
+import zipfile
+from image_compression import COMPRESSION_LEVELS, recompress_images
+from stream_dedup import dedup_streams
+from pdf_writer import StreamingPdfWriter, IncrementalPdfWriter
+from preflight import preflight
+from pdf_merge import StreamingMerger, header_version, iter_fragment, read_fragment, write_fragment
+from image_pdf import load_image, write_image_page
+
+# Operations run_pipeline can chain
+PIPELINE_STEPS = ('extract', 'rotate', 'compress', 'metadata')
+# Document information entries a metadata step can set, and their longest length
+METADATA_FIELDS = {'title': '/Title', 'author': '/Author', 'subject': '/Subject', 'keywords': '/Keywords'}
+MAX_METADATA_LENGTH = 1000
+
+# Outputs are kept in memory up to this size, then moved to a temporary file in
+# SPOOL_DIR (None for the system default). PDFExecutor workers set both from the config.
+OUTPUT_SPOOL_BYTES = 16 * 1024 * 1024
+SPOOL_DIR = None
+
+
+@contextmanager
+def timed_phase(report, phase):
+    """Add the time spent in the block to report['timings'][phase], in seconds"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        if report is not None:
+            timings = report.setdefault('timings', {})
+            timings[phase] = timings.get(phase, 0.0) + time.perf_counter() - started
+
+
+def open_input(pdf_file):
+    """
+    Memory-map a PDF given by path so PdfReader parses it in place rather
+    than reading the whole file into a BytesIO first
+    Args:
+        pdf_file: PDF file object or path
+    Returns:
+        A read-only mmap, or pdf_file itself if it is already a file object
+    """
+    if hasattr(pdf_file, 'read'):
+        return pdf_file
+    with open(pdf_file, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            # Can't map an empty file; PdfReader reports it as invalid
+            return io.BytesIO()
+        # The mapping stays valid after the file is closed
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def new_output():
+    """Temporary file for an output document that moves to disk once it passes OUTPUT_SPOOL_BYTES"""
+    return tempfile.SpooledTemporaryFile(max_size=OUTPUT_SPOOL_BYTES, dir=SPOOL_DIR)
+
+
+def write_incremental_update(pdf_file, reader, objects, output, info=None):
+    """
+    Write a document as its original bytes plus an incremental update
+    holding the objects that were edited in place
+    Args:
+        pdf_file: PDF file object or path reader was opened on
+        reader: PdfReader of pdf_file
+        objects: Edited objects read from it, e.g. page dictionaries after page.rotate()
+        output: Binary file to write to
+        info: Optional new document information dictionary
+    Returns:
+        True, or False without writing anything if the document can't be
+        updated this way (encrypted, pages shared in the page tree, or no
+        usable cross-reference section) and needs a full rewrite
+    """
+    if reader.is_encrypted:
+        # Appended objects would have to be encrypted with the document key
+        return False
+    references = [getattr(obj, 'indirect_reference', None) for obj in objects]
+    if None in references:
+        return False
+    if len(set((ref.idnum, ref.generation) for ref in references)) != len(references):
+        # The same dictionary listed twice would be edited twice
+        return False
+
+    # PyPDF2 leaves /Size out of the trailer it reads from a cross-reference stream
+    numbers = [number for entries in reader.xref.values() for number in entries] + list(reader.xref_objStm)
+    size = max([reader.trailer.get('/Size', 0)] + [number + 1 for number in numbers])
+    try:
+        writer = IncrementalPdfWriter(pdf_file, output, size)
+    except ValueError:
+        return False
+
+    for obj, ref in zip(objects, references):
+        writer.write_object(_serialize(obj), ref.idnum, ref.generation)
+
+    trailer = {key: reader.trailer.raw_get(key) for key in ('/Root', '/Info', '/ID') if key in reader.trailer}
+    if info is not None:
+        info_ref = trailer.get('/Info')
+        if not isinstance(info_ref, IndirectObject):
+            info_ref = IndirectObject(writer.reserve(), 0, reader)
+            trailer['/Info'] = info_ref
+        writer.write_object(_serialize(info), info_ref.idnum, info_ref.generation)
+
+    writer.close(b' '.join(key.encode('ascii') + b' ' + _serialize(value) for key, value in trailer.items()))
+    return True
+
+
+def _updated_info(reader, metadata):
+    """The document information dictionary with metadata's entries set"""
+    info = DictionaryObject()
+    if reader.metadata:
+        info.update(reader.metadata)
+    for key, value in metadata.items():
+        info[NameObject(key)] = create_string_object(value)
+    return info
+
+
+def _serialize(obj):
+    buffer = io.BytesIO()
+    obj.write_to_stream(buffer, None)
+    return buffer.getvalue()
+
+
+class _ChunkSink(io.RawIOBase):
+    """Write-only, unseekable buffer that hands out what was written since the last drain"""
+
+    def __init__(self):
+        super().__init__()
+        self._chunks = []
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
 
 
 class PDFProcessor:
     """Handles all PDF processing operations"""
 
     @staticmethod
-    def merge_pdfs(pdf_files):
+    def merge_pdfs(pdf_files, report=None, output=None, fragments=None):
         """
-        Merge multiple PDF files into one
+        Merge multiple PDF files into one, writing each source's pages as soon
+        as it is parsed and releasing it before the next
         Args:
             pdf_files: List of file objects or file paths
+            report: Optional dictionary that receives the page count, deduplication
+                    stats under 'dedup' and phase timings
+            output: Optional binary file to write to instead of a new spooled temporary file
+            fragments: Optional list of paths written by write_merge_fragment for each
+                       of pdf_files, assembled instead of parsing the files
         Returns:
-            BytesIO object containing merged PDF
+            File object containing merged PDF, positioned at the start
         """
-        merger = PdfMerger()
-
         try:
-            for pdf_file in pdf_files:
-                if hasattr(pdf_file, 'read'):
-                    # It's a file object
-                    merger.append(pdf_file)
-                else:
-                    # It's a file path
-                    merger.append(pdf_file)
-
-            output = io.BytesIO()
-            merger.write(output)
+            versions = [header_version(pdf_file) or '1.4' for pdf_file in pdf_files]
+            if output is None:
+                output = new_output()
+            merger = StreamingMerger(output, max(versions, default='1.4'))
+
+            if fragments is not None:
+                for fragment in fragments:
+                    with open(fragment, 'rb') as fragment_file, timed_phase(report, 'serialize'):
+                        merger.append(read_fragment(fragment_file))
+
+            else:
+                for pdf_file in pdf_files:
+                    with timed_phase(report, 'parse'):
+                        source = open_input(pdf_file)
+                        reader = PdfReader(source)
+                    # Sources from the same system repeat fonts, logos and ICC profiles
+                    with timed_phase(report, 'serialize'):
+                        merger.append(iter_fragment(reader))
+                    del reader
+                    if source is not pdf_file:
+                        source.close()
+
+            with timed_phase(report, 'serialize'):
+                merger.close()
             output.seek(0)
-            merger.close()
+            if report is not None:
+                report['pages'] = len(merger.kids)
+                report['dedup'] = merger.dedup_stats
             return output
 
         except Exception as e:
-            merger.close()
+            raise Exception(f"Error merging PDFs: {str(e)}")
+
+    @staticmethod
+    def write_merge_fragment(pdf_file, output, report=None):
+        """
+        Parse one input of a merge ahead of time, so inputs can be prepared
+        in parallel and then assembled in order by merge_pdfs(fragments=...)
+        Args:
+            pdf_file: PDF file object or path
+            output: Binary file the fragment is written to
+            report: Optional dictionary that receives phase timings
+        """
+        try:
+            with timed_phase(report, 'parse'):
+                reader = PdfReader(open_input(pdf_file))
+            with timed_phase(report, 'transform'):
+                write_fragment(iter_fragment(reader), output)
+
+        except Exception as e:
             raise Exception(f"Error merging PDFs: {str(e)}")
 
     @staticmethod
@@ -48,64 +228,121 @@ class PDFProcessor:
             pdf_file: PDF file object or path
             page_ranges: List of tuples (start, end) for page ranges, or None for all pages
         Returns:
-            List of BytesIO objects containing split PDFs
+            List of file objects containing split PDFs
+        """
+        return [output for _, output in PDFProcessor.iter_split_pdf(pdf_file, page_ranges)]
+
+    @staticmethod
+    def iter_split_pdf(pdf_file, page_ranges=None, report=None):
+        """
+        Split PDF lazily, serializing one output document at a time
+        Args:
+            pdf_file: PDF file object or path
+            page_ranges: List of tuples (start, end) for page ranges, or None for all pages
+            report: Optional dictionary that receives the number of pages written and phase timings
+        Yields:
+            Tuples of (name, file object) for each split PDF, in page order
         """
         try:
-            reader = PdfReader(pdf_file)
-            total_pages = len(reader.pages)
-            outputs = []
+            with timed_phase(report, 'parse'):
+                reader = PdfReader(open_input(pdf_file))
+                total_pages = len(reader.pages)
 
             if page_ranges is None:
                 # Split each page into separate PDF
-                for page_num in range(total_pages):
-                    writer = PdfWriter()
-                    writer.add_page(reader.pages[page_num])
+                page_ranges = [(page_num, page_num) for page_num in range(1, total_pages + 1)]
 
-                    output = io.BytesIO()
-                    writer.write(output)
-                    output.seek(0)
-                    outputs.append(output)
-            else:
-                # Split by page ranges
-                for start, end in page_ranges:
-                    writer = PdfWriter()
+            for start, end in page_ranges:
+                writer = PdfWriter()
+                with timed_phase(report, 'transform'):
                     for page_num in range(start - 1, min(end, total_pages)):
                         writer.add_page(reader.pages[page_num])
 
-                    output = io.BytesIO()
+                if not writer.pages:
+                    continue
+
+                output = new_output()
+                with timed_phase(report, 'serialize'):
                     writer.write(output)
-                    output.seek(0)
-                    outputs.append(output)
+                output.seek(0)
+                if report is not None:
+                    report['pages'] = report.get('pages', 0) + len(writer.pages)
+                # Drop the objects parsed for this part so memory doesn't grow with the document
+                reader.resolved_objects.clear()
 
-            return outputs
+                name = f'page_{start}' if start == end else f'pages_{start}-{min(end, total_pages)}'
+                yield name, output
 
         except Exception as e:
             raise Exception(f"Error splitting PDF: {str(e)}")
 
     @staticmethod
-    def compress_pdf(pdf_file, quality='medium'):
+    def split_pdf_zip(pdf_file, page_ranges=None, report=None):
+        """
+        Split PDF into a ZIP archive that is produced page by page
+        Args:
+            pdf_file: PDF file object or path
+            page_ranges: List of tuples (start, end) for page ranges, or None for all pages
+            report: Optional dictionary that receives the number of pages written and phase timings
+        Yields:
+            Chunks of bytes of the ZIP archive
+        """
+        sink = _ChunkSink()
+        with zipfile.ZipFile(sink, 'w', zipfile.ZIP_DEFLATED) as archive:
+            for name, output in PDFProcessor.iter_split_pdf(pdf_file, page_ranges, report):
+                with timed_phase(report, 'serialize'):
+                    size = output.seek(0, os.SEEK_END)
+                    output.seek(0)
+                    with archive.open(f'{name}.pdf', 'w', force_zip64=size > zipfile.ZIP64_LIMIT) as entry:
+                        shutil.copyfileobj(output, entry)
+                output.close()
+                yield sink.drain()
+        # Central directory is written on close
+        yield sink.drain()
+
+    @staticmethod
+    def compress_pdf(pdf_file, quality='medium', report=None, output=None):
         """
         Compress PDF by reducing image quality and removing unnecessary data
         Args:
             pdf_file: PDF file object or path
             quality: 'low', 'medium', or 'high'
+            report: Optional dictionary that receives the page count, per-image savings
+                    under 'images' and phase timings
+            output: Optional binary file to write to instead of a new spooled temporary file
         Returns:
-            BytesIO object containing compressed PDF
+            File object containing compressed PDF, positioned at the start
         """
         try:
-            reader = PdfReader(pdf_file)
+            with timed_phase(report, 'parse'):
+                reader = PdfReader(open_input(pdf_file))
+                pages = reader.pages
+                page_count = len(pages)
             writer = PdfWriter()
 
-            for page in reader.pages:
-                # Compress content streams
-                page.compress_content_streams()
-                writer.add_page(page)
-
-            # Remove duplicate objects
-            writer.add_metadata(reader.metadata)
-
-            output = io.BytesIO()
-            writer.write(output)
+            with timed_phase(report, 'transform'):
+                for page in pages:
+                    # Compress content streams
+                    page.compress_content_streams()
+                    writer.add_page(page)
+
+                # Downsample and re-encode images for the requested quality
+                images = recompress_images(writer, quality)
+                # Remove duplicate objects
+                dedup = dedup_streams(writer)
+
+                if reader.metadata:
+                    writer.add_metadata(reader.metadata)
+
+            if report is not None:
+                report['pages'] = page_count
+                report['images'] = images
+                report['dedup'] = dedup
+
+            if output is None:
+                output = new_output()
+            with timed_phase(report, 'serialize'):
+                writer.write(output)
             output.seek(0)
 
             return output
@@ -114,53 +351,54 @@ class PDFProcessor:
             raise Exception(f"Error compressing PDF: {str(e)}")
 
     @staticmethod
-    def image_to_pdf(image_files):
+    def image_to_pdf(image_files, dpi=150, report=None, output=None):
         """
         Convert images to PDF
         Args:
-            image_files: List of image file objects
+            image_files: List of image file objects or paths
+            dpi: Resolution to pre-scale large images to for their placement,
+                 or None to keep every pixel
+            report: Optional dictionary that receives the page count and phase timings
+            output: Optional binary file to write to instead of a new spooled temporary file
         Returns:
-            BytesIO object containing PDF
+            File object containing PDF, positioned at the start
         """
         try:
-            output = io.BytesIO()
-            c = canvas.Canvas(output, pagesize=letter)
+            if output is None:
+                output = new_output()
+            writer = StreamingPdfWriter(output)
+            pages_number = writer.reserve()
             width, height = letter
+            page_numbers = []
+
+            # Decode and scale in parallel (PIL releases the GIL); map() keeps upload order
+            workers = max(1, min(len(image_files), os.cpu_count() or 1))
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                prepared = pool.map(lambda img_file: load_image(img_file, (width, height), dpi), image_files)
+
+                # Decoding overlaps with writing, so 'parse' is only the time spent waiting for it
+                while True:
+                    with timed_phase(report, 'parse'):
+                        item = next(prepared, None)
+                    if item is None:
+                        break
+                    image, (x, y, new_width, new_height) = item
+                    with timed_phase(report, 'serialize'):
+                        page_numbers.append(write_image_page(
+                            writer, pages_number, image, x, y, new_width, new_height, width, height
+                        ))
+
+            with timed_phase(report, 'serialize'):
+                kids = ' '.join(f'{number} 0 R' for number in page_numbers)
+                writer.write_object(
+                    f'<</Type /Pages /Kids [{kids}] /Count {len(page_numbers)}>>'.encode('ascii'),
+                    pages_number
+                )
+                root = writer.write_object(b'<</Type /Catalog /Pages %d 0 R>>' % pages_number)
+                writer.close(root)
+            if report is not None:
+                report['pages'] = len(page_numbers)
 
-            for img_file in image_files:
-                # Open image
-                img = Image.open(img_file)
-
-                # Calculate dimensions to fit page while maintaining aspect ratio
-                img_width, img_height = img.size
-                aspect = img_height / float(img_width)
-
-                if img_width > width or img_height > height:
-                    if aspect > 1:
-                        # Portrait
-                        new_height = height - 40
-                        new_width = new_height / aspect
-                    else:
-                        # Landscape
-                        new_width = width - 40
-                        new_height = new_width * aspect
-                else:
-                    new_width = img_width
-                    new_height = img_height
-
-                # Center image
-                x = (width - new_width) / 2
-                y = (height - new_height) / 2
-
-                # Save image to temporary file
-                with tempfile.NamedTemporaryFile(delete=False, suffix='.png') as tmp:
-                    img.save(tmp.name, 'PNG')
-                    c.drawImage(tmp.name, x, y, width=new_width, height=new_height)
-                    os.unlink(tmp.name)
-
-                c.showPage()
-
-            c.save()
             output.seek(0)
             return output
 
@@ -168,24 +406,26 @@ class PDFProcessor:
             raise Exception(f"Error converting images to PDF: {str(e)}")
 
     @staticmethod
-    def extract_pages(pdf_file, page_numbers):
+    def extract_pages(pdf_file, page_numbers, output=None):
         """
         Extract specific pages from PDF
         Args:
             pdf_file: PDF file object or path
             page_numbers: List of page numbers (1-indexed)
+            output: Optional binary file to write to instead of a new spooled temporary file
         Returns:
-            BytesIO object containing PDF with extracted pages
+            File object containing PDF with extracted pages, positioned at the start
         """
         try:
-            reader = PdfReader(pdf_file)
+            reader = PdfReader(open_input(pdf_file))
             writer = PdfWriter()
 
             for page_num in page_numbers:
                 if 1 <= page_num <= len(reader.pages):
                     writer.add_page(reader.pages[page_num - 1])
 
-            output = io.BytesIO()
+            if output is None:
+                output = new_output()
             writer.write(output)
             output.seek(0)
             return output
@@ -194,31 +434,192 @@ class PDFProcessor:
             raise Exception(f"Error extracting pages: {str(e)}")
 
     @staticmethod
-    def rotate_pdf(pdf_file, rotation=90):
+    def rotate_pdf(pdf_file, rotation=90, output=None):
         """
-        Rotate all pages in PDF
+        Rotate all pages in PDF. Only the page dictionaries are rewritten, as
+        an incremental update after the original bytes, unless the document
+        needs a full rewrite (see write_incremental_update).
         Args:
             pdf_file: PDF file object or path
             rotation: Rotation angle (90, 180, 270)
+            output: Optional binary file to write to instead of a new spooled temporary file
         Returns:
-            BytesIO object containing rotated PDF
+            File object containing rotated PDF, positioned at the start
         """
         try:
-            reader = PdfReader(pdf_file)
-            writer = PdfWriter()
-
-            for page in reader.pages:
+            reader = PdfReader(open_input(pdf_file))
+            pages = list(reader.pages)
+            for page in pages:
                 page.rotate(rotation)
-                writer.add_page(page)
 
-            output = io.BytesIO()
-            writer.write(output)
+            if output is None:
+                output = new_output()
+            if not write_incremental_update(pdf_file, reader, pages, output):
+                writer = PdfWriter()
+                for page in pages:
+                    writer.add_page(page)
+                writer.write(output)
             output.seek(0)
             return output
 
         except Exception as e:
             raise Exception(f"Error rotating PDF: {str(e)}")
 
+    @staticmethod
+    def validate_pipeline(steps):
+        """
+        Check a list of pipeline steps before it is queued
+        Args:
+            steps: List of step dictionaries, e.g. [{'op': 'rotate', 'rotation': 90}]
+        Returns:
+            Normalized list of steps
+        Raises:
+            ValueError: If a step is unknown or has invalid options
+        """
+        if not isinstance(steps, list) or not steps:
+            raise ValueError("Pipeline needs at least one step")
+
+        normalized = []
+        for index, step in enumerate(steps, start=1):
+            if not isinstance(step, dict) or step.get('op') not in PIPELINE_STEPS:
+                raise ValueError(f"Step {index}: op must be one of {', '.join(PIPELINE_STEPS)}")
+            op = step['op']
+
+            pages = step.get('pages')
+            if pages is not None:
+                if not isinstance(pages, list) or not all(isinstance(p, int) and p >= 1 for p in pages):
+                    raise ValueError(f"Step {index}: pages must be a list of page numbers")
+            if op == 'extract' and not pages:
+                raise ValueError(f"Step {index}: extract needs pages")
+
+            if op == 'rotate':
+                rotation = step.get('rotation', 90)
+                if not isinstance(rotation, int) or rotation % 90:
+                    raise ValueError(f"Step {index}: rotation must be a multiple of 90")
+                normalized.append({'op': op, 'rotation': rotation, 'pages': pages})
+            elif op == 'compress':
+                quality = step.get('quality', 'medium')
+                if quality not in COMPRESSION_LEVELS:
+                    raise ValueError(f"Step {index}: quality must be one of {', '.join(COMPRESSION_LEVELS)}")
+                normalized.append({'op': op, 'quality': quality})
+            elif op == 'metadata':
+                metadata = {}
+                for field, key in METADATA_FIELDS.items():
+                    value = step.get(field)
+                    if value is None:
+                        continue
+                    if not isinstance(value, str) or len(value) > MAX_METADATA_LENGTH:
+                        raise ValueError(f"Step {index}: {field} must be text of up to {MAX_METADATA_LENGTH} characters")
+                    metadata[key] = value
+                if not metadata:
+                    raise ValueError(f"Step {index}: metadata needs one of {', '.join(METADATA_FIELDS)}")
+                normalized.append({'op': op, 'metadata': metadata})
+            else:
+                normalized.append({'op': op, 'pages': pages})
+
+        return normalized
+
+    @staticmethod
+    def run_pipeline(pdf_file, steps, report=None, output=None):
+        """
+        Apply a list of steps to one document, parsing and serializing it once.
+        Steps only edit a lightweight page list; pages are copied into the
+        writer and compressed at the end. If the steps only rotate pages and
+        set metadata, the rotated page dictionaries and the new document
+        information are appended to the original bytes instead.
+        Args:
+            pdf_file: PDF file object or path
+            steps: List of steps accepted by validate_pipeline, applied in order:
+                   {'op': 'extract', 'pages': [1, 3]} keeps the given pages,
+                   {'op': 'rotate', 'rotation': 90, 'pages': None} rotates pages (all if None),
+                   {'op': 'compress', 'quality': 'medium'} compresses the output,
+                   {'op': 'metadata', 'metadata': {'/Title': 'Report'}} sets document information
+            report: Optional dictionary that receives the page count, compression stats
+                    and phase timings
+            output: Optional binary file to write to instead of a new spooled temporary file
+        Returns:
+            File object containing the resulting PDF, positioned at the start
+        """
+        try:
+            with timed_phase(report, 'parse'):
+                reader = PdfReader(open_input(pdf_file))
+                # Document model: (source page index, extra rotation) per output page
+                pages = [(index, 0) for index in range(len(reader.pages))]
+            quality = None
+            metadata = {}
+
+            for step in steps:
+                if step['op'] == 'extract':
+                    pages = [pages[num - 1] for num in step['pages'] if num <= len(pages)]
+                elif step['op'] == 'rotate':
+                    selected = set(step['pages'] or range(1, len(pages) + 1))
+                    pages = [
+                        (index, rotation + step['rotation']) if num in selected else (index, rotation)
+                        for num, (index, rotation) in enumerate(pages, start=1)
+                    ]
+                elif step['op'] == 'compress':
+                    quality = step['quality']
+                elif step['op'] == 'metadata':
+                    metadata.update(step['metadata'])
+
+            if not pages:
+                raise ValueError("No pages left after applying the steps")
+            if report is not None:
+                report['pages'] = len(pages)
+
+            if quality is None and [index for index, _ in pages] == list(range(len(reader.pages))):
+                # Only rotations and metadata: append the changed objects to the original bytes
+                with timed_phase(report, 'transform'):
+                    rotated = []
+                    for index, rotation in pages:
+                        if rotation % 360:
+                            reader.pages[index].rotate(rotation)
+                            rotated.append(reader.pages[index])
+                if output is None:
+                    output = new_output()
+                with timed_phase(report, 'serialize'):
+                    info = _updated_info(reader, metadata) if metadata else None
+                    updated = write_incremental_update(pdf_file, reader, rotated, output, info=info)
+                if updated:
+                    output.seek(0)
+                    return output
+                # Needs a full rewrite; the pages are already rotated
+                pages = [(index, 0) for index, _ in pages]
+
+            writer = PdfWriter()
+            with timed_phase(report, 'transform'):
+                if quality is not None:
+                    for index in set(index for index, _ in pages):
+                        reader.pages[index].compress_content_streams()
+
+                for index, rotation in pages:
+                    # add_page gives every copy its own page dictionary, so repeated pages rotate independently
+                    page = writer.add_page(reader.pages[index])
+                    if rotation % 360:
+                        page.rotate(rotation)
+
+                if quality is not None:
+                    images = recompress_images(writer, quality)
+                    dedup = dedup_streams(writer)
+                    if report is not None:
+                        report['images'] = images
+                        report['dedup'] = dedup
+
+                if reader.metadata:
+                    writer.add_metadata(reader.metadata)
+                if metadata:
+                    writer.add_metadata(metadata)
+
+            if output is None:
+                output = new_output()
+            with timed_phase(report, 'serialize'):
+                writer.write(output)
+            output.seek(0)
+            return output
+
+        except Exception as e:
+            raise Exception(f"Error running pipeline: {str(e)}")
+
     @staticmethod
     def get_pdf_info(pdf_file):
         """
@@ -229,7 +630,19 @@ class PDFProcessor:
             Dictionary with PDF information
         """
         try:
-            reader = PdfReader(pdf_file)
+            # Preflight reads only the trailer and page tree root
+            result = preflight(pdf_file, info=True)
+            if result['pages'] is not None or result['encrypted']:
+                return {
+                    'pages': result['pages'],
+                    'metadata': result['info'],
+                    'encrypted': result['encrypted']
+                }
+            if not result['damaged']:
+                raise ValueError(result['error'])
+
+            # The structure is damaged; PdfReader can rebuild it
+            reader = PdfReader(open_input(pdf_file))
             info = {
                 'pages': len(reader.pages),
                 'metadata': reader.metadata,
@@ -0,0 +1,252 @@
+import os
+import re
+import zlib
+
+# Buffer size for copying the original file in IncrementalPdfWriter
+COPY_CHUNK_BYTES = 1024 * 1024
+
+
+def pdf_number(value):
+    """Format a number the way PDF expects (no exponent, trimmed zeros)"""
+    if isinstance(value, int):
+        return str(value)
+    text = f'{value:.4f}'.rstrip('0').rstrip('.')
+    return text if text not in ('', '-0') else '0'
+
+
+class StreamingPdfWriter:
+    """
+    Writes PDF objects straight to an output stream as they are produced.
+    Only the byte offset of each object is kept in memory, so the size of
+    the document being written doesn't matter. Object numbers can be
+    reserved up front for objects (like the page tree) written last.
+    """
+
+    def __init__(self, output, version='1.4'):
+        self.output = output
+        self._position = 0
+        self._offsets = {}
+        self._next_number = 1
+        self._write(f'%PDF-{version}\n'.encode('ascii'))
+        # Binary marker so transfer tools treat the file as binary
+        self._write(b'%\xe2\xe3\xcf\xd3\n')
+
+    def _write(self, data):
+        self.output.write(data)
+        self._position += len(data)
+
+    def reserve(self):
+        """Allocate an object number to be written later"""
+        number = self._next_number
+        self._next_number += 1
+        return number
+
+    def write_object(self, body, number=None):
+        """
+        Write an object
+        Args:
+            body: Serialized object, e.g. b'<</Type /Catalog /Pages 2 0 R>>'
+            number: Previously reserved object number, or None to allocate one
+        Returns:
+            The object number
+        """
+        if number is None:
+            number = self.reserve()
+        self._offsets[number] = self._position
+        self._write(b'%d 0 obj\n' % number)
+        self._write(body)
+        self._write(b'\nendobj\n')
+        return number
+
+    def write_stream(self, dictionary, data, number=None):
+        """
+        Write a stream object
+        Args:
+            dictionary: Serialized dictionary entries without /Length, e.g. b'/Filter /FlateDecode'
+            data: Encoded stream data
+            number: Previously reserved object number, or None to allocate one
+        Returns:
+            The object number
+        """
+        if number is None:
+            number = self.reserve()
+        self._offsets[number] = self._position
+        self._write(b'%d 0 obj\n<<%s /Length %d>>\nstream\n' % (number, dictionary, len(data)))
+        self._write(data)
+        self._write(b'\nendstream\nendobj\n')
+        return number
+
+    def close(self, root, info=None):
+        """
+        Write the cross-reference table and trailer
+        Args:
+            root: Object number of the document catalog
+            info: Object number of the document information dictionary, if any
+        """
+        xref_position = self._position
+        size = self._next_number
+        lines = [b'xref\n0 %d\n' % size, b'0000000000 65535 f \n']
+        for number in range(1, size):
+            offset = self._offsets.get(number)
+            if offset is None:
+                lines.append(b'0000000000 65535 f \n')
+            else:
+                lines.append(b'%010d 00000 n \n' % offset)
+        self._write(b''.join(lines))
+
+        trailer = b'trailer\n<</Size %d /Root %d 0 R' % (size, root)
+        if info is not None:
+            trailer += b' /Info %d 0 R' % info
+        self._write(trailer + b'>>\nstartxref\n%d\n%%%%EOF\n' % xref_position)
+
+
+class IncrementalPdfWriter:
+    """
+    Writes an incremental update: the original file is copied byte for byte
+    and changed objects are appended after it with a new cross-reference
+    section that points back to the original one through /Prev. Only the
+    objects written here are new, so editing a page dictionary costs the
+    same whatever the size of the document. The new cross-reference section
+    is a stream if the original uses one, and a table otherwise.
+    """
+
+    def __init__(self, source, output, size):
+        """
+        Args:
+            source: Path or binary file object of the original PDF
+            output: Binary file to write the updated PDF to
+            size: /Size of the original trailer; new objects are numbered from here
+        Raises:
+            ValueError: If the original doesn't end with a usable startxref,
+                        in which case nothing has been written yet
+        """
+        self.output = output
+        self._position = 0
+        self._offsets = {}
+        self._next_number = size
+
+        source_file = open(source, 'rb') if isinstance(source, str) else source
+        try:
+            self._prev, self._xref_stream = self._find_xref(source_file)
+            source_file.seek(0)
+            last = b''
+            while True:
+                chunk = source_file.read(COPY_CHUNK_BYTES)
+                if not chunk:
+                    break
+                self._write(chunk)
+                last = chunk[-1:]
+        finally:
+            if source_file is not source:
+                source_file.close()
+
+        # Appended objects have to start on a new line
+        self._separate = last not in (b'\n', b'\r')
+
+    @staticmethod
+    def _find_xref(source_file):
+        """Offset of the original's last cross-reference section, and whether it is a stream"""
+        source_file.seek(0, os.SEEK_END)
+        length = source_file.tell()
+        source_file.seek(max(0, length - 1024))
+        matches = re.findall(rb'startxref\s+(\d+)', source_file.read())
+        if not matches:
+            raise ValueError("No startxref at the end of the file")
+
+        prev = int(matches[-1])
+        source_file.seek(prev)
+        head = source_file.read(64)
+        if head.startswith(b'xref'):
+            return prev, False
+        if re.match(rb'\d+\s+\d+\s+obj', head):
+            return prev, True
+        raise ValueError("startxref doesn't point to a cross-reference section")
+
+    def _write(self, data):
+        self.output.write(data)
+        self._position += len(data)
+
+    def reserve(self):
+        """Allocate a new object number"""
+        number = self._next_number
+        self._next_number += 1
+        return number
+
+    def write_object(self, body, number, generation=0):
+        """
+        Write a new version of an object, or a new object
+        Args:
+            body: Serialized object, e.g. b'<</Type /Page /Rotate 90 ...>>'
+            number: Object number being replaced, or one from reserve()
+            generation: Generation number of the object being replaced
+        """
+        if self._separate:
+            self._write(b'\n')
+            self._separate = False
+        self._offsets[number] = (self._position, generation)
+        self._write(b'%d %d obj\n' % (number, generation))
+        self._write(body)
+        self._write(b'\nendobj\n')
+
+    def close(self, trailer):
+        """
+        Write the cross-reference section for the objects written so far
+        Args:
+            trailer: Serialized trailer entries to carry over, without /Size and /Prev,
+                     e.g. b'/Root 1 0 R /Info 2 0 R /ID [<...> <...>]'
+        """
+        if not self._offsets:
+            # Nothing changed; the copy is the result
+            return
+        if self._xref_stream:
+            self._close_stream(trailer)
+        else:
+            self._close_table(trailer)
+
+    def _close_table(self, trailer):
+        xref_position = self._position
+        # Restating the head of the free list keeps the section zero-indexed,
+        # which some readers expect
+        lines = [b'xref\n0 1\n0000000000 65535 f \n']
+        for start, numbers in self._subsections():
+            lines.append(b'%d %d\n' % (start, len(numbers)))
+            for number in numbers:
+                lines.append(b'%010d %05d n \n' % self._offsets[number])
+        self._write(b''.join(lines))
+        self._write(
+            b'trailer\n<</Size %d /Prev %d %s>>\nstartxref\n%d\n%%%%EOF\n'
+            % (self._next_number, self._prev, trailer, xref_position)
+        )
+
+    def _close_stream(self, trailer):
+        # The cross-reference stream is an object too, and lists itself
+        number = self.reserve()
+        xref_position = self._position
+        self._offsets[number] = (xref_position, 0)
+
+        offset_width = max(4, (xref_position.bit_length() + 7) // 8)
+        index, rows = [], []
+        for start, numbers in self._subsections():
+            index.append(b'%d %d' % (start, len(numbers)))
+            for entry in numbers:
+                offset, generation = self._offsets[entry]
+                rows.append(b'\x01' + offset.to_bytes(offset_width, 'big') + generation.to_bytes(2, 'big'))
+        data = zlib.compress(b''.join(rows))
+
+        self._write(
+            b'%d 0 obj\n<</Type /XRef /Size %d /Index [%s] /W [1 %d 2] /Prev %d %s'
+            b' /Filter /FlateDecode /Length %d>>\nstream\n'
+            % (number, self._next_number, b' '.join(index), offset_width, self._prev, trailer, len(data))
+        )
+        self._write(data)
+        self._write(b'\nendstream\nendobj\nstartxref\n%d\n%%%%EOF\n' % xref_position)
+
+    def _subsections(self):
+        """Written object numbers grouped into runs of consecutive numbers"""
+        runs = []
+        for number in sorted(self._offsets):
+            if runs and number == runs[-1][0] + len(runs[-1][1]):
+                runs[-1][1].append(number)
+            else:
+                runs.append((number, [number]))
+        return runs
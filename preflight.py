@@ -0,0 +1,554 @@
+import os
+import re
+import zlib
+
+# Rough cost of each operation as (fixed ms, ms per page, ms per MB), measured
+# on the benchmark.py corpus with one worker. 'parse' is what opening the
+# document costs; 'pipeline' is for steps other than compress. Convert counts
+# images as pages.
+COST_MODEL = {
+    'parse': (5, 0.05, 2),
+    'merge': (5, 0.6, 2),
+    'split': (5, 1.2, 10),
+    'compress': (120, 5.0, 150),
+    'pipeline': (5, 0.3, 4),
+    'convert': (5, 120, 10)
+}
+# Rebuilding a damaged cross-reference section means scanning the whole file
+DAMAGED_COST_FACTOR = 2
+
+# How far from the end startxref and %%EOF are looked for
+TAIL_BYTES = 4096
+# Largest object read while following the document structure
+MAX_OBJECT_BYTES = 16 * 1024 * 1024
+# Largest decoded cross-reference or object stream
+MAX_DECODED_BYTES = 64 * 1024 * 1024
+# Deepest nesting of arrays and dictionaries parsed
+MAX_DEPTH = 64
+# Cross-reference sections followed through /Prev before giving up
+MAX_SECTIONS = 1000
+
+_WHITESPACE = b' \t\r\n\f\x00'
+_NUMBER = re.compile(rb'[+-]?(?:\d+\.?\d*|\.\d+)')
+_REFERENCE = re.compile(rb'\s+(\d+)\s+R(?![^\s()<>\[\]{}/%])')
+_KEYWORD = re.compile(rb'[A-Za-z]+')
+_NAME = re.compile(rb'/[^\s()<>\[\]{}/%\x00]*')
+_OBJECT_HEADER = re.compile(rb'\s*(\d+)\s+(\d+)\s+obj')
+_SUBSECTION = re.compile(rb'(\d+)\s+(\d+)[ \t]*(?:\r\n|\r|\n)')
+_STREAM_KEYWORD = re.compile(rb'\s*stream(?:\r\n|\n|\r)')
+_OCTAL = re.compile(rb'[0-7]{1,3}')
+_XREF_ENTRY = re.compile(rb'\d{10} \d{5} [fn](?:\r\n| \r| \n|\r|\n)')
+_ESCAPES = {b'n': b'\n', b'r': b'\r', b't': b'\t', b'b': b'\b', b'f': b'\f'}
+
+
+class _Reference(tuple):
+    """Indirect reference (object number, generation)"""
+
+
+class _Damaged(Exception):
+    """The document structure can't be followed without rebuilding it"""
+
+
+class _Incomplete(Exception):
+    """The object runs past the bytes read so far"""
+
+
+def preflight(pdf_file, operation_type=None, info=False):
+    """
+    Check a PDF by reading only its header, trailer, cross-reference
+    sections and page tree root, without parsing pages
+    Args:
+        pdf_file: PDF file object or path; a file object's position is kept
+        operation_type: Operation to estimate the cost of (a key of COST_MODEL),
+                        or None for the cost of opening the document
+        info: Also read the document information dictionary
+    Returns:
+        Dictionary with 'pages' (None if the page tree can't be followed),
+        'encrypted', 'damaged' (the structure is broken and would have to be
+        rebuilt), 'error' (why the file can't be processed, or None),
+        'version', 'size', 'cost_ms' and, if info is set, 'info'
+    """
+    source = _Source(pdf_file)
+    try:
+        return _Document(source).check(operation_type, info)
+    finally:
+        source.close()
+
+
+def estimate_cost_ms(operation_type, pages, size, damaged=False):
+    """
+    Estimate how long an operation takes
+    Args:
+        operation_type: Key of COST_MODEL, or None for 'parse'
+        pages: Page count, or None if unknown
+        size: File size in bytes
+        damaged: Whether the file needs its structure rebuilt first
+    Returns:
+        Estimated milliseconds of worker time
+    """
+    fixed, per_page, per_mb = COST_MODEL.get(operation_type or 'parse', COST_MODEL['parse'])
+    cost = fixed + per_page * (pages or 0) + per_mb * size / (1024 * 1024)
+    if damaged:
+        cost *= DAMAGED_COST_FACTOR
+    return int(cost)
+
+
+class _Source:
+    """Random access to the bytes of a path or file object"""
+
+    def __init__(self, pdf_file):
+        if hasattr(pdf_file, 'read'):
+            self.file = pdf_file
+            self.position = pdf_file.tell()
+        else:
+            self.file = open(pdf_file, 'rb')
+            self.position = None
+        self.size = self.file.seek(0, os.SEEK_END)
+
+    def read(self, offset, size):
+        if offset < 0:
+            raise _Damaged()
+        self.file.seek(offset)
+        return self.file.read(size)
+
+    def close(self):
+        if self.position is None:
+            self.file.close()
+        else:
+            self.file.seek(self.position)
+
+
+class _Document:
+    """What preflight() learns about one file"""
+
+    def __init__(self, source):
+        self.source = source
+        self.sections = []  # newest first: (kind, data) with kind 'table' or 'stream'
+        self.trailer = {}
+        self._object_streams = {}
+
+    def check(self, operation_type, info):
+        result = {
+            'pages': None, 'encrypted': False, 'damaged': False, 'error': None,
+            'version': None, 'size': self.source.size
+        }
+        if info:
+            result['info'] = {}
+
+        head = self.source.read(0, 1024)
+        match = re.search(rb'%PDF-(\d\.\d)', head)
+        if self.source.size == 0:
+            result['error'] = 'The file is empty'
+        elif not match:
+            result['error'] = 'The file is not a PDF'
+        else:
+            result['version'] = match.group(1).decode('ascii')
+            self._check_structure(result, info)
+
+        result['cost_ms'] = estimate_cost_ms(operation_type, result['pages'], self.source.size, result['damaged'])
+        return result
+
+    def _check_structure(self, result, info):
+        tail = self.source.read(max(0, self.source.size - TAIL_BYTES), TAIL_BYTES)
+        matches = re.findall(rb'startxref\s+(\d+)\s+%%EOF', tail)
+        if not matches:
+            # PdfReader can't open a file without them either
+            result['damaged'] = True
+            result['error'] = 'The file is truncated or damaged'
+            return
+
+        try:
+            self._read_sections(int(matches[-1]))
+            result['encrypted'] = '/Encrypt' in self.trailer
+            catalog = self._get(self.trailer.get('/Root'))
+            pages = self._get(catalog.get('/Pages')) if isinstance(catalog, dict) else None
+            count = pages.get('/Count') if isinstance(pages, dict) else None
+            if not _is_count(count):
+                raise _Damaged()
+            result['pages'] = count
+            if info and not result['encrypted']:
+                result['info'] = _text_entries(self._get(self.trailer.get('/Info')))
+        except _Damaged:
+            # PdfReader rebuilds what it can by scanning the file
+            result['damaged'] = True
+
+        if result['encrypted']:
+            result['error'] = 'Password-protected PDFs are not supported'
+        elif result['pages'] == 0:
+            result['error'] = 'The PDF has no pages'
+
+    def _read_sections(self, offset):
+        """Collect cross-reference sections from offset back through /Prev"""
+        seen = set()
+        while offset is not None:
+            if offset in seen or len(seen) >= MAX_SECTIONS or not 0 <= offset < self.source.size:
+                raise _Damaged()
+            seen.add(offset)
+
+            head = self.source.read(offset, 4)
+            if head == b'xref':
+                trailer = self._read_table(offset)
+                # A hybrid file lists objects in object streams in a stream as well
+                stream_offset = trailer.get('/XRefStm')
+                if isinstance(stream_offset, int):
+                    self._read_stream_section(stream_offset)
+            else:
+                trailer = self._read_stream_section(offset)
+
+            for key in ('/Root', '/Info', '/Encrypt'):
+                if key in trailer:
+                    self.trailer.setdefault(key, trailer[key])
+            prev = trailer.get('/Prev')
+            offset = prev if isinstance(prev, int) else None
+
+    def _read_table(self, offset):
+        """Index a cross-reference table without reading its entries, and return its trailer"""
+        position = offset + 4
+        subsections = []
+        while True:
+            chunk = self.source.read(position, 64)
+            skipped = _skip(chunk, 0)
+            if chunk.startswith(b'trailer', skipped):
+                trailer, _ = self._parse_at(position + skipped + 7)
+                break
+            match = _SUBSECTION.match(chunk, skipped)
+            if not match:
+                raise _Damaged()
+            start, count = int(match.group(1)), int(match.group(2))
+            entries_offset = position + match.end()
+            # Entries should be 20 bytes, but some writers end lines with a bare newline
+            entry = _XREF_ENTRY.match(self.source.read(entries_offset, 21))
+            entry_size = len(entry.group(0)) if entry else 20
+            subsections.append((start, count, entries_offset, entry_size))
+            position = entries_offset + count * entry_size
+
+        if not isinstance(trailer, dict):
+            raise _Damaged()
+        self.sections.append(('table', subsections))
+        return trailer
+
+    def _read_stream_section(self, offset):
+        """Read a cross-reference stream and return its dictionary, which is also a trailer"""
+        dictionary, data = self._read_stream(offset)
+        if dictionary.get('/Type') != '/XRef':
+            raise _Damaged()
+        widths = dictionary.get('/W')
+        index = dictionary.get('/Index', [0, dictionary.get('/Size')])
+        if not (isinstance(widths, list) and len(widths) == 3 and all(_is_count(w) for w in widths)):
+            raise _Damaged()
+        if not (isinstance(index, list) and all(_is_count(value) for value in index)):
+            raise _Damaged()
+        self.sections.append(('stream', (widths, index, data)))
+        return dictionary
+
+    def _read_stream(self, offset):
+        """Read and decode the stream object at offset"""
+        dictionary, end = self._parse_at(offset, header=True)
+        if not isinstance(dictionary, dict):
+            raise _Damaged()
+        length = self._get(dictionary.get('/Length'))
+        if not isinstance(length, int) or length > MAX_OBJECT_BYTES:
+            raise _Damaged()
+        match = _STREAM_KEYWORD.match(self.source.read(end, 32))
+        if not match:
+            raise _Damaged()
+        return dictionary, _decode(dictionary, self.source.read(end + match.end(), length))
+
+    def _parse_at(self, offset, header=False, number=None):
+        """
+        Parse the value at offset, or after the 'n g obj' header there
+        Returns:
+            Tuple of (value, file offset just after it)
+        """
+        size = 4096
+        while True:
+            data = self.source.read(offset, size)
+            complete = len(data) < size
+            if complete:
+                # So a number at the very end isn't taken for a cut-off reference
+                data += b' ' * 16
+            position = 0
+            if header:
+                match = _OBJECT_HEADER.match(data)
+                if not match or (number is not None and int(match.group(1)) != number):
+                    raise _Damaged()
+                position = match.end()
+            try:
+                value, position = _parse(data, position)
+                return value, offset + position
+            except _Incomplete:
+                if complete or size >= MAX_OBJECT_BYTES:
+                    raise _Damaged()
+                size *= 4
+
+    def _locate(self, number):
+        """Where the newest definition of an object is: ('offset', n), ('compressed', stream, index) or None"""
+        for kind, section in self.sections:
+            if kind == 'table':
+                for start, count, entries_offset, entry_size in section:
+                    if start <= number < start + count:
+                        entry = self.source.read(entries_offset + (number - start) * entry_size, 18)
+                        if not re.match(rb'\d{10} \d{5} [fn]', entry):
+                            raise _Damaged()
+                        if entry[17:18] == b'f':
+                            return None
+                        return ('offset', int(entry[:10]))
+            else:
+                widths, index, data = section
+                row_size = sum(widths)
+                row = 0
+                for start, count in zip(index[::2], index[1::2]):
+                    if start <= number < start + count:
+                        at = (row + number - start) * row_size
+                        fields = []
+                        for width in widths:
+                            fields.append(int.from_bytes(data[at:at + width], 'big'))
+                            at += width
+                        kind_field = fields[0] if widths[0] else 1
+                        if kind_field == 0:
+                            return None
+                        if kind_field == 1:
+                            return ('offset', fields[1])
+                        return ('compressed', fields[1], fields[2])
+                    row += count
+        return None
+
+    def _get(self, reference):
+        """Resolve a reference, or return a direct value as is"""
+        if not isinstance(reference, _Reference):
+            return reference
+        location = self._locate(reference[0])
+        if location is None:
+            raise _Damaged()
+        if location[0] == 'offset':
+            return self._parse_at(location[1], header=True, number=reference[0])[0]
+
+        _, stream_number, index = location
+        if stream_number not in self._object_streams:
+            stream_location = self._locate(stream_number)
+            if stream_location is None or stream_location[0] != 'offset':
+                raise _Damaged()
+            dictionary, data = self._read_stream(stream_location[1])
+            first, count = dictionary.get('/First'), dictionary.get('/N')
+            if not _is_count(first) or not _is_count(count):
+                raise _Damaged()
+            numbers = data[:first].split()
+            if not all(value.isdigit() for value in numbers):
+                raise _Damaged()
+            offsets = [int(value) for value in numbers[1::2]]
+            self._object_streams = {stream_number: (first, offsets, data)}
+        first, offsets, data = self._object_streams[stream_number]
+        if index >= len(offsets):
+            raise _Damaged()
+        try:
+            # Padded like a complete read in _parse_at
+            return _parse(data + b' ' * 16, first + offsets[index])[0]
+        except _Incomplete:
+            raise _Damaged()
+
+
+def _decode(dictionary, data):
+    """Undo FlateDecode and PNG predictors, the only encoding cross-reference and object streams use in practice"""
+    filters = dictionary.get('/Filter')
+    if isinstance(filters, list):
+        filters = filters[0] if len(filters) == 1 else filters
+    if filters is None:
+        return data
+    if filters != '/FlateDecode':
+        raise _Damaged()
+    decompressor = zlib.decompressobj()
+    try:
+        data = decompressor.decompress(data, MAX_DECODED_BYTES)
+    except zlib.error:
+        raise _Damaged()
+    if decompressor.unconsumed_tail:
+        raise _Damaged()
+
+    parameters = dictionary.get('/DecodeParms')
+    if isinstance(parameters, list):
+        parameters = parameters[0] if parameters else None
+    predictor = parameters.get('/Predictor', 1) if isinstance(parameters, dict) else 1
+    if not _is_count(predictor) or predictor < 10:
+        return data
+    columns = parameters.get('/Columns', 1)
+    if not _is_count(columns) or not 0 < columns <= MAX_DECODED_BYTES:
+        raise _Damaged()
+    return _undo_png_predictor(data, columns)
+
+
+def _undo_png_predictor(data, columns):
+    rows = []
+    previous = bytes(columns)
+    # Masks for adding rows byte by byte as one integer, without carries between bytes
+    low = int.from_bytes(b'\x7f' * columns, 'big')
+    high = int.from_bytes(b'\x80' * columns, 'big')
+    for start in range(0, len(data), columns + 1):
+        kind, row = data[start], data[start + 1:start + 1 + columns].ljust(columns, b'\x00')
+        if kind == 2:
+            # Up, which cross-reference streams almost always use
+            a, b = int.from_bytes(row, 'big'), int.from_bytes(previous, 'big')
+            row = (((a & low) + (b & low)) ^ ((a ^ b) & high)).to_bytes(columns, 'big')
+        elif kind:
+            row = _unfilter_row(kind, bytearray(row), previous)
+        rows.append(row)
+        previous = row
+    return b''.join(rows)
+
+
+def _unfilter_row(kind, row, previous):
+    for i in range(len(row)):
+        left = row[i - 1] if i else 0
+        up = previous[i]
+        if kind == 1:
+            row[i] = (row[i] + left) & 0xff
+        elif kind == 3:
+            row[i] = (row[i] + (left + up) // 2) & 0xff
+        elif kind == 4:
+            up_left = previous[i - 1] if i else 0
+            estimate = left + up - up_left
+            distances = (abs(estimate - left), abs(estimate - up), abs(estimate - up_left))
+            row[i] = (row[i] + (left, up, up_left)[distances.index(min(distances))]) & 0xff
+    return bytes(row)
+
+
+def _skip(data, position):
+    """Skip whitespace and comments"""
+    while position < len(data):
+        byte = data[position:position + 1]
+        if byte in _WHITESPACE:
+            position += 1
+        elif byte == b'%':
+            while position < len(data) and data[position:position + 1] not in b'\r\n':
+                position += 1
+        else:
+            break
+    return position
+
+
+def _parse(data, position, depth=0):
+    """
+    Parse one PDF value starting at position
+    Returns:
+        Tuple of (value, position after it). Dictionaries become dicts keyed by
+        name, arrays lists, names str, strings bytes and references _Reference
+    """
+    position = _skip(data, position)
+    if position >= len(data):
+        raise _Incomplete()
+    byte = data[position:position + 1]
+
+    if (data.startswith(b'<<', position) or byte == b'[') and depth >= MAX_DEPTH:
+        raise _Damaged()
+
+    if data.startswith(b'<<', position):
+        value, position = {}, position + 2
+        while True:
+            position = _skip(data, position)
+            if position >= len(data):
+                raise _Incomplete()
+            if data.startswith(b'>>', position):
+                return value, position + 2
+            key, position = _parse(data, position, depth + 1)
+            if not isinstance(key, str) or not key.startswith('/'):
+                raise _Damaged()
+            value[key], position = _parse(data, position, depth + 1)
+
+    if byte == b'[':
+        value, position = [], position + 1
+        while True:
+            position = _skip(data, position)
+            if position >= len(data):
+                raise _Incomplete()
+            if data.startswith(b']', position):
+                return value, position + 1
+            item, position = _parse(data, position, depth + 1)
+            value.append(item)
+
+    if byte == b'<':
+        end = data.find(b'>', position)
+        if end < 0:
+            raise _Incomplete()
+        digits = re.sub(rb'[^0-9A-Fa-f]', b'', data[position + 1:end])
+        return bytes.fromhex((digits + b'0' * (len(digits) % 2)).decode('ascii')), end + 1
+
+    if byte == b'(':
+        return _parse_string(data, position + 1)
+
+    if byte == b'/':
+        match = _NAME.match(data, position)
+        name = re.sub(rb'#([0-9A-Fa-f]{2})', lambda m: bytes.fromhex(m.group(1).decode('ascii')), match.group(0))
+        return name.decode('latin-1'), match.end()
+
+    match = _NUMBER.match(data, position)
+    if match:
+        text = match.group(0)
+        if b'.' in text:
+            return float(text), match.end()
+        reference = _REFERENCE.match(data, match.end())
+        if reference and match.end() < len(data):
+            return _Reference((int(text), int(reference.group(1)))), reference.end()
+        if match.end() + 8 >= len(data):
+            # Could be the start of a reference that was cut off
+            raise _Incomplete()
+        return int(text), match.end()
+
+    match = _KEYWORD.match(data, position)
+    if match:
+        word = match.group(0)
+        return {b'true': True, b'false': False, b'null': None}.get(word, word.decode('ascii')), match.end()
+    raise _Damaged()
+
+
+def _parse_string(data, position):
+    """Parse a literal string whose opening parenthesis is just before position"""
+    out, depth = bytearray(), 1
+    while position < len(data):
+        byte = data[position:position + 1]
+        position += 1
+        if byte == b'\\':
+            escaped = data[position:position + 1]
+            position += 1
+            octal = _OCTAL.match(data, position - 1, position + 2)
+            if escaped in _ESCAPES:
+                out += _ESCAPES[escaped]
+            elif octal:
+                out.append(int(octal.group(0), 8) & 0xff)
+                position = octal.end()
+            elif escaped == b'\r':
+                if data[position:position + 1] == b'\n':
+                    position += 1
+            elif escaped != b'\n':
+                # Unknown escapes, \8 and \9 included, stand for the character itself
+                out += escaped
+        elif byte == b'(':
+            depth += 1
+            out += byte
+        elif byte == b')':
+            depth -= 1
+            if depth == 0:
+                return bytes(out), position
+            out += byte
+        else:
+            out += byte
+    raise _Incomplete()
+
+
+def _is_count(value):
+    """Whether a parsed value is a non-negative integer (bool is an int too)"""
+    return isinstance(value, int) and not isinstance(value, bool) and value >= 0
+
+
+def _text_entries(dictionary):
+    """Decode the text strings of a document information dictionary"""
+    if not isinstance(dictionary, dict):
+        return {}
+    entries = {}
+    for key, value in dictionary.items():
+        if isinstance(value, bytes):
+            if value.startswith(b'\xfe\xff'):
+                entries[key] = value[2:].decode('utf-16-be', 'replace')
+            else:
+                entries[key] = value.decode('latin-1')
+        elif isinstance(value, str):
+            entries[key] = value
+    return entries
@@ -0,0 +1,130 @@
+import os
+import io
+import json
+import pstats
+import cProfile
+import tracemalloc
+from datetime import datetime
+
+# Entries written to the text summary
+TOP_FUNCTIONS = 40
+TOP_ALLOCATIONS = 25
+# Stack depth tracemalloc keeps per allocation; deeper is slower
+TRACEMALLOC_FRAMES = 10
+
+
+def profile_call(func, args, profile_path):
+    """
+    Run func(*args) under cProfile and tracemalloc, inside the worker process.
+    The profile is written even if func raises, e.g. when it hits the CPU limit.
+    Args:
+        func: Function to profile
+        args: Tuple of positional arguments
+        profile_path: Path without extension; <path>.prof gets the cProfile stats
+                      and <path>.txt the hottest functions and allocation sites
+    Returns:
+        Tuple of (func's return value, peak traced memory in bytes)
+    """
+    profiler = cProfile.Profile()
+    tracemalloc.start(TRACEMALLOC_FRAMES)
+    profiler.enable()
+    try:
+        result = func(*args)
+    finally:
+        profiler.disable()
+        _, peak = tracemalloc.get_traced_memory()
+        snapshot = tracemalloc.take_snapshot()
+        tracemalloc.stop()
+        _write_profile(profiler, snapshot, peak, profile_path)
+    return result, peak
+
+
+def _write_profile(profiler, snapshot, peak, profile_path):
+    profiler.dump_stats(f'{profile_path}.prof')
+
+    summary = io.StringIO()
+    summary.write(f'Peak traced memory: {peak / 1048576:.1f} MB\n\n')
+    summary.write(f'Top {TOP_FUNCTIONS} functions by cumulative time (calling thread only)\n')
+    pstats.Stats(profiler, stream=summary).sort_stats('cumulative').print_stats(TOP_FUNCTIONS)
+
+    summary.write(f'\nTop {TOP_ALLOCATIONS} allocation sites still alive at the end\n\n')
+    snapshot = snapshot.filter_traces((
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, '<frozen importlib._bootstrap>')
+    ))
+    for stat in snapshot.statistics('lineno')[:TOP_ALLOCATIONS]:
+        frame = stat.traceback[0]
+        summary.write(f'{stat.size / 1024:10.1f} KiB {stat.count:8d} blocks  {frame.filename}:{frame.lineno}\n')
+
+    with open(f'{profile_path}.txt', 'w') as f:
+        f.write(summary.getvalue())
+
+
+class ProfileStore:
+    """
+    Local store of PDF operation profiles under UPLOAD_FOLDER/profiles.
+    Each profile is <id>.prof (cProfile stats for pstats or snakeviz),
+    <id>.txt (readable summary with allocation sites) and <id>.json
+    (what was profiled and why). Only the newest PROFILE_KEEP are kept;
+    the documents themselves never are.
+    """
+
+    def __init__(self, app=None):
+        self.profile_dir = None
+        self.keep = None
+        self.slow_seconds = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        # Absolute, as send_from_directory resolves relative paths against the app root
+        self.profile_dir = os.path.abspath(os.path.join(app.config['UPLOAD_FOLDER'], 'profiles'))
+        self.keep = app.config['PROFILE_KEEP']
+        self.slow_seconds = app.config['PROFILE_SLOW_SECONDS']
+        os.makedirs(self.profile_dir, exist_ok=True)
+
+    def new_path(self, job_id):
+        """
+        Reserve a profile
+        Args:
+            job_id: Job being profiled
+        Returns:
+            Tuple of (profile ID, path without extension to pass to profile_call)
+        """
+        profile_id = f'{datetime.utcnow().strftime("%Y%m%d-%H%M%S")}-{job_id[:8]}'
+        return profile_id, os.path.join(self.profile_dir, profile_id)
+
+    def save(self, profile_id, **details):
+        """
+        Record what a finished profile is about and drop the oldest beyond PROFILE_KEEP
+        Args:
+            profile_id: ID from new_path
+            **details: JSON-serializable details, e.g. operation_type and reason
+        """
+        details = dict(details, id=profile_id, created_at=datetime.utcnow().isoformat())
+        with open(os.path.join(self.profile_dir, f'{profile_id}.json'), 'w') as f:
+            json.dump(details, f)
+
+        for profile in self.list()[self.keep:]:
+            for extension in ('json', 'prof', 'txt'):
+                try:
+                    os.remove(os.path.join(self.profile_dir, f"{profile['id']}.{extension}"))
+                except OSError:
+                    pass
+
+    def list(self):
+        """
+        Get the stored profiles
+        Returns:
+            List of profile detail dictionaries, newest first
+        """
+        profiles = []
+        for name in os.listdir(self.profile_dir):
+            if not name.endswith('.json'):
+                continue
+            try:
+                with open(os.path.join(self.profile_dir, name)) as f:
+                    profiles.append(json.load(f))
+            except (OSError, ValueError):
+                continue
+        return sorted(profiles, key=lambda profile: profile['id'], reverse=True)
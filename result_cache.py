@@ -0,0 +1,171 @@
+import os
+import json
+import shutil
+import hashlib
+import threading
+from importlib import metadata
+from metrics import metrics
+
+# Bump to drop every cached result, e.g. after a fix in code not listed below
+CACHE_VERSION = 2
+# Modules whose code decides the bytes of a result, and libraries they call.
+# Their sources and versions are part of every key, so results written by
+# older code aren't served after a deploy.
+OUTPUT_MODULES = (
+    'pdf_utils', 'pdf_merge', 'pdf_writer', 'stream_dedup',
+    'image_compression', 'image_pdf', 'pdf_executor'
+)
+OUTPUT_LIBRARIES = ('PyPDF2', 'reportlab', 'Pillow')
+
+
+def code_fingerprint():
+    """Hex digest of CACHE_VERSION, the OUTPUT_MODULES sources and the OUTPUT_LIBRARIES versions"""
+    digest = hashlib.sha256(b'%d' % CACHE_VERSION)
+    base_dir = os.path.dirname(os.path.abspath(__file__))
+    for module in OUTPUT_MODULES:
+        digest.update(f'\0{module}:'.encode())
+        try:
+            with open(os.path.join(base_dir, f'{module}.py'), 'rb') as f:
+                digest.update(f.read())
+        except OSError:
+            pass
+    for library in OUTPUT_LIBRARIES:
+        try:
+            version = metadata.version(library)
+        except metadata.PackageNotFoundError:
+            version = None
+        digest.update(f'\0{library}:{version}'.encode())
+    return digest.hexdigest()
+
+
+class ResultCache:
+    """
+    Content-addressed cache of operation results on local disk. Entries are
+    keyed by a hash of the input bytes, the operation and its parameters,
+    stored under UPLOAD_FOLDER/cache and evicted least-recently-used once the
+    cache grows past RESULT_CACHE_MAX_MB. Keys include code_fingerprint(), so
+    a deploy that changes how results are made starts from an empty cache;
+    the old entries age out through eviction.
+    """
+
+    def __init__(self, app=None):
+        self.cache_dir = None
+        self.max_bytes = 0
+        self.fingerprint = code_fingerprint()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.cache_dir = os.path.join(app.config['UPLOAD_FOLDER'], 'cache')
+        self.max_bytes = app.config['RESULT_CACHE_MAX_MB'] * 1024 * 1024
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    @property
+    def enabled(self):
+        return self.max_bytes > 0
+
+    def key(self, operation_type, input_paths, params):
+        """
+        Build the cache key for an operation
+        Args:
+            operation_type: Operation name
+            input_paths: List of input file paths, in processing order
+            params: Dictionary of operation options
+        Returns:
+            Hex digest identifying the result
+        """
+        digest = hashlib.sha256()
+        digest.update(json.dumps([self.fingerprint, operation_type, params], sort_keys=True).encode())
+        for path in input_paths:
+            # Length prefix keeps file boundaries unambiguous
+            digest.update(b'%d:' % os.path.getsize(path))
+            with open(path, 'rb') as f:
+                for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                    digest.update(chunk)
+        return digest.hexdigest()
+
+    def _paths(self, key):
+        base = os.path.join(self.cache_dir, key[:2], key)
+        return base + '.result', base + '.json'
+
+    def get(self, key, dest_path):
+        """
+        Copy a cached result to dest_path
+        Returns:
+            Tuple of (hit, report) where report is what the operation returned
+        """
+        result_path, meta_path = self._paths(key)
+        try:
+            with open(meta_path) as f:
+                report = json.load(f)
+            _link_or_copy(result_path, dest_path)
+            # mtime is the LRU clock
+            os.utime(result_path)
+        except (OSError, ValueError):
+            return False, None
+        return True, report
+
+    def put(self, key, result_path, report=None):
+        """Store a finished result and evict old entries if the cache is over budget"""
+        cached_path, meta_path = self._paths(key)
+        os.makedirs(os.path.dirname(cached_path), exist_ok=True)
+
+        # Write under temporary names and rename so readers never see partial entries
+        tmp_suffix = f'.{os.getpid()}.{threading.get_ident()}.tmp'
+        _link_or_copy(result_path, cached_path + tmp_suffix)
+        os.replace(cached_path + tmp_suffix, cached_path)
+        with open(meta_path + tmp_suffix, 'w') as f:
+            json.dump(report, f)
+        os.replace(meta_path + tmp_suffix, meta_path)
+
+        self._evict()
+
+    def _evict(self):
+        entries = []
+        total = 0
+        for root, _, files in os.walk(self.cache_dir):
+            for name in files:
+                if not name.endswith('.result'):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+                total += stat.st_size
+
+        entries.sort()
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            for stale in (path, path[:-len('.result')] + '.json'):
+                try:
+                    os.remove(stale)
+                except OSError:
+                    pass
+            total -= size
+
+    def stats(self):
+        """
+        Hits and misses of every web process, from the merged metrics
+        snapshots, so up to METRICS_FLUSH_SECONDS behind for other processes
+        Returns:
+            Dictionary with 'hits', 'misses' and 'hit_rate' in percent
+        """
+        totals = {dict(labels).get('result'): value
+                  for labels, value in metrics.totals('pdf_result_cache_requests_total').items()}
+        hits, misses = totals.get('hit', 0), totals.get('miss', 0)
+        lookups = hits + misses
+        return {
+            'hits': hits,
+            'misses': misses,
+            'hit_rate': round(hits / lookups * 100, 1) if lookups else 0.0
+        }
+
+
+def _link_or_copy(source, dest):
+    try:
+        os.link(source, dest)
+    except OSError:
+        shutil.copyfile(source, dest)
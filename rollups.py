@@ -0,0 +1,198 @@
+from datetime import date, datetime, timedelta
+from sqlalchemy import case, func, insert, select, update
+from sqlalchemy.dialects import postgresql, sqlite
+from models import db, User, PDFOperation, OperationRollup, StatCounter
+
+# Dialects with INSERT ... ON CONFLICT DO UPDATE
+_UPSERT_INSERTS = {
+    'sqlite': sqlite.insert,
+    'postgresql': postgresql.insert
+}
+
+
+def _upsert(table, keys, increments):
+    """Add increments to the row identified by keys, creating it if needed"""
+    dialect_insert = _UPSERT_INSERTS.get(db.engine.dialect.name)
+    if dialect_insert is not None:
+        statement = dialect_insert(table).values(**keys, **increments)
+        statement = statement.on_conflict_do_update(
+            index_elements=list(keys),
+            set_={column: table.c[column] + statement.excluded[column] for column in increments}
+        )
+        db.session.execute(statement)
+        return
+
+    result = db.session.execute(
+        update(table)
+        .where(*[table.c[column] == value for column, value in keys.items()])
+        .values({column: table.c[column] + value for column, value in increments.items()})
+    )
+    if result.rowcount == 0:
+        db.session.execute(insert(table).values(**keys, **increments))
+
+
+def increment_counter(name, delta=1):
+    """Adjust a StatCounter in the current transaction"""
+    _upsert(StatCounter.__table__, {'name': name}, {'value': delta})
+
+
+def tier_changed(old_tier, new_tier):
+    """Keep paid_users in step with a subscription change, in the current transaction"""
+    was_paid = (old_tier or 'free') != 'free'
+    is_paid = (new_tier or 'free') != 'free'
+    if was_paid != is_paid:
+        increment_counter('paid_users', 1 if is_paid else -1)
+
+
+def record_operations(rows):
+    """
+    Add newly logged operations to the rollups, in the caller's transaction
+    Args:
+        rows: PDFOperation column dictionaries, with created_at as a datetime
+    """
+    if not rows:
+        return
+
+    user_ids = {row['user_id'] for row in rows}
+    tiers = dict(db.session.execute(
+        select(User.id, User.subscription_tier).where(User.id.in_(user_ids))
+    ).all())
+
+    groups = {}
+    for row in rows:
+        key = (row['created_at'].date(), row['operation_type'], tiers.get(row['user_id']) or 'free')
+        totals = groups.setdefault(key, {
+            'operation_count': 0, 'failed_count': 0, 'file_count': 0,
+            'bytes_in': 0, 'bytes_out': 0, 'duration_ms': 0
+        })
+        totals['operation_count'] += 1
+        totals['failed_count'] += 0 if row.get('success', True) else 1
+        totals['file_count'] += row.get('file_count') or 0
+        totals['bytes_in'] += row.get('bytes_in') or 0
+        totals['bytes_out'] += row.get('bytes_out') or 0
+        totals['duration_ms'] += row.get('duration_ms') or 0
+
+    # Same order in every process so concurrent flushes don't deadlock
+    for (day, operation_type, tier), totals in sorted(groups.items()):
+        _upsert(
+            OperationRollup.__table__,
+            {'day': day, 'operation_type': operation_type, 'subscription_tier': tier},
+            totals
+        )
+    increment_counter('total_operations', len(rows))
+
+
+def rebuild_rollups():
+    """
+    Recompute every rollup and counter from the users and pdf_operations
+    tables. Operations are attributed to each user's current tier.
+    Returns:
+        Number of rollup rows written
+    """
+    tier = func.coalesce(User.subscription_tier, 'free')
+    day = func.date(PDFOperation.created_at)
+    grouped = db.session.execute(
+        select(
+            day,
+            PDFOperation.operation_type,
+            tier,
+            func.count(),
+            func.sum(case((PDFOperation.success.is_(False), 1), else_=0)),
+            func.sum(func.coalesce(PDFOperation.file_count, 0)),
+            func.sum(func.coalesce(PDFOperation.bytes_in, 0)),
+            func.sum(func.coalesce(PDFOperation.bytes_out, 0)),
+            func.sum(func.coalesce(PDFOperation.duration_ms, 0))
+        )
+        .select_from(PDFOperation)
+        .outerjoin(User, User.id == PDFOperation.user_id)
+        .group_by(day, PDFOperation.operation_type, tier)
+    ).all()
+
+    rollups = []
+    for row in grouped:
+        # SQLite's date() returns text
+        row_day = date.fromisoformat(row[0]) if isinstance(row[0], str) else row[0]
+        rollups.append({
+            'day': row_day,
+            'operation_type': row[1],
+            'subscription_tier': row[2],
+            'operation_count': row[3],
+            'failed_count': row[4] or 0,
+            'file_count': row[5] or 0,
+            'bytes_in': row[6] or 0,
+            'bytes_out': row[7] or 0,
+            'duration_ms': row[8] or 0
+        })
+
+    counters = {
+        'total_users': db.session.scalar(select(func.count()).select_from(User)),
+        'paid_users': db.session.scalar(
+            select(func.count()).select_from(User).where(User.subscription_tier != 'free')
+        ),
+        'total_operations': db.session.scalar(select(func.count()).select_from(PDFOperation))
+    }
+
+    try:
+        db.session.execute(OperationRollup.__table__.delete())
+        db.session.execute(StatCounter.__table__.delete())
+        if rollups:
+            db.session.execute(OperationRollup.__table__.insert(), rollups)
+        db.session.execute(
+            StatCounter.__table__.insert(),
+            [{'name': name, 'value': value} for name, value in counters.items()]
+        )
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        raise Exception(f"Error rebuilding rollups: {str(e)}")
+
+    return len(rollups)
+
+
+def ensure_rollups():
+    """
+    Backfill the rollups once for databases created before they existed.
+    Processes starting together may all try; a backfill that fails because
+    another one committed first is not an error.
+    """
+    if db.session.get(StatCounter, 'total_users') is not None:
+        return
+    try:
+        rebuild_rollups()
+    except Exception:
+        db.session.rollback()
+        if db.session.get(StatCounter, 'total_users') is None:
+            raise
+
+
+def get_dashboard_stats(days=30):
+    """
+    Read the admin dashboard figures from the counters and rollups only
+    Args:
+        days: How many days of per-day and per-operation totals to include
+    Returns:
+        Dictionary of counters plus 'by_operation', 'by_tier' and 'by_day' totals
+    """
+    stats = {name: 0 for name in ('total_users', 'paid_users', 'total_operations')}
+    for counter in StatCounter.query.all():
+        stats[counter.name] = counter.value
+
+    since = (datetime.utcnow() - timedelta(days=days - 1)).date()
+    rollups = OperationRollup.query.filter(OperationRollup.day >= since).all()
+
+    by_operation, by_tier, by_day = {}, {}, {}
+    for rollup in rollups:
+        for totals, key in ((by_operation, rollup.operation_type),
+                            (by_tier, rollup.subscription_tier),
+                            (by_day, rollup.day)):
+            entry = totals.setdefault(key, {'operations': 0, 'failed': 0, 'bytes_in': 0, 'bytes_out': 0})
+            entry['operations'] += rollup.operation_count
+            entry['failed'] += rollup.failed_count
+            entry['bytes_in'] += rollup.bytes_in
+            entry['bytes_out'] += rollup.bytes_out
+
+    stats['days'] = days
+    stats['by_operation'] = sorted(by_operation.items())
+    stats['by_tier'] = sorted(by_tier.items())
+    stats['by_day'] = sorted(by_day.items(), reverse=True)
+    return stats
@@ -27,3 +27,54 @@ document.addEventListener('DOMContentLoaded', function() {
         });
     });
 });
+
+// Give up waiting for a job after this long
+const JOB_POLL_TIMEOUT_MS = 10 * 60 * 1000;
+
+// Submit a PDF operation and poll its job until the result is ready
+async function runPdfJob(url, formData, onStatus) {
+    const response = await fetch(url, {
+        method: 'POST',
+        body: formData
+    });
+
+    let job = await response.json();
+    if (!response.ok) {
+        throw new Error(job.error);
+    }
+
+    const deadline = Date.now() + JOB_POLL_TIMEOUT_MS;
+    while (job.status === 'queued' || job.status === 'running') {
+        if (Date.now() > deadline) {
+            throw new Error('Processing is taking longer than expected. Please try again later.');
+        }
+        if (onStatus) {
+            onStatus(job);
+        }
+        await new Promise(resolve => setTimeout(resolve, 1000));
+
+        const statusResponse = await fetch(job.status_url);
+        job = await statusResponse.json();
+        if (!statusResponse.ok) {
+            throw new Error(job.error);
+        }
+    }
+
+    if (job.status !== 'done') {
+        throw new Error(job.error || 'Processing failed');
+    }
+
+    const resultResponse = await fetch(job.result_url);
+    if (!resultResponse.ok) {
+        const error = await resultResponse.json();
+        throw new Error(error.error);
+    }
+
+    return { job: job, blob: await resultResponse.blob() };
+}
+
+// Show queue progress for a running job
+function showJobStatus(resultDiv, job) {
+    const message = job.status === 'queued' ? 'Waiting in queue...' : 'Processing your files...';
+    resultDiv.innerHTML = `<p class="info">${message}</p>`;
+}
@@ -0,0 +1,106 @@
+import io
+import hashlib
+from PyPDF2.generic import (
+    ArrayObject, DictionaryObject, IndirectObject, NullObject, StreamObject
+)
+
+
+def _fingerprint(value, remap, out):
+    """Serialize a PDF value for hashing, with references already collapsed"""
+    if isinstance(value, IndirectObject):
+        out.write(b'R%d ' % remap.get(value.idnum, value.idnum))
+    elif isinstance(value, DictionaryObject):
+        out.write(b'<<')
+        for key in sorted(value.keys()):
+            if key == '/Length':
+                continue
+            out.write(key.encode('latin-1') + b' ')
+            _fingerprint(value[key], remap, out)
+        out.write(b'>>')
+    elif isinstance(value, ArrayObject):
+        out.write(b'[')
+        for item in value:
+            _fingerprint(item, remap, out)
+        out.write(b']')
+    else:
+        value.write_to_stream(out, None)
+        out.write(b' ')
+
+
+def _stream_digest(stream, remap):
+    out = io.BytesIO()
+    _fingerprint(stream, remap, out)
+    data = stream._data
+    if isinstance(data, str):
+        data = data.encode('latin-1')
+    out.write(b'stream')
+    out.write(data)
+    return hashlib.sha256(out.getvalue()).digest()
+
+
+def _rewrite_references(value, writer, remap):
+    if isinstance(value, DictionaryObject):
+        items = value.items()
+    elif isinstance(value, ArrayObject):
+        items = enumerate(value)
+    else:
+        return
+
+    for key, item in list(items):
+        if isinstance(item, IndirectObject):
+            if item.idnum in remap:
+                value[key] = IndirectObject(remap[item.idnum], 0, writer)
+        else:
+            _rewrite_references(item, writer, remap)
+
+
+def dedup_streams(writer):
+    """
+    Collapse byte-identical stream objects (fonts, images, ICC profiles, ...)
+    in a PdfWriter into a single shared object, in place
+    Args:
+        writer: PdfWriter with all pages added
+    Returns:
+        Dictionary with the number of objects and stream bytes removed
+    """
+    remap = {}  # duplicate idnum -> idnum of the copy that is kept
+    bytes_removed = 0
+
+    # Streams can reference other streams (e.g. an image's /SMask), so a second
+    # pass may find more duplicates once their children have been collapsed
+    while True:
+        index = {}
+        found = False
+        for i, obj in enumerate(writer._objects):
+            idnum = i + 1
+            if idnum in remap or not isinstance(obj, StreamObject):
+                continue
+
+            digest = _stream_digest(obj, remap)
+            canonical = index.setdefault(digest, idnum)
+            if canonical != idnum:
+                remap[idnum] = canonical
+                bytes_removed += len(obj._data)
+                found = True
+
+        if not found:
+            break
+
+    if not remap:
+        return {'objects_removed': 0, 'bytes_removed': 0}
+
+    # A kept copy may itself have been collapsed in a later pass
+    for idnum, canonical in remap.items():
+        while canonical in remap:
+            canonical = remap[canonical]
+        remap[idnum] = canonical
+
+    for idnum in remap:
+        # Keep the slot so object numbers (and the xref table) stay aligned
+        writer._objects[idnum - 1] = NullObject()
+
+    for obj in writer._objects:
+        _rewrite_references(obj, writer, remap)
+
+    return {'objects_removed': len(remap), 'bytes_removed': bytes_removed}
+
@@ -0,0 +1,49 @@
+import os
+import uuid
+import pytest
+
+
+@pytest.fixture(scope='session')
+def app(tmp_path_factory):
+    """The application on a scratch database and upload folder, with its job workers running"""
+    root = tmp_path_factory.mktemp('app')
+    # Config reads these when the app is first imported
+    os.environ.update({
+        'DATABASE_URL': f"sqlite:///{root / 'test.db'}",
+        'UPLOAD_FOLDER': str(root / 'uploads'),
+        'JOB_WORKERS': '2',
+        'PDF_PROCESS_WORKERS': '2',
+        'RESULT_CACHE_MAX_MB': '0',
+        'ADMISSION_RATE_PER_MINUTE': '0',
+        'OPERATION_LOG_FLUSH_SECONDS': '0.2'
+    })
+    from app import app
+    app.config['TESTING'] = True
+    return app
+
+
+@pytest.fixture
+def make_user(app):
+    """Create a user and return their ID"""
+    from models import db, User
+
+    def make_user(tier='pro', **columns):
+        with app.app_context():
+            user = User(email=f'{uuid.uuid4().hex}@example.com', subscription_tier=tier, **columns)
+            user.set_password('password')
+            db.session.add(user)
+            db.session.commit()
+            return user.id
+    return make_user
+
+
+@pytest.fixture
+def client(app, make_user):
+    """Test client signed in as a new pro user, whose ID is client.user_id"""
+    from models import db, User
+    client = app.test_client()
+    client.user_id = make_user()
+    with app.app_context():
+        email = db.session.get(User, client.user_id).email
+    client.post('/login', data={'email': email, 'password': 'password'})
+    return client
@@ -0,0 +1,113 @@
+"""Small PDFs built byte by byte, so tests control every offset and table"""
+import io
+import zlib
+from reportlab.pdfgen import canvas
+
+CATALOG = b'<</Type /Catalog /Pages 2 0 R>>'
+
+
+def page_objects(count, first=3):
+    """Page tree (object 2) and count pages numbered from first"""
+    kids = b' '.join(b'%d 0 R' % number for number in range(first, first + count))
+    objects = {2: b'<</Type /Pages /Kids [%s] /Count %d>>' % (kids, count)}
+    for number in range(first, first + count):
+        objects[number] = b'<</Type /Page /Parent 2 0 R /MediaBox [0 0 200 200]>>'
+    return objects
+
+
+def table_pdf(objects, trailer=b'', version=b'1.4'):
+    """
+    PDF with a classic cross-reference table
+    Args:
+        objects: Object number -> body bytes
+        trailer: Extra trailer entries; /Size and /Root are added
+    """
+    out = bytearray(b'%PDF-' + version + b'\n%\xe2\xe3\xcf\xd3\n')
+    offsets = {}
+    for number, body in sorted(objects.items()):
+        offsets[number] = len(out)
+        out += b'%d 0 obj\n%s\nendobj\n' % (number, body)
+    size = max(offsets) + 1
+    xref = len(out)
+    out += b'xref\n0 %d\n0000000000 65535 f \n' % size
+    for number in range(1, size):
+        out += b'%010d 00000 n \n' % offsets[number] if number in offsets else b'0000000000 65535 f \n'
+    out += b'trailer\n<</Size %d /Root 1 0 R %s>>\nstartxref\n%d\n%%%%EOF\n' % (size, trailer, xref)
+    return bytes(out)
+
+
+def append_update(original, objects, trailer=b''):
+    """Append an incremental update section with a table and /Prev to the original"""
+    prev = int(original.rsplit(b'startxref', 1)[1].split()[0])
+    out = bytearray(original)
+    offsets = {}
+    for number, body in sorted(objects.items()):
+        offsets[number] = len(out)
+        out += b'%d 0 obj\n%s\nendobj\n' % (number, body)
+    xref = len(out)
+    out += b'xref\n0 1\n0000000000 65535 f \n'
+    for number, offset in sorted(offsets.items()):
+        out += b'%d 1\n%010d 00000 n \n' % (number, offset)
+    size = max(offsets) + 1
+    out += b'trailer\n<</Size %d /Root 1 0 R /Prev %d %s>>\nstartxref\n%d\n%%%%EOF\n' % (
+        size, prev, trailer, xref
+    )
+    return bytes(out)
+
+
+def xref_stream_pdf(objects, compressed=(), trailer=b''):
+    """
+    PDF 1.5 with a cross-reference stream using the PNG Up predictor
+    Args:
+        objects: Object number -> body bytes
+        compressed: Numbers of objects to put in an object stream
+        trailer: Extra entries for the cross-reference stream dictionary
+    """
+    out = bytearray(b'%PDF-1.5\n%\xe2\xe3\xcf\xd3\n')
+    entries = {0: (0, 0, 65535)}
+    for number, body in sorted(objects.items()):
+        if number not in compressed:
+            entries[number] = (1, len(out), 0)
+            out += b'%d 0 obj\n%s\nendobj\n' % (number, body)
+
+    next_number = max(objects) + 1
+    if compressed:
+        stream_number, next_number = next_number, next_number + 1
+        header, body = b'', b''
+        for index, number in enumerate(sorted(compressed)):
+            header += b'%d %d ' % (number, len(body))
+            body += objects[number] + b' '
+            entries[number] = (2, stream_number, index)
+        data = zlib.compress(header + body)
+        entries[stream_number] = (1, len(out), 0)
+        out += b'%d 0 obj\n<</Type /ObjStm /N %d /First %d /Filter /FlateDecode /Length %d>>\nstream\n' % (
+            stream_number, len(compressed), len(header), len(data)
+        ) + data + b'\nendstream\nendobj\n'
+
+    xref_number = next_number
+    xref = len(out)
+    entries[xref_number] = (1, xref, 0)
+    rows, previous = b'', bytes(7)
+    for number in range(xref_number + 1):
+        kind, field, generation = entries.get(number, (0, 0, 0))
+        row = bytes([kind]) + field.to_bytes(4, 'big') + generation.to_bytes(2, 'big')
+        rows += b'\x02' + bytes((a - b) & 0xff for a, b in zip(row, previous))
+        previous = row
+    data = zlib.compress(rows)
+    out += (
+        b'%d 0 obj\n<</Type /XRef /Size %d /W [1 4 2] /Root 1 0 R %s '
+        b'/DecodeParms <</Predictor 12 /Columns 7>> /Filter /FlateDecode /Length %d>>\nstream\n'
+        % (xref_number, xref_number + 1, trailer, len(data))
+    ) + data + b'\nendstream\nendobj\nstartxref\n%d\n%%%%EOF\n' % xref
+    return bytes(out)
+
+
+def reportlab_pdf(pages):
+    """Multi-page text PDF as reportlab writes it"""
+    output = io.BytesIO()
+    document = canvas.Canvas(output)
+    for number in range(1, pages + 1):
+        document.drawString(100, 700, f'Page {number} of {pages}')
+        document.showPage()
+    document.save()
+    return output.getvalue()
@@ -0,0 +1,106 @@
+import json
+import os
+import time
+from datetime import datetime
+import pytest
+from test_jobs import pdf_upload, submit
+
+
+@pytest.fixture
+def admin_client(app):
+    """Test client signed in as the admin user"""
+    from models import db, User
+    with app.app_context():
+        if User.query.filter_by(email='admin@pdftoolkit.com').first() is None:
+            user = User(email='admin@pdftoolkit.com', subscription_tier='pro')
+            user.set_password('password')
+            db.session.add(user)
+            db.session.commit()
+    client = app.test_client()
+    client.post('/login', data={'email': 'admin@pdftoolkit.com', 'password': 'password'})
+    return client
+
+
+def test_dashboard_shows_totals_by_day(admin_client):
+    submit(admin_client, '/compress', {'file': pdf_upload(1)})
+    today = datetime.utcnow().strftime('%Y-%m-%d')
+
+    # The operation reaches the rollups once the operation log flushes
+    deadline = time.monotonic() + 10
+    while True:
+        page = admin_client.get('/admin').get_data(as_text=True)
+        if f'<td>{today}</td>' in page:
+            break
+        assert time.monotonic() < deadline, 'No row for today'
+        time.sleep(0.1)
+    assert 'By Day' in page
+
+
+def test_dashboard_is_for_admins_only(client):
+    response = client.get('/admin')
+    assert response.status_code == 302
+
+
+def test_cache_stats_cover_every_web_process(admin_client):
+    from app import job_queue
+    from metrics import metrics
+    before = job_queue.result_cache.stats()
+    # Lookups another web process has published
+    path = os.path.join(metrics.snapshot_dir, '1.json')
+    with open(path, 'w') as f:
+        json.dump({'counters': [
+            ['pdf_result_cache_requests_total', [['result', 'hit']], 3],
+            ['pdf_result_cache_requests_total', [['result', 'miss']], 1]
+        ]}, f)
+    try:
+        stats = job_queue.result_cache.stats()
+        assert (stats['hits'], stats['misses']) == (before['hits'] + 3, before['misses'] + 1)
+        assert f"{stats['hits']} hits / {stats['misses']} misses" in admin_client.get('/admin').get_data(as_text=True)
+    finally:
+        os.remove(path)
+
+
+def wait_for_profile(reason, timeout=30):
+    from app import job_queue
+    deadline = time.monotonic() + timeout
+    while True:
+        profiles = [profile for profile in job_queue.profiles.list() if profile['reason'] == reason]
+        if profiles:
+            return profiles[0]
+        assert time.monotonic() < deadline, f'No {reason} profile'
+        time.sleep(0.05)
+
+
+def test_requested_profile_can_be_downloaded(admin_client):
+    job = submit(admin_client, '/compress', {'file': pdf_upload(2), 'profile': '1'})
+    from app import job_queue
+    [profile] = [profile for profile in job_queue.profiles.list() if profile['job_id'] == job['job_id']]
+    assert profile['reason'] == 'requested'
+    assert profile['id'] in admin_client.get('/admin').get_data(as_text=True)
+
+    summary = admin_client.get(f"/admin/profiles/{profile['id']}.txt")
+    assert summary.status_code == 200
+    assert summary.get_data(as_text=True).startswith('Peak traced memory')
+    assert admin_client.get(f"/admin/profiles/{profile['id']}.prof").status_code == 200
+    # The details file is only shown on the dashboard
+    assert admin_client.get(f"/admin/profiles/{profile['id']}.json").status_code == 404
+
+
+def test_slow_job_is_rerun_under_the_profiler(admin_client, monkeypatch):
+    from app import job_queue
+    monkeypatch.setattr(job_queue.profiles, 'slow_seconds', 1e-6)
+    job = submit(admin_client, '/compress', {'file': pdf_upload(2)})
+
+    profile = wait_for_profile('slow')
+    assert profile['job_id'] == job['job_id']
+    assert profile['original_duration_ms'] >= 0
+    assert admin_client.get(f"/admin/profiles/{profile['id']}.prof").status_code == 200
+    # The rerun's copy of the inputs is removed once it's done
+    deadline = time.monotonic() + 10
+    while os.path.exists(os.path.join(job_queue.job_dir(job['job_id']), 'profile')):
+        assert time.monotonic() < deadline
+        time.sleep(0.05)
+
+
+def test_profiles_are_for_admins_only(client):
+    assert client.get('/admin/profiles/anything.txt').status_code == 302
@@ -0,0 +1,91 @@
+import io
+import time
+from types import SimpleNamespace
+import pytest
+from admission import AdmissionControl, INFLIGHT_RETRY_SECONDS
+from pdf_samples import reportlab_pdf
+
+
+def make_admission(tmp_path, user_inflight=2, global_inflight=3, rate_per_minute=0, burst=10, ttl=900):
+    return AdmissionControl(SimpleNamespace(config={
+        'UPLOAD_FOLDER': str(tmp_path),
+        'ADMISSION_USER_INFLIGHT': user_inflight,
+        'ADMISSION_GLOBAL_INFLIGHT': global_inflight,
+        'ADMISSION_RATE_PER_MINUTE': rate_per_minute,
+        'ADMISSION_BURST': burst,
+        'ADMISSION_SLOT_TTL_SECONDS': ttl
+    }))
+
+
+def test_user_inflight_limit(tmp_path):
+    admission = make_admission(tmp_path)
+    first, _ = admission.acquire(1)
+    second, _ = admission.acquire(1)
+    assert first and second and first != second
+    assert admission.acquire(1) == (None, INFLIGHT_RETRY_SECONDS)
+
+    admission.release(first)
+    slot, retry_after = admission.acquire(1)
+    assert slot is not None and retry_after is None
+
+
+def test_global_inflight_limit(tmp_path):
+    admission = make_admission(tmp_path)
+    for user_id in (1, 2, 3):
+        assert admission.acquire(user_id)[0] is not None
+    assert admission.acquire(4) == (None, INFLIGHT_RETRY_SECONDS)
+
+
+def test_rate_limit_retry_after(tmp_path):
+    admission = make_admission(tmp_path, user_inflight=0, global_inflight=0, rate_per_minute=6, burst=2)
+    assert admission.acquire(1)[0] is not None
+    assert admission.acquire(1)[0] is not None
+    # One token every 10 seconds
+    slot, retry_after = admission.acquire(1)
+    assert slot is None
+    assert 9 <= retry_after <= 10
+    # Buckets are per user
+    assert admission.acquire(2)[0] is not None
+
+
+def test_expired_slots_are_dropped(tmp_path):
+    admission = make_admission(tmp_path, user_inflight=1, ttl=0.2)
+    assert admission.acquire(1)[0] is not None
+    assert admission.acquire(1)[0] is None
+    time.sleep(0.3)
+    assert admission.acquire(1)[0] is not None
+
+
+def test_limits_are_shared_through_the_file(tmp_path):
+    first = make_admission(tmp_path, user_inflight=1)
+    second = make_admission(tmp_path, user_inflight=1)
+    assert first.acquire(1)[0] is not None
+    assert second.acquire(1)[0] is None
+
+
+@pytest.fixture
+def one_slot(app, monkeypatch):
+    from app import job_queue
+    monkeypatch.setattr(job_queue.admission, 'user_inflight', 1)
+    return job_queue.admission
+
+
+def test_busy_user_gets_429_with_retry_after(client, one_slot):
+    slot, _ = one_slot.acquire(client.user_id)
+    try:
+        response = client.post('/compress', data={'file': (io.BytesIO(reportlab_pdf(1)), 'doc.pdf')},
+                               content_type='multipart/form-data')
+        assert response.status_code == 429
+        assert response.headers['Retry-After'] == str(INFLIGHT_RETRY_SECONDS)
+        assert 'error' in response.get_json()
+    finally:
+        one_slot.release(slot)
+
+
+def test_slot_is_freed_when_no_job_is_queued(client, one_slot):
+    response = client.post('/compress', data={'file': (io.BytesIO(b'not a pdf'), 'doc.pdf')},
+                           content_type='multipart/form-data')
+    assert response.status_code == 400
+    slot, _ = one_slot.acquire(client.user_id)
+    assert slot is not None
+    one_slot.release(slot)
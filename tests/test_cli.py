@@ -0,0 +1,37 @@
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Runs the release step's command and reports what is still running as it exits
+INIT_DB = """
+import atexit, multiprocessing, sys, threading
+
+@atexit.register
+def report():
+    print('threads', sorted(thread.name for thread in threading.enumerate()))
+    print('children', len(multiprocessing.active_children()))
+
+sys.argv = ['flask', '--app', 'app', 'init-db']
+from flask.cli import main
+main()
+"""
+
+
+def test_init_db_starts_no_job_workers(tmp_path):
+    env = dict(
+        os.environ,
+        DATABASE_URL=f"sqlite:///{tmp_path / 'release.db'}",
+        UPLOAD_FOLDER=str(tmp_path / 'uploads'),
+        INIT_DB_ON_STARTUP='false'
+    )
+    result = subprocess.run(
+        [sys.executable, '-c', INIT_DB], cwd=ROOT, env=env, capture_output=True, text=True, timeout=120
+    )
+
+    assert result.returncode == 0, result.stderr
+    lines = dict(line.split(' ', 1) for line in result.stdout.splitlines() if ' ' in line)
+    assert 'pdf-job' not in lines['threads']
+    assert lines['children'] == '0'
+    assert (tmp_path / 'release.db').exists()
@@ -0,0 +1,110 @@
+import io
+import random
+import zlib
+import pytest
+from PyPDF2 import PdfReader, PdfWriter
+from image_compression import recompress_images
+from pdf_samples import CATALOG, table_pdf
+from test_jobs import submit
+
+# Pages are 200pt (2.78in) square, so a 1200 pixel image is drawn at 432 DPI
+PAGE_SIZE = 200
+
+
+def noise(size, components):
+    return random.Random(size).randbytes(size * size * components)
+
+
+def image(size, color_space=b'/DeviceRGB', components=3, data=None, entries=b''):
+    data = zlib.compress(data if data is not None else noise(size, components))
+    return b'<</Type /XObject /Subtype /Image /Width %d /Height %d /ColorSpace %s /BitsPerComponent 8 ' \
+           b'/Filter /FlateDecode %s /Length %d>>\nstream\n%s\nendstream' % (
+               size, size, color_space, entries, len(data), data
+           )
+
+
+def image_pdf(body, extra=None):
+    """One page drawing the image object body as /Im0"""
+    return table_pdf({
+        1: CATALOG,
+        2: b'<</Type /Pages /Kids [3 0 R] /Count 1>>',
+        3: b'<</Type /Page /Parent 2 0 R /MediaBox [0 0 %d %d] '
+           b'/Resources <</XObject <</Im0 4 0 R>>>>>>' % (PAGE_SIZE, PAGE_SIZE),
+        4: body,
+        **(extra or {})
+    })
+
+
+def recompress(source, quality):
+    writer = PdfWriter()
+    for page in PdfReader(io.BytesIO(source)).pages:
+        writer.add_page(page)
+    report = recompress_images(writer, quality)
+    output = io.BytesIO()
+    writer.write(output)
+    reader = PdfReader(io.BytesIO(output.getvalue()), strict=True)
+    return report, reader.pages[0]['/Resources']['/XObject']['/Im0']
+
+
+@pytest.mark.parametrize('quality, dpi, size', [
+    ('low', 72, 200),
+    ('medium', 150, 417),
+    ('high', 220, 611),
+])
+def test_images_are_capped_at_the_tier_resolution(quality, dpi, size):
+    report, result = recompress(image_pdf(image(1200)), quality)
+
+    [entry] = report
+    assert entry['action'] == 'recompressed'
+    assert (entry['new_width'], entry['new_height']) == (size, size)
+    assert round(size / (PAGE_SIZE / 72)) == dpi
+    assert (result['/Width'], result['/Height']) == (size, size)
+    assert entry['bytes_saved'] == entry['original_bytes'] - entry['new_bytes'] > 0
+    # High keeps raw images lossless
+    assert result['/Filter'] == ('/FlateDecode' if quality == 'high' else '/DCTDecode')
+
+
+def test_image_below_the_cap_is_not_resampled():
+    report, result = recompress(image_pdf(image(240)), 'low')
+    assert report[0].get('new_width', 240) == 240
+    assert result['/Width'] == 240
+
+
+def test_soft_mask_is_kept():
+    mask = image(1200, b'/DeviceGray', 1, data=bytes(range(256)) * (1200 * 1200 // 256))
+    report, result = recompress(image_pdf(image(1200, entries=b'/SMask 5 0 R'), {5: mask}), 'low')
+
+    assert report[0]['action'] == 'recompressed'
+    smask = result['/SMask']
+    assert (smask['/Width'], smask['/ColorSpace']) == (1200, '/DeviceGray')
+    assert smask.get_data() == bytes(range(256)) * (1200 * 1200 // 256)
+
+
+def test_cmyk_image_is_left_alone():
+    source = image(1200, b'/DeviceCMYK', 4)
+    report, result = recompress(image_pdf(source), 'low')
+
+    assert (report[0]['action'], report[0]['reason']) == ('skipped', 'unsupported color space')
+    assert result['/ColorSpace'] == '/DeviceCMYK'
+    assert result.get_data() == noise(1200, 4)
+
+
+def test_image_that_would_grow_is_left_alone():
+    report, result = recompress(image_pdf(image(4)), 'low')
+
+    assert (report[0]['action'], report[0]['reason']) == ('skipped', 'no savings')
+    assert report[0]['bytes_saved'] == 0
+    assert result['/Filter'] == '/FlateDecode'
+    assert result.get_data() == noise(4, 3)
+
+
+def test_compress_job_reports_the_savings(client):
+    job = submit(client, '/compress', {
+        'file': (io.BytesIO(image_pdf(image(1200))), 'photo.pdf'),
+        'quality': 'low'
+    })
+
+    assert job['status'] == 'done', job['error']
+    [entry] = job['report']['images']
+    assert entry['action'] == 'recompressed'
+    assert entry['bytes_saved'] > 0
@@ -0,0 +1,168 @@
+import io
+import pytest
+from PIL import Image
+from PyPDF2 import PdfReader
+from image_pdf import fit_to_page
+from pdf_utils import PDFProcessor
+from test_jobs import submit
+
+
+def jpeg(size=(120, 80), mode='RGB', color='red', **options):
+    output = io.BytesIO()
+    Image.new(mode, size, color).save(output, format='JPEG', **options)
+    return output.getvalue()
+
+
+def two_color_jpeg(orientation):
+    """Red left half, blue right half, tagged with an EXIF orientation"""
+    img = Image.new('RGB', (120, 80), 'blue')
+    img.paste('red', (0, 0, 60, 80))
+    exif = Image.Exif()
+    exif[0x0112] = orientation
+    output = io.BytesIO()
+    img.save(output, format='JPEG', exif=exif, quality=95)
+    return output.getvalue()
+
+
+def convert(*images, dpi=150):
+    data = PDFProcessor.image_to_pdf([io.BytesIO(image) for image in images], dpi=dpi).read()
+    reader = PdfReader(io.BytesIO(data), strict=True)
+    return data, [page['/Resources']['/XObject']['/Im0'] for page in reader.pages]
+
+
+@pytest.mark.parametrize('kind, image, color_space', [
+    ('baseline', jpeg(), '/DeviceRGB'),
+    ('progressive', jpeg(progressive=True), '/DeviceRGB'),
+    ('grayscale', jpeg(mode='L', color=128), '/DeviceGray'),
+    ('cmyk', jpeg(mode='CMYK', color=(0, 255, 255, 0)), '/DeviceCMYK'),
+])
+def test_jpeg_is_embedded_verbatim(kind, image, color_space):
+    data, [embedded] = convert(image)
+
+    assert image in data
+    assert embedded['/Filter'] == '/DCTDecode'
+    assert embedded['/ColorSpace'] == color_space
+    assert embedded.get_data() == image
+    assert (embedded['/Width'], embedded['/Height']) == (120, 80)
+
+
+def test_adobe_cmyk_jpeg_is_marked_inverted():
+    image = jpeg(mode='CMYK', color=(0, 255, 255, 0))
+    assert 'adobe' in Image.open(io.BytesIO(image)).info
+    _, [embedded] = convert(image)
+    assert list(embedded['/Decode']) == [1, 0] * 4
+
+
+def is_red(pixel):
+    return pixel[0] > 200 and pixel[2] < 50
+
+
+@pytest.mark.parametrize('orientation, size, red, blue', [
+    (1, (120, 80), (30, 40), (90, 40)),
+    (3, (120, 80), (90, 40), (30, 40)),
+    # Turned a quarter, the red half ends up on top or at the bottom
+    (6, (80, 120), (40, 30), (40, 90)),
+    (8, (80, 120), (40, 90), (40, 30)),
+])
+def test_exif_orientation_is_applied(orientation, size, red, blue):
+    image = two_color_jpeg(orientation)
+    data, [embedded] = convert(image)
+
+    # Only an upright photo can be passed through
+    assert (image in data) == (orientation == 1)
+    pixels = Image.open(io.BytesIO(embedded.get_data())).convert('RGB')
+    assert pixels.size == size
+    assert is_red(pixels.getpixel(red))
+    assert not is_red(pixels.getpixel(blue))
+
+
+@pytest.mark.parametrize('mode, color_space', [
+    ('RGBA', '/DeviceRGB'),
+    ('P', '/DeviceRGB'),
+    ('L', '/DeviceGray'),
+])
+def test_other_images_are_flate_encoded(mode, color_space):
+    img = Image.new(mode, (30, 20))
+    output = io.BytesIO()
+    img.save(output, format='PNG')
+    _, [embedded] = convert(output.getvalue())
+
+    assert embedded['/Filter'] == '/FlateDecode'
+    assert embedded['/ColorSpace'] == color_space
+    assert len(embedded.get_data()) == 30 * 20 * (3 if color_space == '/DeviceRGB' else 1)
+
+
+def test_transparency_is_flattened_onto_white():
+    output = io.BytesIO()
+    Image.new('RGBA', (4, 4), (255, 0, 0, 0)).save(output, format='PNG')
+    _, [embedded] = convert(output.getvalue())
+    assert embedded.get_data() == b'\xff' * 4 * 4 * 3
+
+
+def test_pages_keep_upload_order():
+    images = [jpeg(color=color) for color in ('red', 'green', 'blue')]
+    _, embedded = convert(*images)
+    assert [image.get_data() for image in embedded] == images
+
+
+def needed_pixels(size, dpi):
+    """Pixels an image of this size needs at dpi once fitted to a letter page"""
+    _, _, width, height = fit_to_page(size[0], size[1], 612, 792)
+    return round(width / 72 * dpi), round(height / 72 * dpi)
+
+
+@pytest.mark.parametrize('dpi', [150, 300])
+def test_oversized_jpeg_is_prescaled_to_the_dpi(dpi):
+    image = jpeg((4000, 3000))
+    data, [embedded] = convert(image, dpi=dpi)
+
+    width, height = needed_pixels((4000, 3000), dpi)
+    assert embedded['/Width'] == width
+    assert abs(embedded['/Height'] - height) <= 1
+    # Still a JPEG, re-encoded at the smaller size
+    assert embedded['/Filter'] == '/DCTDecode'
+    assert image not in data
+    assert Image.open(io.BytesIO(embedded.get_data())).size == (embedded['/Width'], embedded['/Height'])
+
+
+def test_oversized_png_is_prescaled():
+    output = io.BytesIO()
+    Image.new('RGB', (3000, 4000), 'green').save(output, format='PNG')
+    _, [embedded] = convert(output.getvalue(), dpi=150)
+
+    width, height = needed_pixels((3000, 4000), 150)
+    assert abs(embedded['/Width'] - width) <= 1
+    assert embedded['/Height'] == height
+    assert embedded['/Filter'] == '/FlateDecode'
+
+
+def test_image_near_the_dpi_is_not_prescaled():
+    # Within PRESCALE_THRESHOLD of what 150 DPI needs, so passed through
+    size = (1300, 975)
+    assert needed_pixels(size, 150)[0] * 1.25 > size[0]
+    image = jpeg(size)
+    data, [embedded] = convert(image, dpi=150)
+    assert image in data
+
+
+def test_original_dpi_keeps_every_pixel():
+    image = jpeg((4000, 3000))
+    data, [embedded] = convert(image, dpi=None)
+    assert image in data
+    assert (embedded['/Width'], embedded['/Height']) == (4000, 3000)
+
+
+@pytest.mark.parametrize('dpi', ['300', 'original'])
+def test_convert_uses_the_requested_dpi(client, dpi):
+    job = submit(client, '/convert', {'files': [(io.BytesIO(jpeg((4000, 3000))), 'photo.jpg')], 'dpi': dpi})
+
+    assert job['status'] == 'done', job['error']
+    reader = PdfReader(io.BytesIO(client.get(job['result_url']).data), strict=True)
+    width = reader.pages[0]['/Resources']['/XObject']['/Im0']['/Width']
+    assert width == (4000 if dpi == 'original' else needed_pixels((4000, 3000), 300)[0])
+
+
+def test_convert_rejects_other_dpis(client):
+    response = client.post('/convert', data={'files': [(io.BytesIO(jpeg()), 'photo.jpg')], 'dpi': '600'},
+                           content_type='multipart/form-data')
+    assert response.status_code == 400
@@ -0,0 +1,108 @@
+import threading
+from collections import Counter
+from job_scheduler import FairScheduler, LANE_WEIGHTS
+
+
+def fill(scheduler, lane, count, cost_ms=10):
+    for number in range(count):
+        scheduler.put((lane, number), lane, cost_ms)
+
+
+def serve(scheduler, count, max_cost_ms=None):
+    return [scheduler.get(max_cost_ms) for _ in range(count)]
+
+
+def test_busy_lanes_share_workers_by_weight():
+    scheduler = FairScheduler()
+    for lane in LANE_WEIGHTS:
+        fill(scheduler, lane, 100)
+
+    shares = Counter(lane for lane, _ in serve(scheduler, 50))
+    assert shares == {'pro': 30, 'basic': 15, 'free': 5}
+
+
+def test_share_is_measured_in_cost_not_jobs():
+    scheduler = FairScheduler({'pro': 1, 'free': 1})
+    fill(scheduler, 'pro', 100, cost_ms=100)
+    fill(scheduler, 'free', 100, cost_ms=10)
+
+    shares = Counter(lane for lane, _ in serve(scheduler, 44))
+    assert shares == {'pro': 4, 'free': 40}
+
+
+def test_lane_keeps_submission_order():
+    scheduler = FairScheduler()
+    fill(scheduler, 'basic', 5)
+    assert serve(scheduler, 5) == [('basic', number) for number in range(5)]
+
+
+def test_idle_lane_gets_no_credit():
+    scheduler = FairScheduler()
+    fill(scheduler, 'pro', 100)
+    serve(scheduler, 60)
+
+    # Free was idle while pro ran alone; it mustn't be owed the time it missed
+    fill(scheduler, 'free', 20)
+    shares = Counter(lane for lane, _ in serve(scheduler, 14))
+    assert shares == {'pro': 12, 'free': 2}
+
+
+def test_fast_lane_skips_costly_heads():
+    scheduler = FairScheduler()
+    scheduler.put('free large', 'free', 5000)
+    scheduler.put('free small', 'free', 10)
+    scheduler.put('pro large', 'pro', 5000)
+    scheduler.put('pro small', 'pro', 10)
+
+    assert serve(scheduler, 2, max_cost_ms=100) == ['pro small', 'free small']
+    # The general workers still serve the skipped jobs, in tag order
+    assert serve(scheduler, 2) == ['pro large', 'free large']
+
+
+def test_costly_head_is_not_starved_by_fast_lane():
+    scheduler = FairScheduler({'pro': 1, 'free': 1})
+    scheduler.put('large', 'free', 600)
+    fill(scheduler, 'pro', 100, cost_ms=60)
+
+    served = []
+    while 'large' not in served:
+        # A fast-lane take and a general take alternate
+        served.append(scheduler.get(max_cost_ms=100))
+        served.append(scheduler.get())
+    # Pro's jobs up to tag 600 go first, then the fast lane takes one more
+    # while the large job waits for a general take
+    assert served.index('large') == 11
+    assert scheduler.depth() == {'pro': 100 - len(served) + 1, 'free': 0}
+
+
+def test_out_of_turn_fast_lane_take_keeps_clock():
+    scheduler = FairScheduler()
+    scheduler.put('free large', 'free', 5000)
+    scheduler.put('free small', 'free', 10)
+    assert scheduler.get(max_cost_ms=100) == 'free small'
+
+    # A lane arriving now isn't queued behind the small job's far-off tag
+    scheduler.put('pro', 'pro', 10)
+    assert scheduler.get() == 'pro'
+
+
+def test_unknown_lane_goes_to_default():
+    scheduler = FairScheduler()
+    scheduler.put('job', 'enterprise', 10)
+    assert scheduler.depth() == {'pro': 0, 'basic': 0, 'free': 1}
+
+
+def test_close_wakes_waiting_workers():
+    scheduler = FairScheduler()
+    scheduler.put('large', 'free', 5000)
+    results = []
+    worker = threading.Thread(target=lambda: results.append(scheduler.get(max_cost_ms=100)))
+    worker.start()
+    worker.join(0.1)
+    # Only a costly job is queued, so the fast-lane worker keeps waiting
+    assert worker.is_alive()
+
+    scheduler.close()
+    worker.join(5)
+    assert results == [None]
+    assert scheduler.get() is None
@@ -0,0 +1,210 @@
+import io
+import json
+import os
+import time
+import zipfile
+from datetime import datetime, timedelta
+import pytest
+from PIL import Image
+from PyPDF2 import PdfReader
+from pdf_samples import reportlab_pdf
+
+
+def pdf_upload(pages, name='doc.pdf'):
+    return io.BytesIO(reportlab_pdf(pages)), name
+
+
+def image_upload(name, color):
+    output = io.BytesIO()
+    Image.new('RGB', (120, 80), color).save(output, format=name.rsplit('.', 1)[1].replace('jpg', 'jpeg'))
+    output.seek(0)
+    return output, name
+
+
+def wait_for(client, job, timeout=60):
+    deadline = time.monotonic() + timeout
+    while job['status'] in ('queued', 'running'):
+        assert time.monotonic() < deadline, f"Job {job['job_id']} is still {job['status']}"
+        time.sleep(0.05)
+        job = client.get(job['status_url']).get_json()
+    return job
+
+
+def submit(client, url, data):
+    response = client.post(url, data=data, content_type='multipart/form-data')
+    assert response.status_code == 202, response.get_json()
+    return wait_for(client, response.get_json())
+
+
+def pdf_pages(data):
+    return len(PdfReader(io.BytesIO(data)).pages)
+
+
+OPERATIONS = {
+    'merge': (
+        '/merge',
+        lambda: {'files': [pdf_upload(2, 'a.pdf'), pdf_upload(3, 'b.pdf')]},
+        lambda data: pdf_pages(data) == 5
+    ),
+    'split': (
+        '/split',
+        lambda: {'file': pdf_upload(3), 'split_type': 'all'},
+        lambda data: len(zipfile.ZipFile(io.BytesIO(data)).namelist()) == 3
+    ),
+    'compress': (
+        '/compress',
+        lambda: {'file': pdf_upload(4), 'quality': 'low'},
+        lambda data: pdf_pages(data) == 4
+    ),
+    'convert': (
+        '/convert',
+        lambda: {'files': [image_upload('a.png', 'red'), image_upload('b.jpg', 'blue')]},
+        lambda data: pdf_pages(data) == 2
+    ),
+    'pipeline': (
+        '/api/pipeline',
+        lambda: {'file': pdf_upload(4), 'steps': json.dumps([
+            {'op': 'extract', 'pages': [1, 3]},
+            {'op': 'rotate', 'rotation': 90},
+            {'op': 'metadata', 'title': 'Tested'}
+        ])},
+        lambda data: [page.rotation for page in PdfReader(io.BytesIO(data)).pages] == [90, 90]
+    ),
+}
+
+
+@pytest.mark.parametrize('operation', OPERATIONS)
+def test_submit_run_and_download(client, operation):
+    url, form, check = OPERATIONS[operation]
+    job = submit(client, url, form())
+    assert job['status'] == 'done', job['error']
+    assert job['operation_type'] == operation
+
+    result = client.get(job['result_url'])
+    assert result.status_code == 200
+    assert result.mimetype in ('application/pdf', 'application/zip')
+    assert check(result.data)
+
+
+def test_invalid_upload_is_rejected_without_a_job(app, client):
+    from models import Job
+    response = client.post('/compress', data={'file': (io.BytesIO(b'not a pdf'), 'doc.pdf')},
+                           content_type='multipart/form-data')
+    assert response.status_code == 400
+    with app.app_context():
+        assert Job.query.filter_by(user_id=client.user_id).count() == 0
+
+
+def test_unknown_quality_is_rejected_without_a_job(app, client):
+    from models import Job
+    response = client.post('/compress', data={'file': pdf_upload(1), 'quality': 'ultra'},
+                           content_type='multipart/form-data')
+    assert response.status_code == 400
+    with app.app_context():
+        assert Job.query.filter_by(user_id=client.user_id).count() == 0
+
+
+def test_failed_job_reports_its_error(client):
+    # Page numbers are only checked against the document in the worker
+    job = submit(client, '/api/pipeline', {
+        'file': pdf_upload(2),
+        'steps': json.dumps([{'op': 'extract', 'pages': [5]}])
+    })
+    assert job['status'] == 'failed'
+    assert job['error']
+    assert client.get(job['result_url']).status_code == 409
+
+
+def test_other_users_jobs_are_hidden(app, client, make_user):
+    job = submit(client, '/compress', {'file': pdf_upload(1)})
+    other = app.test_client()
+    other.user_id = make_user()
+    from models import db, User
+    with app.app_context():
+        email = db.session.get(User, other.user_id).email
+    other.post('/login', data={'email': email, 'password': 'password'})
+    assert other.get(job['status_url']).status_code == 404
+    assert other.get(job['result_url']).status_code == 404
+
+
+def stored_job(app, user_id, job_id, status, attempts, heartbeat_at, with_inputs=True):
+    from app import job_queue
+    from models import db, Job
+    if with_inputs:
+        input_dir = job_queue.input_dir(job_id)
+        os.makedirs(input_dir, exist_ok=True)
+        with open(os.path.join(input_dir, '0000_doc.pdf'), 'wb') as f:
+            f.write(reportlab_pdf(2))
+    with app.app_context():
+        db.session.add(Job(
+            id=job_id, user_id=user_id, operation_type='compress', status=status,
+            params=json.dumps({'quality': 'low'}), file_count=1, worker_id='gone:1:0',
+            heartbeat_at=heartbeat_at, attempts=attempts
+        ))
+        db.session.commit()
+
+
+def test_abandoned_jobs_are_recovered(app, client):
+    from app import job_queue
+    from models import db, Job
+    long_ago = datetime.utcnow() - timedelta(hours=1)
+    stored_job(app, client.user_id, 'r' * 32, 'running', 1, long_ago)
+    stored_job(app, client.user_id, 'q' * 32, 'queued', 0, long_ago)
+    stored_job(app, client.user_id, 'x' * 32, 'running', job_queue.max_attempts, long_ago)
+    stored_job(app, client.user_id, 'm' * 32, 'queued', 0, long_ago, with_inputs=False)
+    # Still owned by a live process
+    stored_job(app, client.user_id, 'l' * 32, 'queued', 0, datetime.utcnow())
+    job_queue.admission._connection().execute(
+        'INSERT INTO inflight (slot, user_id, expires_at) VALUES (?, ?, ?)', ('x' * 32, client.user_id, time.time() + 60)
+    )
+
+    with app.app_context():
+        job_queue._recover_stale_jobs()
+
+    for job_id in ('r' * 32, 'q' * 32):
+        job = wait_for(client, client.get(f'/api/jobs/{job_id}').get_json())
+        assert job['status'] == 'done'
+        assert pdf_pages(client.get(job['result_url']).data) == 2
+    for job_id in ('x' * 32, 'm' * 32):
+        job = client.get(f'/api/jobs/{job_id}').get_json()
+        assert job['status'] == 'failed'
+        assert job['error'] == 'Processing was interrupted. Please try again.'
+    assert job_queue.admission._connection().execute(
+        'SELECT COUNT(*) FROM inflight WHERE slot = ?', ('x' * 32,)
+    ).fetchone() == (0,)
+    with app.app_context():
+        live = db.session.get(Job, 'l' * 32)
+        assert (live.status, live.worker_id) == ('queued', 'gone:1:0')
+        assert db.session.get(Job, 'r' * 32).attempts == 2
+
+
+def test_job_claimed_by_another_process_is_not_run(app, client):
+    from app import job_queue
+    from models import db, Job
+    stored_job(app, client.user_id, 'o' * 32, 'queued', 0, datetime.utcnow())
+    job_queue._run('o' * 32, job_queue.pdf_executor)
+    with app.app_context():
+        job = db.session.get(Job, 'o' * 32)
+        assert (job.status, job.attempts) == ('queued', 0)
+
+
+def test_finished_jobs_expire(app, client):
+    from app import job_queue
+    from models import db, Job
+    job = submit(client, '/compress', {'file': pdf_upload(1)})
+    orphan = os.path.join(job_queue.storage_dir, 'orphan')
+    os.makedirs(orphan)
+    os.utime(orphan, (0, 0))
+
+    with app.app_context():
+        # Not old enough yet
+        job_queue._expire_jobs()
+        assert db.session.get(Job, job['job_id']) is not None
+        db.session.get(Job, job['job_id']).finished_at = datetime.utcnow() - timedelta(days=2)
+        db.session.commit()
+        assert job_queue._expire_jobs() >= 1
+        assert db.session.get(Job, job['job_id']) is None
+
+    assert not os.path.exists(job_queue.job_dir(job['job_id']))
+    assert not os.path.exists(orphan)
+    assert client.get(job['result_url']).status_code == 404
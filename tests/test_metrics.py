@@ -0,0 +1,133 @@
+import json
+import os
+import re
+import pytest
+from flask import Flask
+from metrics import DURATION_BUCKETS, Metrics
+
+SAMPLE = re.compile(r'^(\w+)(?:\{(.*)\})? (\S+)$')
+LABEL = re.compile(r'(\w+)="((?:[^"\\]|\\.)*)"')
+
+
+def parse(text):
+    """Exposition format -> {(name, labels): value} and {name: type}"""
+    samples, types = {}, {}
+    for line in text.splitlines():
+        if line.startswith('# TYPE '):
+            _, _, name, metric_type = line.split(' ')
+            types[name] = metric_type
+        elif line and not line.startswith('#'):
+            name, labels, value = SAMPLE.match(line).groups()
+            labels = tuple(sorted(LABEL.findall(labels or '')))
+            assert (name, labels) not in samples, f'Duplicate sample {line}'
+            samples[(name, labels)] = float(value)
+    return samples, types
+
+
+@pytest.fixture
+def metrics(tmp_path):
+    app = Flask(__name__)
+    app.config.update(UPLOAD_FOLDER=str(tmp_path), METRICS_FLUSH_SECONDS=3600)
+    metrics = Metrics(app)
+
+    @app.route('/items/<int:item_id>')
+    def item(item_id):
+        return 'item'
+
+    metrics.client = app.test_client()
+    return metrics
+
+
+def test_counter_and_histogram_round_trip(metrics):
+    metrics.inc('pdf_operations_total', operation='merge', status='success')
+    metrics.inc('pdf_operation_pages_total', 12, operation='merge')
+    metrics.inc('pdf_operation_pages_total', 3, operation='merge')
+    for seconds in (0.003, 0.2, 0.2, 200):
+        metrics.observe('pdf_operation_duration_seconds', seconds, operation='merge')
+
+    samples, types = parse(metrics.render())
+
+    assert types['pdf_operations_total'] == 'counter'
+    assert types['pdf_operation_duration_seconds'] == 'histogram'
+    assert samples[('pdf_operations_total', (('operation', 'merge'), ('status', 'success')))] == 1
+    assert samples[('pdf_operation_pages_total', (('operation', 'merge'),))] == 15
+
+    merge = ('operation', 'merge')
+    buckets = {
+        dict(labels)['le']: value for (name, labels), value in samples.items()
+        if name == 'pdf_operation_duration_seconds_bucket'
+    }
+    assert len(buckets) == len(DURATION_BUCKETS) + 1
+    # Buckets are cumulative; 200s is only counted in +Inf
+    assert (buckets['0.005'], buckets['0.1'], buckets['0.25'], buckets['120'], buckets['+Inf']) == (1, 1, 3, 3, 4)
+    assert samples[('pdf_operation_duration_seconds_count', (merge,))] == 4
+    assert samples[('pdf_operation_duration_seconds_sum', (merge,))] == pytest.approx(200.403)
+
+
+def test_requests_are_counted_by_route(metrics):
+    for item_id in (1, 2):
+        assert metrics.client.get(f'/items/{item_id}').status_code == 200
+    metrics.client.get('/missing')
+
+    samples, _ = parse(metrics.render())
+    route = (('method', 'GET'), ('route', '/items/<int:item_id>'))
+    assert samples[('http_requests_total', route + (('status', '200'),))] == 2
+    assert samples[('http_requests_total', (('method', 'GET'), ('route', 'unmatched'), ('status', '404')))] == 1
+    assert samples[('http_request_duration_seconds_count', route)] == 2
+
+
+def test_snapshots_of_every_process_are_merged(metrics):
+    metrics.inc('pdf_operations_total', operation='split', status='success')
+    metrics.observe('pdf_operation_duration_seconds', 0.2, operation='split')
+    # As another web process would have written it
+    other = {
+        'counters': [
+            ['pdf_operations_total', [['operation', 'split'], ['status', 'success']], 2],
+            ['pdf_operations_total', [['operation', 'split'], ['status', 'failed']], 1]
+        ],
+        'histograms': [
+            ['pdf_operation_duration_seconds', [['operation', 'split']],
+             [0] * 8 + [1] * 6, 3.0, 1]
+        ]
+    }
+    with open(os.path.join(metrics.snapshot_dir, '1.json'), 'w') as f:
+        json.dump(other, f)
+
+    samples, _ = parse(metrics.render())
+    split = ('operation', 'split')
+    assert samples[('pdf_operations_total', (split, ('status', 'success')))] == 3
+    assert samples[('pdf_operations_total', (split, ('status', 'failed')))] == 1
+    assert samples[('pdf_operation_duration_seconds_count', (split,))] == 2
+    assert samples[('pdf_operation_duration_seconds_sum', (split,))] == pytest.approx(3.2)
+    assert samples[('pdf_operation_duration_seconds_bucket', (('le', '0.25'), split))] == 1
+    assert samples[('pdf_operation_duration_seconds_bucket', (('le', '5'), split))] == 2
+
+
+def test_unreadable_snapshot_is_skipped(metrics):
+    metrics.inc('pdf_operations_total', operation='merge', status='success')
+    with open(os.path.join(metrics.snapshot_dir, '1.json'), 'w') as f:
+        f.write('{"counters": [')
+
+    samples, _ = parse(metrics.render())
+    assert samples[('pdf_operations_total', (('operation', 'merge'), ('status', 'success')))] == 1
+
+
+def test_label_values_are_escaped(metrics):
+    metrics.inc('pdf_operations_total', operation='a "quoted"\\name', status='success')
+    samples, _ = parse(metrics.render())
+    assert (('operation', 'a \\"quoted\\"\\\\name'), ('status', 'success')) in {
+        labels for name, labels in samples if name == 'pdf_operations_total'
+    }
+
+
+def test_scrape_needs_the_token_when_set(app, monkeypatch):
+    client = app.test_client()
+    assert client.get('/metrics').status_code == 200
+
+    monkeypatch.setitem(app.config, 'METRICS_TOKEN', 'scrape-secret')
+    assert client.get('/metrics').status_code == 401
+    assert client.get('/metrics', headers={'Authorization': 'Bearer wrong'}).status_code == 401
+    response = client.get('/metrics', headers={'Authorization': 'Bearer scrape-secret'})
+    assert response.status_code == 200
+    samples, types = parse(response.get_data(as_text=True))
+    assert types['http_requests_total'] == 'counter'
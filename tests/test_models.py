@@ -0,0 +1,88 @@
+from datetime import datetime, timedelta
+import pytest
+from models import db, User, PDFOperation, USAGE_LIMITS, USAGE_PERIOD
+
+
+def consume(app, user_id):
+    with app.app_context():
+        consumed = User.consume_usage(user_id)
+        db.session.commit()
+        return consumed, db.session.get(User, user_id).usage_count
+
+
+def test_consume_usage_stops_at_the_limit(app, make_user):
+    limit = USAGE_LIMITS['free']
+    user_id = make_user('free', usage_count=limit - 1, usage_reset_date=datetime.utcnow())
+    assert consume(app, user_id) == (True, limit)
+    assert consume(app, user_id) == (False, limit)
+
+
+@pytest.mark.parametrize('tier', ['basic', 'pro'])
+def test_limit_depends_on_tier(app, make_user, tier):
+    user_id = make_user(tier, usage_count=USAGE_LIMITS['free'], usage_reset_date=datetime.utcnow())
+    assert consume(app, user_id)[0] is True
+
+
+def test_consume_usage_resets_after_the_period(app, make_user):
+    user_id = make_user('free', usage_count=USAGE_LIMITS['free'],
+                        usage_reset_date=datetime.utcnow() - USAGE_PERIOD - timedelta(minutes=1))
+    assert consume(app, user_id) == (True, 1)
+
+
+def test_consume_usage_is_not_committed(app, make_user):
+    user_id = make_user('free', usage_count=0, usage_reset_date=datetime.utcnow())
+    with app.app_context():
+        assert User.consume_usage(user_id)
+        db.session.rollback()
+        assert db.session.get(User, user_id).usage_count == 0
+
+
+@pytest.fixture
+def operations(app, client):
+    """25 operations of the client's user; several share a timestamp"""
+    start = datetime(2026, 1, 1)
+    with app.app_context():
+        for index in range(25):
+            db.session.add(PDFOperation(
+                user_id=client.user_id, operation_type='merge', file_count=index,
+                created_at=start + timedelta(seconds=index // 3)
+            ))
+        db.session.commit()
+        return [operation.id for operation in PDFOperation.query.filter_by(user_id=client.user_id)]
+
+
+def test_history_pages_cover_every_operation_once(app, client, operations):
+    with app.app_context():
+        seen, before, pages = [], None, 0
+        while True:
+            page, has_more = PDFOperation.history_page(client.user_id, 4, before)
+            pages += 1
+            assert len(page) == 4 or not has_more
+            seen.extend(page)
+            if not has_more:
+                break
+            before = (page[-1].created_at, page[-1].id)
+
+        assert pages == 7
+        assert sorted(operation.id for operation in seen) == sorted(operations)
+        keys = [(operation.created_at, operation.id) for operation in seen]
+        assert keys == sorted(keys, reverse=True)
+
+
+def test_history_is_per_user(app, client, operations, make_user):
+    with app.app_context():
+        assert PDFOperation.history_page(make_user(), 10) == ([], False)
+
+
+def test_history_api_cursor(client, operations):
+    seen, url = [], '/api/operations?limit=10'
+    while url:
+        data = client.get(url).get_json()
+        seen.extend(operation['id'] for operation in data['operations'])
+        url = f"/api/operations?limit=10&cursor={data['next_cursor']}" if data['next_cursor'] else None
+    assert sorted(seen) == sorted(operations)
+    assert len(seen) == len(set(seen))
+
+
+def test_history_api_rejects_bad_cursor(client):
+    assert client.get('/api/operations?cursor=!!!').status_code == 400
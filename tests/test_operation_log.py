@@ -0,0 +1,92 @@
+import os
+import json
+import time
+import subprocess
+import sys
+from datetime import datetime
+import pytest
+from flask import Flask
+from models import db, ensure_schema, PDFOperation, StatCounter
+from operation_log import OperationLogger
+
+
+@pytest.fixture
+def log_app(tmp_path):
+    app = Flask(__name__)
+    app.config.update(
+        SQLALCHEMY_DATABASE_URI=f"sqlite:///{tmp_path / 'log.db'}",
+        UPLOAD_FOLDER=str(tmp_path / 'uploads'),
+        OPERATION_LOG_BATCH_SIZE=100,
+        OPERATION_LOG_FLUSH_SECONDS=0.05
+    )
+    db.init_app(app)
+    with app.app_context():
+        ensure_schema()
+    os.makedirs(tmp_path / 'uploads' / 'oplog')
+    return app
+
+
+def dead_pid():
+    process = subprocess.Popen([sys.executable, '-c', 'pass'])
+    process.wait()
+    return process.pid
+
+
+def record(user_id, operation_type='compress'):
+    return {
+        'user_id': user_id, 'operation_type': operation_type, 'file_count': 1,
+        'success': True, 'duration_ms': 10, 'created_at': datetime.utcnow().isoformat()
+    }
+
+
+def write_spool(app, name, records):
+    path = os.path.join(app.config['UPLOAD_FOLDER'], 'oplog', name)
+    with open(path, 'w') as f:
+        f.write(''.join(json.dumps(entry) + '\n' for entry in records))
+    return path
+
+
+def operation_count(app):
+    with app.app_context():
+        return PDFOperation.query.count()
+
+
+def wait_for_count(app, count, timeout=5):
+    deadline = time.monotonic() + timeout
+    while operation_count(app) < count and time.monotonic() < deadline:
+        time.sleep(0.05)
+    return operation_count(app)
+
+
+def test_spool_of_dead_process_is_replayed(log_app):
+    pid = dead_pid()
+    path = write_spool(log_app, f'{pid}.jsonl', [record(1), record(2, 'merge')])
+    # Claimed by a replaying process that died before finishing
+    claimed = write_spool(log_app, f'{pid + 1}.jsonl.replay-{dead_pid()}', [record(3)])
+
+    OperationLogger(log_app)
+    assert wait_for_count(log_app, 3) == 3
+    assert not os.path.exists(path)
+    assert not os.path.exists(claimed)
+    with log_app.app_context():
+        assert db.session.get(StatCounter, 'total_operations').value == 3
+        assert {operation.operation_type for operation in PDFOperation.query} == {'compress', 'merge'}
+
+
+def test_spool_of_live_process_is_left_alone(log_app):
+    path = write_spool(log_app, f'{os.getppid()}.jsonl', [record(1)])
+    OperationLogger(log_app)
+    time.sleep(0.3)
+    assert operation_count(log_app) == 0
+    assert os.path.exists(path)
+
+
+def test_logged_records_are_flushed_and_unspooled(log_app):
+    logger = OperationLogger(log_app)
+    logger.log(1, 'split', file_count=1, success=False, duration_ms=5)
+    logger.log(1, 'merge', file_count=2, duration_ms=7)
+    logger.flush()
+
+    assert operation_count(log_app) == 2
+    spool = os.path.join(log_app.config['UPLOAD_FOLDER'], 'oplog', f'{os.getpid()}.jsonl')
+    assert os.path.getsize(spool) == 0
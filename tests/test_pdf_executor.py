@@ -0,0 +1,73 @@
+import os
+import pytest
+from concurrent.futures import Future
+from types import SimpleNamespace
+from PyPDF2 import PdfReader
+from pdf_executor import PDFExecutor
+from pdf_samples import reportlab_pdf
+
+
+def make_app(tmp_path, process_workers, job_workers):
+    return SimpleNamespace(config={
+        'PDF_PROCESS_WORKERS': process_workers,
+        'JOB_WORKERS': job_workers,
+        'PDF_TASK_CPU_SECONDS': 60,
+        'PDF_TASK_MEMORY_MB': 0,
+        'SPOOL_FOLDER': str(tmp_path / 'tmp'),
+        'PDF_OUTPUT_SPOOL_MB': 16
+    })
+
+
+class InlinePool:
+    """Runs tasks at once, counting those not yet collected through wait()"""
+
+    def __init__(self):
+        self.outstanding = set()
+        self.most_outstanding = 0
+
+    def submit(self, function, *args):
+        future = Future()
+        future.set_result(function(*args))
+        self.outstanding.add(future)
+        self.most_outstanding = max(self.most_outstanding, len(self.outstanding))
+        return future
+
+    def wait(self, futures, return_when=None):
+        # FIRST_COMPLETED hands back one task, as a single worker freeing up would
+        futures = set(futures)
+        done = futures if return_when is None else {next(iter(futures))}
+        self.outstanding -= done
+        return done, futures - done
+
+
+@pytest.mark.parametrize('process_workers, job_workers, expected', [
+    (8, 2, 4),
+    (4, 4, 1),
+    (2, 8, 1),
+])
+def test_merge_parallelism_is_a_fair_share(tmp_path, monkeypatch, process_workers, job_workers, expected):
+    monkeypatch.setattr(PDFExecutor, '_start_pool', lambda self: None)
+    executor = PDFExecutor(make_app(tmp_path, process_workers, job_workers))
+    assert executor.merge_parallelism == expected
+
+
+def test_merge_keeps_fragments_in_flight_within_limit(tmp_path, monkeypatch):
+    monkeypatch.setattr(PDFExecutor, '_start_pool', lambda self: None)
+    executor = PDFExecutor(make_app(tmp_path, 4, 2))
+    pool = InlinePool()
+    monkeypatch.setattr('pdf_executor.wait', pool.wait)
+    inputs = []
+    for number in range(6):
+        path = tmp_path / f'in{number}.pdf'
+        path.write_bytes(reportlab_pdf(number + 1))
+        inputs.append(str(path))
+    output = tmp_path / 'merged.pdf'
+
+    report, usage = executor._run_merge(pool, inputs, str(output), {})
+
+    # Two fragments at a time, plus the assembling task once they are done
+    assert pool.most_outstanding == 2
+    assert report['pages'] == 21
+    assert len(PdfReader(str(output)).pages) == 21
+    assert 'parse' in usage['timings']
+    assert os.listdir(tmp_path / 'tmp') == []
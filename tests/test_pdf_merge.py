@@ -0,0 +1,103 @@
+import io
+from PyPDF2 import PdfReader
+from pdf_merge import StreamingMerger, iter_fragment, read_fragment, write_fragment
+from pdf_samples import table_pdf
+
+PAGE = (
+    b'<</Type /Page /Parent 2 0 R /MediaBox [0 0 200 200] '
+    b'/Resources <</XObject <</Im0 5 0 R>>>> /Contents 6 0 R>>'
+)
+
+
+def stream(dictionary, data):
+    return b'<<%s /Length %d>>\nstream\n%s\nendstream' % (dictionary, len(data), data)
+
+
+def outlined_pdf(pixel=b'\x80'):
+    """Two pages drawing the same image, with a two-level outline"""
+    return table_pdf({
+        1: b'<</Type /Catalog /Pages 2 0 R /Outlines 7 0 R>>',
+        2: b'<</Type /Pages /Kids [3 0 R 4 0 R] /Count 2>>',
+        3: PAGE,
+        4: PAGE,
+        5: stream(b'/Type /XObject /Subtype /Image /Width 1 /Height 1 '
+                  b'/ColorSpace /DeviceGray /BitsPerComponent 8', pixel),
+        6: stream(b'', b'q 10 0 0 10 0 0 cm /Im0 Do Q'),
+        7: b'<</Type /Outlines /First 8 0 R /Last 9 0 R /Count 3>>',
+        8: b'<</Title (Intro) /Parent 7 0 R /Next 9 0 R /Dest [3 0 R /XYZ 0 200 0]>>',
+        9: b'<</Title (Chapter) /Parent 7 0 R /Prev 8 0 R /Dest [4 0 R /Fit] '
+           b'/First 10 0 R /Last 10 0 R /Count 1>>',
+        10: b'<</Title (Section) /Parent 9 0 R /Dest [4 0 R /XYZ 0 100 0]>>',
+    })
+
+
+def merge(sources):
+    output = io.BytesIO()
+    merger = StreamingMerger(output)
+    for source in sources:
+        merger.append(iter_fragment(PdfReader(io.BytesIO(source))))
+    merger.close()
+    return output.getvalue(), merger.dedup_stats
+
+
+def flatten(reader, outline):
+    """(title, page index) of each outline item, depth first"""
+    items = []
+    for entry in outline:
+        if isinstance(entry, list):
+            items.append(flatten(reader, entry))
+        else:
+            items.append((entry.title, reader.get_destination_page_number(entry)))
+    return items
+
+
+def test_pages_and_outline_survive():
+    data, _ = merge([outlined_pdf(), outlined_pdf()])
+
+    reader = PdfReader(io.BytesIO(data), strict=True)
+    assert len(reader.pages) == 4
+    assert flatten(reader, reader.outline) == [
+        ('Intro', 0), ('Chapter', 1), [('Section', 1)],
+        ('Intro', 2), ('Chapter', 3), [('Section', 3)],
+    ]
+    # Destination parameters are carried over with the page
+    assert list(reader.outline[2][0].dest_array[1:]) == ['/XYZ', 0, 100, 0]
+
+
+def test_identical_streams_are_written_once():
+    data, stats = merge([outlined_pdf(), outlined_pdf()])
+
+    # The second source's image and content stream are the first's
+    assert stats['objects_removed'] == 2
+    assert data.count(b'/Subtype /Image') == 1
+    reader = PdfReader(io.BytesIO(data), strict=True)
+    images = {page['/Resources']['/XObject'].raw_get('/Im0').idnum for page in reader.pages}
+    assert len(images) == 1
+
+
+def test_different_streams_are_kept():
+    data, stats = merge([outlined_pdf(b'\x80'), outlined_pdf(b'\x40')])
+
+    assert stats['objects_removed'] == 1
+    assert data.count(b'/Subtype /Image') == 2
+    reader = PdfReader(io.BytesIO(data), strict=True)
+    pixels = [page['/Resources']['/XObject']['/Im0'].get_data() for page in reader.pages]
+    assert pixels == [b'\x80', b'\x80', b'\x40', b'\x40']
+
+
+def test_saved_fragments_merge_the_same():
+    sources = [outlined_pdf(), outlined_pdf(b'\x40')]
+    fragments = []
+    for source in sources:
+        fragment = io.BytesIO()
+        write_fragment(iter_fragment(PdfReader(io.BytesIO(source))), fragment)
+        fragment.seek(0)
+        fragments.append(fragment)
+
+    output = io.BytesIO()
+    merger = StreamingMerger(output)
+    for fragment in fragments:
+        merger.append(read_fragment(fragment))
+    merger.close()
+
+    assert output.getvalue() == merge(sources)[0]
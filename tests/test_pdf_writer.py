@@ -0,0 +1,158 @@
+import io
+import pytest
+from PyPDF2 import PdfReader
+from pdf_utils import PDFProcessor
+from pdf_writer import IncrementalPdfWriter
+from preflight import preflight
+from pdf_samples import CATALOG, page_objects, reportlab_pdf, table_pdf, xref_stream_pdf
+
+
+def table_source():
+    return reportlab_pdf(3)
+
+
+def stream_source():
+    objects = {1: CATALOG, **page_objects(3), 6: b'<</Title (Original) /Author (Someone)>>'}
+    return xref_stream_pdf(objects, compressed={2, 6}, trailer=b'/Info 6 0 R')
+
+
+SOURCES = {'table': table_source, 'xref stream': stream_source}
+
+
+def strict_reader(data):
+    """Parse without PdfReader's repairs, so a broken table or /Prev chain fails"""
+    return PdfReader(io.BytesIO(data), strict=True)
+
+
+@pytest.mark.parametrize('kind', SOURCES)
+def test_rotation_is_appended_after_original_bytes(kind):
+    source = SOURCES[kind]()
+    output = PDFProcessor.rotate_pdf(io.BytesIO(source), 90).read()
+
+    assert output.startswith(source)
+    assert len(output) > len(source)
+    reader = strict_reader(output)
+    assert [page.rotation for page in reader.pages] == [90, 90, 90]
+    assert preflight(io.BytesIO(output))['pages'] == 3
+
+
+@pytest.mark.parametrize('kind', SOURCES)
+def test_new_section_matches_the_original_kind(kind):
+    source = SOURCES[kind]()
+    update = PDFProcessor.rotate_pdf(io.BytesIO(source), 90).read()[len(source):]
+    if kind == 'table':
+        assert b'\nxref\n0 1\n0000000000 65535 f \n' in update
+        assert b'/Type /XRef' not in update
+    else:
+        assert b'/Type /XRef' in update
+        assert b'\nxref\n' not in update
+
+
+@pytest.mark.parametrize('kind', SOURCES)
+def test_updates_chain_through_prev(kind):
+    source = SOURCES[kind]()
+    once = PDFProcessor.rotate_pdf(io.BytesIO(source), 90).read()
+    twice = PDFProcessor.rotate_pdf(io.BytesIO(once), 90).read()
+
+    assert twice.startswith(once)
+    assert twice.count(b'startxref') == 3
+    assert [page.rotation for page in strict_reader(twice).pages] == [180, 180, 180]
+
+
+@pytest.mark.parametrize('kind', SOURCES)
+def test_metadata_step_is_an_incremental_update(kind):
+    source = SOURCES[kind]()
+    steps = PDFProcessor.validate_pipeline([{'op': 'metadata', 'title': 'Quarterly report'}])
+    output = PDFProcessor.run_pipeline(io.BytesIO(source), steps).read()
+
+    assert output.startswith(source)
+    metadata = strict_reader(output).metadata
+    assert metadata['/Title'] == 'Quarterly report'
+    if kind == 'xref stream':
+        # Entries that weren't set are carried over
+        assert metadata['/Author'] == 'Someone'
+
+
+def test_metadata_and_rotation_in_one_update():
+    source = table_source()
+    steps = PDFProcessor.validate_pipeline([
+        {'op': 'rotate', 'rotation': 270, 'pages': [2]},
+        {'op': 'metadata', 'author': 'Pipeline'}
+    ])
+    output = PDFProcessor.run_pipeline(io.BytesIO(source), steps).read()
+
+    assert output.startswith(source)
+    assert output.count(b'startxref') == 2
+    reader = strict_reader(output)
+    assert [page.rotation for page in reader.pages] == [0, 270, 0]
+    assert reader.metadata['/Author'] == 'Pipeline'
+
+
+def test_metadata_with_compress_is_a_full_rewrite():
+    source = table_source()
+    steps = PDFProcessor.validate_pipeline([
+        {'op': 'metadata', 'title': 'Small'},
+        {'op': 'compress', 'quality': 'low'}
+    ])
+    output = PDFProcessor.run_pipeline(io.BytesIO(source), steps).read()
+
+    assert not output.startswith(source)
+    assert strict_reader(output).metadata['/Title'] == 'Small'
+
+
+@pytest.mark.parametrize('step', [
+    {'op': 'metadata'},
+    {'op': 'metadata', 'title': 5},
+    {'op': 'metadata', 'title': 'x' * 1001},
+])
+def test_invalid_metadata_steps(step):
+    with pytest.raises(ValueError):
+        PDFProcessor.validate_pipeline([step])
+
+
+def test_original_without_trailing_newline():
+    source = table_source().rstrip(b'\r\n')
+    output = PDFProcessor.rotate_pdf(io.BytesIO(source), 90).read()
+
+    assert output.startswith(source)
+    assert output[len(source):len(source) + 1] == b'\n'
+    assert [page.rotation for page in strict_reader(output).pages] == [90, 90, 90]
+
+
+def test_nothing_written_is_an_exact_copy():
+    source = table_pdf({1: CATALOG, **page_objects(1)})
+    output = io.BytesIO()
+    writer = IncrementalPdfWriter(io.BytesIO(source), output, 4)
+    writer.close(b'/Root 1 0 R')
+    assert output.getvalue() == source
+
+
+def test_unusable_startxref_writes_nothing():
+    source = table_source().rpartition(b'startxref')[0] + b'startxref\n12\n%%EOF\n'
+    output = io.BytesIO()
+    with pytest.raises(ValueError):
+        IncrementalPdfWriter(io.BytesIO(source), output, 10)
+    assert output.getvalue() == b''
+
+
+def test_damaged_source_falls_back_to_a_full_rewrite():
+    source = table_source().rpartition(b'startxref')[0] + b'startxref\n12\n%%EOF\n'
+    output = PDFProcessor.rotate_pdf(io.BytesIO(source), 90).read()
+
+    assert not output.startswith(source)
+    assert [page.rotation for page in strict_reader(output).pages] == [90, 90, 90]
+
+
+def test_new_objects_get_numbers_past_the_original_size():
+    source = table_pdf({1: CATALOG, **page_objects(2)})
+    output = io.BytesIO()
+    writer = IncrementalPdfWriter(io.BytesIO(source), output, 5)
+    number = writer.reserve()
+    writer.write_object(b'<</Title (Added)>>', number)
+    writer.close(b'/Root 1 0 R /Info %d 0 R' % number)
+
+    assert number == 5
+    data = output.getvalue()
+    assert data.startswith(source)
+    assert b'/Size 6' in data[len(source):]
+    assert strict_reader(data).metadata['/Title'] == 'Added'
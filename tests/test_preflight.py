@@ -0,0 +1,173 @@
+import io
+import pytest
+from PyPDF2 import PdfReader, PdfWriter
+from preflight import preflight, estimate_cost_ms, _parse_string
+from pdf_samples import CATALOG, append_update, page_objects, reportlab_pdf, table_pdf, xref_stream_pdf
+
+
+def reader_pages(data):
+    return len(PdfReader(io.BytesIO(data)).pages)
+
+
+def check(data, **kwargs):
+    return preflight(io.BytesIO(data), **kwargs)
+
+
+@pytest.mark.parametrize('pages', [1, 3, 25])
+def test_classic_table_page_count_matches_reader(pages):
+    data = reportlab_pdf(pages)
+    result = check(data)
+    assert result['pages'] == reader_pages(data) == pages
+    assert result['damaged'] is False
+    assert result['error'] is None
+    assert result['encrypted'] is False
+
+
+def test_xref_stream_with_object_stream():
+    objects = {1: CATALOG, **page_objects(4)}
+    objects[7] = b'<</Title <FEFF00480069>>>'
+    data = xref_stream_pdf(objects, compressed={1, 2, 7}, trailer=b'/Info 7 0 R')
+    result = check(data, info=True)
+    assert result['pages'] == reader_pages(data) == 4
+    assert result['version'] == '1.5'
+    assert result['info'] == {'/Title': 'Hi'}
+    assert result['damaged'] is False
+
+
+def test_prev_chain_uses_newest_definitions():
+    original = table_pdf({1: CATALOG, **page_objects(2)}, trailer=b'/Info 5 0 R')
+    updated = append_update(original, {
+        2: b'<</Type /Pages /Kids [3 0 R 4 0 R 6 0 R] /Count 3>>',
+        6: b'<</Type /Page /Parent 2 0 R /MediaBox [0 0 200 200]>>'
+    })
+    twice = append_update(updated, {5: b'<</Title (Second)>>'})
+
+    assert check(original)['pages'] == reader_pages(original) == 2
+    assert check(updated)['pages'] == reader_pages(updated) == 3
+    result = check(twice, info=True)
+    assert result['pages'] == reader_pages(twice) == 3
+    assert result['info'] == {'/Title': 'Second'}
+
+
+def test_prev_loop_is_damaged():
+    data = table_pdf({1: CATALOG, **page_objects(1)})
+    xref = int(data.rsplit(b'startxref', 1)[1].split()[0])
+    looped = data.replace(b'/Root 1 0 R', b'/Root 1 0 R /Prev %d' % xref)
+    result = check(looped)
+    assert result['damaged'] is True
+    assert result['error'] is None
+
+
+def test_incremental_update_of_xref_stream_file():
+    data = xref_stream_pdf({1: CATALOG, **page_objects(2)}, compressed={2})
+    updated = append_update(data, {3: b'<</Type /Page /Parent 2 0 R /MediaBox [0 0 200 200] /Rotate 90>>'})
+    assert check(updated)['pages'] == reader_pages(updated) == 2
+
+
+def test_encrypted_file_is_rejected():
+    writer = PdfWriter()
+    writer.append(PdfReader(io.BytesIO(reportlab_pdf(2))))
+    writer.encrypt('secret')
+    output = io.BytesIO()
+    writer.write(output)
+
+    result = check(output.getvalue())
+    assert result['encrypted'] is True
+    assert result['error'] == 'Password-protected PDFs are not supported'
+
+
+@pytest.mark.parametrize('data, error', [
+    (b'', 'The file is empty'),
+    (b'\xff\xd8\xff\xe0 not a pdf', 'The file is not a PDF'),
+    (b'%PDF-1.4\n1 0 obj\n<<>>\nendobj\n', 'The file is truncated or damaged'),
+])
+def test_unusable_files_have_an_error(data, error):
+    assert check(data)['error'] == error
+
+
+def test_truncated_file():
+    data = reportlab_pdf(3)
+    result = check(data[:len(data) // 2])
+    assert result['damaged'] is True
+    assert result['error'] == 'The file is truncated or damaged'
+    assert result['pages'] is None
+
+
+def test_wrong_startxref_is_damaged_but_repairable():
+    data = reportlab_pdf(3)
+    head = data.rpartition(b'startxref')[0]
+    damaged = head + b'startxref\n9\n%%EOF\n'
+
+    result = check(damaged)
+    assert result['damaged'] is True
+    assert result['pages'] is None
+    assert result['error'] is None
+    # PdfReader rebuilds the table by scanning, which is what the worker will do
+    assert reader_pages(damaged) == 3
+
+
+def test_empty_page_tree():
+    data = table_pdf({1: CATALOG, 2: b'<</Type /Pages /Kids [] /Count 0>>'})
+    assert check(data)['error'] == 'The PDF has no pages'
+
+
+def test_non_integer_count_is_damaged():
+    data = table_pdf({1: CATALOG, 2: b'<</Type /Pages /Kids [] /Count true>>'})
+    result = check(data)
+    assert result['damaged'] is True
+    assert result['pages'] is None
+
+
+def test_deep_nesting_does_not_recurse_forever():
+    objects = {1: CATALOG, **page_objects(1), 4: b'[' * 5000 + b']' * 5000}
+    data = table_pdf(objects, trailer=b'/Info 4 0 R')
+    result = check(data, info=True)
+    assert result['pages'] == 1
+
+
+def test_file_position_is_kept():
+    stream = io.BytesIO(reportlab_pdf(2))
+    stream.seek(5)
+    preflight(stream)
+    assert stream.tell() == 5
+
+
+def test_path_input(tmp_path):
+    path = tmp_path / 'doc.pdf'
+    path.write_bytes(reportlab_pdf(2))
+    assert preflight(str(path))['pages'] == 2
+
+
+@pytest.mark.parametrize('literal, expected', [
+    (b'plain)', b'plain'),
+    (b'a (nested) b)', b'a (nested) b'),
+    (b'\\n\\r\\t\\b\\f)', b'\n\r\t\b\f'),
+    (b'\\(\\)\\\\)', b'()\\'),
+    (b'\\101\\60\\0)', b'A0\x00'),
+    (b'\\1011)', b'A1'),
+    (b'\\8\\9)', b'89'),
+    (b'\\q)', b'q'),
+    (b'line\\\ncontinued)', b'linecontinued'),
+    (b'line\\\r\ncontinued)', b'linecontinued'),
+    (b'\\777)', b'\xff'),
+])
+def test_string_escapes(literal, expected):
+    value, position = _parse_string(literal, 0)
+    assert value == expected
+    assert position == len(literal)
+
+
+def test_unknown_escape_in_info_is_read():
+    objects = {1: CATALOG, **page_objects(1), 4: b'<</Title (a\\8b\\9)>>'}
+    result = check(table_pdf(objects, trailer=b'/Info 4 0 R'), info=True)
+    assert result['info'] == {'/Title': 'a8b9'}
+    assert result['damaged'] is False
+
+
+def test_estimate_cost_grows_with_pages_and_size():
+    small = estimate_cost_ms('compress', 1, 10 * 1024)
+    assert estimate_cost_ms('compress', 300, 10 * 1024) > small
+    assert estimate_cost_ms('compress', 1, 50 * 1024 * 1024) > small
+    assert estimate_cost_ms('compress', 1, 10 * 1024, damaged=True) > small
+    # Unknown operations cost what opening the document does
+    assert estimate_cost_ms('unknown', 10, 1024) == estimate_cost_ms(None, 10, 1024)
@@ -0,0 +1,43 @@
+import os
+from types import SimpleNamespace
+from profiling import ProfileStore, profile_call
+
+
+def make_store(upload_folder, keep=2):
+    return ProfileStore(SimpleNamespace(config={
+        'UPLOAD_FOLDER': upload_folder,
+        'PROFILE_KEEP': keep,
+        'PROFILE_SLOW_SECONDS': 0
+    }))
+
+
+def record(store, job_id, **details):
+    profile_id, path = store.new_path(job_id)
+    profile_call(sum, ([1, 2, 3],), path)
+    store.save(profile_id, **details)
+    return profile_id
+
+
+def test_profile_dir_is_absolute(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    store = make_store('uploads')
+    assert store.profile_dir == str(tmp_path / 'uploads' / 'profiles')
+
+
+def test_profile_is_written_and_listed(tmp_path):
+    store = make_store(str(tmp_path))
+    profile_id = record(store, 'a' * 32, operation_type='merge', reason='requested')
+
+    assert sorted(os.listdir(store.profile_dir)) == [f'{profile_id}.{extension}' for extension in ('json', 'prof', 'txt')]
+    with open(os.path.join(store.profile_dir, f'{profile_id}.txt')) as f:
+        assert f.read().startswith('Peak traced memory')
+    [profile] = store.list()
+    assert (profile['id'], profile['operation_type'], profile['reason']) == (profile_id, 'merge', 'requested')
+
+
+def test_only_the_newest_are_kept(tmp_path):
+    store = make_store(str(tmp_path), keep=2)
+    ids = [record(store, f'{number}' * 32) for number in range(3)]
+
+    assert [profile['id'] for profile in store.list()] == ids[:0:-1]
+    assert not any(name.startswith(ids[0]) for name in os.listdir(store.profile_dir))
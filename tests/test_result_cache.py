@@ -0,0 +1,37 @@
+from types import SimpleNamespace
+import result_cache
+from result_cache import ResultCache, code_fingerprint
+
+
+def make_cache(tmp_path):
+    return ResultCache(SimpleNamespace(config={'UPLOAD_FOLDER': str(tmp_path), 'RESULT_CACHE_MAX_MB': 1}))
+
+
+def test_result_round_trip(tmp_path):
+    cache = make_cache(tmp_path)
+    source = tmp_path / 'in.pdf'
+    source.write_bytes(b'%PDF-1.4 input')
+    result = tmp_path / 'result'
+    result.write_bytes(b'output')
+
+    key = cache.key('compress', [str(source)], {'quality': 'low'})
+    assert cache.get(key, str(tmp_path / 'missed')) == (False, None)
+    cache.put(key, str(result), {'pages': 1})
+    assert cache.get(key, str(tmp_path / 'copy')) == (True, {'pages': 1})
+    assert (tmp_path / 'copy').read_bytes() == b'output'
+
+
+def test_key_depends_on_code_fingerprint(tmp_path, monkeypatch):
+    source = tmp_path / 'in.pdf'
+    source.write_bytes(b'%PDF-1.4 input')
+    before = make_cache(tmp_path).key('compress', [str(source)], {})
+
+    monkeypatch.setattr(result_cache, 'CACHE_VERSION', result_cache.CACHE_VERSION + 1)
+    assert make_cache(tmp_path).key('compress', [str(source)], {}) != before
+
+
+def test_fingerprint_covers_output_modules(tmp_path, monkeypatch):
+    before = code_fingerprint()
+    assert code_fingerprint() == before
+    monkeypatch.setattr(result_cache, 'OUTPUT_MODULES', result_cache.OUTPUT_MODULES[:-1])
+    assert code_fingerprint() != before
@@ -0,0 +1,45 @@
+import pytest
+from flask import Flask
+import rollups
+from models import db, ensure_schema, StatCounter
+
+
+@pytest.fixture
+def app(tmp_path):
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = f"sqlite:///{tmp_path / 'rollups.db'}"
+    db.init_app(app)
+    with app.app_context():
+        ensure_schema()
+        yield app
+
+
+def test_backfill_runs_once(app):
+    rollups.ensure_rollups()
+    assert db.session.get(StatCounter, 'total_users').value == 0
+
+    db.session.get(StatCounter, 'total_users').value = 7
+    db.session.commit()
+    rollups.ensure_rollups()
+    assert db.session.get(StatCounter, 'total_users').value == 7
+
+
+def test_backfill_lost_to_another_process_is_not_an_error(app, monkeypatch):
+    def losing_rebuild():
+        # Another process commits its backfill first, and ours conflicts with it
+        db.session.add(StatCounter(name='total_users', value=0))
+        db.session.commit()
+        raise Exception("Error rebuilding rollups: UNIQUE constraint failed")
+
+    monkeypatch.setattr(rollups, 'rebuild_rollups', losing_rebuild)
+    rollups.ensure_rollups()
+    assert db.session.get(StatCounter, 'total_users') is not None
+
+
+def test_failed_backfill_is_raised(app, monkeypatch):
+    def failing_rebuild():
+        raise Exception("Error rebuilding rollups: database is locked")
+
+    monkeypatch.setattr(rollups, 'rebuild_rollups', failing_rebuild)
+    with pytest.raises(Exception, match='database is locked'):
+        rollups.ensure_rollups()
@@ -0,0 +1,61 @@
+import pytest
+from flask import Flask
+from sqlalchemy import inspect, text
+from sqlalchemy.exc import OperationalError
+import models
+from models import db, ensure_schema
+
+
+@pytest.fixture
+def app(tmp_path):
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = f"sqlite:///{tmp_path / 'schema.db'}"
+    db.init_app(app)
+    with app.app_context():
+        yield app
+
+
+def job_columns():
+    return {column['name'] for column in inspect(db.engine).get_columns('jobs')}
+
+
+def test_adds_missing_columns_and_indexes(app):
+    db.session.execute(text('CREATE TABLE jobs (id VARCHAR(32) PRIMARY KEY, user_id INTEGER, status VARCHAR(20))'))
+    db.session.commit()
+
+    ensure_schema()
+    assert {'params', 'report', 'finished_at'} <= job_columns()
+    assert inspect(db.engine).get_indexes('pdf_operations')
+    # A second run has nothing left to do
+    ensure_schema()
+
+
+def test_change_made_by_another_process_is_skipped(app, monkeypatch):
+    db.session.execute(text('CREATE TABLE jobs (id VARCHAR(32) PRIMARY KEY, user_id INTEGER, status VARCHAR(20))'))
+    db.session.commit()
+    real_column_names = models._column_names
+    checked = set()
+
+    def stale_column_names(table):
+        names = real_column_names(table)
+        if table.name == 'jobs' and 'jobs' not in checked:
+            checked.add('jobs')
+            # Another process adds a column right after this one looked
+            db.session.execute(text('ALTER TABLE jobs ADD COLUMN params TEXT'))
+            db.session.commit()
+        return names
+
+    monkeypatch.setattr(models, '_column_names', stale_column_names)
+    ensure_schema()
+    assert 'params' in job_columns()
+
+
+def test_failure_that_left_the_change_unmade_is_raised(app, monkeypatch):
+    def failing_ddl(statement):
+        raise OperationalError(statement, {}, Exception('database is locked'))
+
+    db.session.execute(text('CREATE TABLE jobs (id VARCHAR(32) PRIMARY KEY, user_id INTEGER, status VARCHAR(20))'))
+    db.session.commit()
+    monkeypatch.setattr(models, '_execute_ddl', failing_ddl)
+    with pytest.raises(OperationalError):
+        ensure_schema()
@@ -0,0 +1,87 @@
+import io
+import zlib
+from PyPDF2 import PdfReader, PdfWriter
+from stream_dedup import dedup_streams
+from pdf_samples import CATALOG, table_pdf
+
+PIXELS = zlib.compress(bytes(range(64)))
+FLATE = b'/Filter /FlateDecode'
+
+
+def image(entries=FLATE, data=PIXELS):
+    return b'<</Type /XObject /Subtype /Image /Width 8 /Height 8 /ColorSpace /DeviceGray ' \
+           b'/BitsPerComponent 8 %s /Length %d>>\nstream\n%s\nendstream' % (entries, len(data), data)
+
+
+def document(images, extra=None):
+    """
+    One page per image, drawing it as /Im0
+    Args:
+        images: Image object bodies, numbered from 10
+        extra: Object number -> body of other objects, e.g. soft masks numbered from 20
+    """
+    kids = [3 + index for index in range(len(images))]
+    objects = {1: CATALOG, 2: b'<</Type /Pages /Kids [%s] /Count %d>>' % (
+        b' '.join(b'%d 0 R' % kid for kid in kids), len(kids)
+    )}
+    for index, body in enumerate(images):
+        objects[kids[index]] = (
+            b'<</Type /Page /Parent 2 0 R /MediaBox [0 0 200 200] '
+            b'/Resources <</XObject <</Im0 %d 0 R>>>>>>' % (10 + index)
+        )
+        objects[10 + index] = body
+    objects.update(extra or {})
+    return table_pdf(objects)
+
+
+def dedup(source):
+    writer = PdfWriter()
+    for page in PdfReader(io.BytesIO(source)).pages:
+        writer.add_page(page)
+    stats = dedup_streams(writer)
+    output = io.BytesIO()
+    writer.write(output)
+    return PdfReader(io.BytesIO(output.getvalue()), strict=True), stats
+
+
+def images(reader):
+    return [page['/Resources']['/XObject'].raw_get('/Im0') for page in reader.pages]
+
+
+def test_only_identical_streams_collapse():
+    reader, stats = dedup(document([
+        image(),
+        image(),
+        # The same bytes decoded differently are different images
+        image(FLATE + b' /DecodeParms <</Predictor 1>>'),
+        image(b''),
+        image(b'/Filter [/FlateDecode]'),
+    ]))
+
+    assert stats == {'objects_removed': 1, 'bytes_removed': len(PIXELS)}
+    numbers = [reference.idnum for reference in images(reader)]
+    assert numbers[0] == numbers[1]
+    assert len(set(numbers)) == 4
+    assert images(reader)[0].get_object().get_data() == bytes(range(64))
+    assert images(reader)[3].get_object().get_data() == PIXELS
+
+
+def test_nothing_to_collapse():
+    reader, stats = dedup(document([image(), image(data=zlib.compress(bytes(64)))]))
+
+    assert stats == {'objects_removed': 0, 'bytes_removed': 0}
+    assert len({reference.idnum for reference in images(reader)}) == 2
+
+
+def test_streams_collapse_once_their_masks_have():
+    mask = image(data=zlib.compress(bytes([255]) * 64))
+    reader, stats = dedup(document(
+        [image(FLATE + b' /SMask 20 0 R'), image(FLATE + b' /SMask 21 0 R')],
+        {20: mask, 21: mask}
+    ))
+
+    # The masks first, then the images that now point at the same mask
+    assert stats['objects_removed'] == 2
+    [first, second] = images(reader)
+    assert first.idnum == second.idnum
+    assert first.get_object()['/SMask'].get_object().get_data() == bytes([255]) * 64
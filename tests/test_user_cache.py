@@ -0,0 +1,90 @@
+from contextlib import contextmanager
+import pytest
+import stripe
+from sqlalchemy import event
+
+
+@pytest.fixture
+def cache(app):
+    from app import user_cache
+    with app.app_context():
+        yield user_cache
+
+
+@contextmanager
+def count_queries(statements):
+    from models import db
+
+    def record(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    event.listen(db.engine, 'before_cursor_execute', record)
+    try:
+        yield
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', record)
+
+
+def test_cached_identity_is_served_without_a_query(cache, make_user):
+    from models import db
+    user_id = make_user(tier='basic')
+    cache.load(user_id)
+    db.session.remove()
+
+    statements = []
+    with count_queries(statements):
+        user = cache.load(user_id)
+        assert (user.id, user.subscription_tier) == (user_id, 'basic')
+    assert statements == []
+
+    # Anything else loads the row, once
+    with count_queries(statements):
+        assert user.usage_count == 0
+        assert user.can_perform_operation()
+    assert len(statements) == 1
+
+
+def test_attribute_write_reaches_the_row(cache, make_user):
+    from models import db, User
+    user_id = make_user(tier='free')
+    user = cache.load(user_id)
+    db.session.remove()
+    user = cache.load(user_id)
+
+    user.subscription_tier = 'pro'
+    db.session.commit()
+    db.session.remove()
+
+    assert db.session.get(User, user_id).subscription_tier == 'pro'
+    # The write dropped the entry, so the next load sees it
+    assert cache.load(user_id).subscription_tier == 'pro'
+
+
+def test_webhook_drops_the_cached_tier(app, client, monkeypatch):
+    from models import db, User
+    with app.app_context():
+        db.session.get(User, client.user_id).stripe_subscription_id = 'sub_cached'
+        db.session.commit()
+    assert client.get('/api/usage').get_json()['subscription_tier'] == 'pro'
+
+    monkeypatch.setattr(stripe.Webhook, 'construct_event', lambda *args: {
+        'type': 'customer.subscription.deleted',
+        'data': {'object': {'id': 'sub_cached'}}
+    })
+    assert client.post('/webhook', data=b'{}').status_code == 200
+
+    assert client.get('/api/usage').get_json()['subscription_tier'] == 'free'
+
+
+def test_deleted_user_is_logged_out(app, client):
+    from models import db, User
+    assert client.get('/api/usage').status_code == 200
+    with app.app_context():
+        db.session.delete(db.session.get(User, client.user_id))
+        db.session.commit()
+
+    # Still cached, but the row it falls back to is gone
+    response = client.get('/api/usage')
+    assert response.status_code == 302
+    assert '/login' in response.headers['Location']
+    assert client.get('/dashboard').status_code == 302
@@ -0,0 +1,40 @@
+import os
+import tempfile
+from flask import Request, current_app
+
+# Uploads up to this size stay in memory, as with Werkzeug's default
+SMALL_UPLOAD_BYTES = 500 * 1024
+
+
+class SpooledUploadRequest(Request):
+    """
+    Request that spools large file uploads to named temporary files in
+    SPOOL_FOLDER instead of the system temp directory, which is often a
+    RAM-backed tmpfs. Being on the same filesystem as the job storage lets
+    store_upload() link them into place instead of copying them.
+    """
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        if total_content_length is not None and total_content_length <= SMALL_UPLOAD_BYTES:
+            return super()._get_file_stream(total_content_length, content_type, filename, content_length)
+        return tempfile.NamedTemporaryFile('wb+', prefix='upload-', dir=current_app.config['SPOOL_FOLDER'])
+
+
+def store_upload(file, path):
+    """
+    Save an uploaded file
+    Args:
+        file: Uploaded file object
+        path: Where to save it
+    """
+    spooled_path = getattr(file.stream, 'name', None)
+    if isinstance(spooled_path, str) and os.path.isfile(spooled_path):
+        file.stream.flush()
+        try:
+            # The spool file is deleted when the request ends; the link keeps the data
+            os.link(spooled_path, path)
+            return
+        except OSError:
+            # Different filesystem, or links not supported
+            pass
+    file.save(path)
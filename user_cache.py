@@ -0,0 +1,112 @@
+import time
+import threading
+from collections import OrderedDict
+from flask import abort, current_app
+from flask_login import UserMixin, logout_user
+from models import db, User
+
+# Fields served from the cache; anything else (usage counters, password hash, ...) is read fresh
+CACHED_FIELDS = (
+    'id', 'email', 'created_at', 'subscription_tier', 'subscription_status',
+    'stripe_customer_id', 'stripe_subscription_id'
+)
+
+
+class CachedUser(UserMixin):
+    """
+    Stand-in for User built from cached identity fields. Reading any other
+    attribute or calling a User method (e.g. can_perform_operation) loads the
+    real row once for the request and delegates to it; assigning to an
+    attribute writes through to the row and drops the cache entry. If the
+    row was deleted since it was cached, the user is logged out and the
+    request answered as Flask-Login answers an anonymous one.
+    """
+
+    def __init__(self, snapshot, cache):
+        object.__setattr__(self, '_snapshot', snapshot)
+        object.__setattr__(self, '_cache', cache)
+        object.__setattr__(self, '_user', None)
+
+    def _load(self):
+        if self._user is None:
+            user = db.session.get(User, self._snapshot['id'])
+            if user is None:
+                self._cache.invalidate(self._snapshot['id'])
+                logout_user()
+                # A redirect to the login page, or a 401 where there is none
+                abort(current_app.login_manager.unauthorized())
+            object.__setattr__(self, '_user', user)
+        return self._user
+
+    def __getattr__(self, name):
+        # Once the row is loaded it is the source of truth, including unsaved changes
+        if self._user is None and name in self._snapshot:
+            return self._snapshot[name]
+        return getattr(self._load(), name)
+
+    def __setattr__(self, name, value):
+        setattr(self._load(), name, value)
+        self._cache.invalidate(self._snapshot['id'])
+
+    def get_usage_limit(self):
+        return User.get_usage_limit(self)
+
+    def __repr__(self):
+        return f'<User {self.email}>'
+
+
+class UserCache:
+    """
+    Per-process TTL/LRU cache of user identity fields for Flask-Login's
+    user_loader, so read-only requests don't need a users lookup. Entries
+    are dropped when a subscription changes in this process and expire
+    after USER_CACHE_TTL_SECONDS, which bounds staleness in other processes.
+    """
+
+    def __init__(self, app=None):
+        self.ttl = 0
+        self.max_size = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.ttl = app.config['USER_CACHE_TTL_SECONDS']
+        self.max_size = app.config['USER_CACHE_SIZE']
+
+    def load(self, user_id):
+        """
+        Get a user for the current request
+        Args:
+            user_id: ID of the user
+        Returns:
+            CachedUser, or None if there is no such user
+        """
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is not None and entry[0] > now:
+                self._entries.move_to_end(user_id)
+                return CachedUser(entry[1], self)
+
+        user = db.session.get(User, user_id)
+        if user is None:
+            return None
+
+        snapshot = {field: getattr(user, field) for field in CACHED_FIELDS}
+        if self.ttl > 0:
+            with self._lock:
+                self._entries[user_id] = (now + self.ttl, snapshot)
+                self._entries.move_to_end(user_id)
+                while len(self._entries) > self.max_size:
+                    self._entries.popitem(last=False)
+
+        cached = CachedUser(snapshot, self)
+        # Already loaded, so reuse the row rather than fetching it again
+        object.__setattr__(cached, '_user', user)
+        return cached
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self._entries.pop(user_id, None)